@@ -1,13 +1,26 @@
 import datetime
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session, joinedload
-from typing import List
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response, status
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from typing import List, Optional
 from database import models, schemas, db as database
-from api.auth.utils import get_current_user
+from api.auth.utils import Principal, get_current_user
+from api.common.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, keyset_page
+from api.common.cache import MISSING
+from api.common.fields import FieldSet, page_model
+from api.common.responses import EncodedPayload, json_response, type_adapter
+from api.account.batch import apply_operations
+from api.account.catalog import catalog_cache, catalog_headers, catalog_version, etag_matches, make_etag, search_cache
+from api.account.search import search_products
+from api.account.typeahead import TYPEAHEAD_MAX_RESULTS, typeahead
 from api.account.utils import (
-    add_to_wishlist, remove_from_wishlist, add_to_cart, remove_from_cart, send_order_confirmation_email, send_promo_email
+    add_to_wishlist, remove_from_wishlist, add_to_cart, remove_from_cart, load_cart, load_wishlist,
+    queue_order_confirmation_email, queue_promo_email
 )
 from database.schemas import OrderItemResponse, OrderResponse, Product as ProductSchema, ReferralRequest
+from database.loaders import Loaders, get_loaders
 from database.models import Product
 from hashids import Hashids
 
@@ -20,11 +33,11 @@ router = APIRouter()
 #-----------------------------------#
 
 @router.get("/details", response_model=schemas.User)
-def get_user_details(current_user: models.User = Depends(get_current_user)):
+async def get_user_details(current_user: Principal = Depends(get_current_user)):
     return current_user
 
 @router.get("/me", response_model=schemas.User)
-def get_user_me(current_user: models.User = Depends(get_current_user)):
+async def get_user_me(current_user: Principal = Depends(get_current_user)):
     return current_user
 
 #-----------------------------------#
@@ -32,15 +45,15 @@ def get_user_me(current_user: models.User = Depends(get_current_user)):
 #-----------------------------------#
 
 @router.get("/address", response_model=schemas.Address)
-def get_address(db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
-    address = db.query(models.Address).filter(models.Address.user_id == current_user.id).first()
+async def get_address(db: AsyncSession = Depends(database.get_read_db), current_user: Principal = Depends(get_current_user)):
+    address = await db.scalar(select(models.Address).filter(models.Address.user_id == current_user.id))
     if not address:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Address not found")
     return address
 
 @router.post("/address", response_model=schemas.Address)
-def add_or_update_address(address: schemas.AddressBase, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
-    existing_address = db.query(models.Address).filter(models.Address.user_id == current_user.id).first()
+async def add_or_update_address(address: schemas.AddressBase, db: AsyncSession = Depends(database.get_db), current_user: Principal = Depends(get_current_user)):
+    existing_address = await db.scalar(select(models.Address).filter(models.Address.user_id == current_user.id))
     if existing_address:
         # Update logic if an address already exists
         existing_address.street_address = address.street_address
@@ -48,93 +61,78 @@ def add_or_update_address(address: schemas.AddressBase, db: Session = Depends(da
         existing_address.state = address.state
         existing_address.postal_code = address.postal_code
         existing_address.country = address.country
-        db.commit()
-        db.refresh(existing_address)
+        await db.commit()
+        await db.refresh(existing_address)
         return existing_address
     else:
         # Create new address if none exists
         new_address = models.Address(**address.model_dump(), user_id=current_user.id)
         db.add(new_address)
-        db.commit()
-        db.refresh(new_address) 
+        await db.commit()
+        await db.refresh(new_address) 
         return new_address
 
 
 @router.delete("/address", response_model=schemas.Message)
-def delete_address(db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
-    address = db.query(models.Address).filter(models.Address.user_id == current_user.id).first()
+async def delete_address(db: AsyncSession = Depends(database.get_db), current_user: Principal = Depends(get_current_user)):
+    address = await db.scalar(select(models.Address).filter(models.Address.user_id == current_user.id))
     if not address:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Address not found")
-    db.delete(address)
-    db.commit()
+    await db.delete(address)
+    await db.commit()
     return {"message": "Address deleted successfully"}
 
 #-----------------------------------#
 #         ORDER ROUTES              #
 #-----------------------------------#
 
-@router.get("/orders", response_model=List[schemas.Order])
-def get_orders(
-    db: Session = Depends(database.get_db),
-    current_user: models.User = Depends(get_current_user)
+@router.get("/orders", response_model=schemas.OrderPage)
+async def get_orders(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    order_status: Optional[schemas.OrderStatusEnum] = Query(None, alias="status"),
+    created_from: Optional[datetime.datetime] = None,
+    created_to: Optional[datetime.datetime] = None,
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return, e.g. id,status,items.product.name"),
+    db: AsyncSession = Depends(database.get_read_db),
+    current_user: Principal = Depends(get_current_user)
 ):
     """
-    Retrieve all orders for the authenticated user, including order items
-    and product details.
+    Retrieve a page of the authenticated user's orders, newest first,
+    including order items and product details. Pass the returned
+    next_cursor as 'after' (or prev_cursor as 'before') to move between pages.
+    With fields, only those columns and relationships are loaded and returned.
     """
+    # The cursor needs id and created_at whatever fields are asked for
+    fieldset = FieldSet(schemas.Order, models.Order, fields, always=("id", "created_at"))
     try:
-        # Query orders with eager loading of items and their associated products
-        orders = (
-            db.query(models.Order)
+        # Query orders with eager loading of the items and products the response includes
+        query = (
+            select(models.Order)
             .filter(models.Order.user_id == current_user.id)
-            .options(
-                joinedload(models.Order.items)
-                .joinedload(models.OrderItem.product)
-                .joinedload(models.Product.category)  # Include category if needed
-            )
-            .all()
+            .options(*fieldset.options)
+        )
+        if order_status:
+            query = query.filter(models.Order.status == order_status)
+        if created_from:
+            query = query.filter(models.Order.created_at >= created_from)
+        if created_to:
+            query = query.filter(models.Order.created_at < created_to)
+
+        orders, next_cursor, prev_cursor = await keyset_page(
+            db, query, models.Order.created_at, models.Order.id, limit, after=after, before=before
         )
 
-        if not orders:
-            return []  # Return an empty list instead of raising an HTTPException
-
-        # Serialize orders into response format
-        serialized_orders = [
-            schemas.Order(
-                id=order.id,
-                user_id=order.user_id,
-                status=order.status.value,
-                total_price=order.total_price,
-                items=[
-                    schemas.OrderItem(
-                        id=item.id,
-                        product=schemas.Product(
-                            id=item.product.id,
-                            name=item.product.name,
-                            description=item.product.description,  # Optional in schema
-                            price=item.product.price,
-                            created_at=item.product.created_at,
-                            updated_at=item.product.updated_at,
-                            category=schemas.Category(
-                                id=item.product.category.id,
-                                name=item.product.category.name
-                            ) if item.product.category else None,
-                        ),
-                        quantity=item.quantity,
-                        color=item.color,
-                        size=item.size.value if hasattr(item.size, 'value') else item.size,
-                        price=item.price,
-                    )
-                    for item in order.items
-                ],
-                created_at=order.created_at,
-                updated_at=order.updated_at,
-            )
-            for order in orders
-        ]
-
-        return serialized_orders
+        # Validated from the ORM rows and encoded in one pass
+        return json_response(
+            page_model(schemas.OrderPage, fieldset.schema),
+            {"items": orders, "next_cursor": next_cursor, "prev_cursor": prev_cursor},
+            from_attributes=True,
+        )
 
+    except HTTPException:
+        raise
     except Exception as e:
         # Handle unexpected errors gracefully
         raise HTTPException(
@@ -144,19 +142,18 @@ def get_orders(
 
 
 @router.get("/orders/{order_id}", response_model=OrderResponse)
-def get_order(order_id: str, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
+async def get_order(order_id: str, db: AsyncSession = Depends(database.get_read_db), current_user: Principal = Depends(get_current_user)):
     numeric_order_id = hashids.decode(order_id)
     if not numeric_order_id:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid order ID")
 
     # Query the order with its items and the related products loaded
-    order = (
-        db.query(models.Order)
+    order = await db.scalar(
+        select(models.Order)
         .filter(models.Order.id == numeric_order_id[0], models.Order.user_id == current_user.id)
         .options(
-            joinedload(models.Order.items).joinedload(models.OrderItem.product)  # Load products in items
+            selectinload(models.Order.items).selectinload(models.OrderItem.product)  # Load products in items
         )
-        .first()
     )
 
     if not order:
@@ -185,82 +182,99 @@ def get_order(order_id: str, db: Session = Depends(database.get_db), current_use
     return response_data
 
 @router.post("/orders", response_model=schemas.PublicOrderResponse)
-def create_order(
+async def create_order(
     order: schemas.OrderCreate, 
-    db: Session = Depends(database.get_db), 
-    current_user: models.User = Depends(get_current_user)
+    db: AsyncSession = Depends(database.get_db), 
+    current_user: Principal = Depends(get_current_user)
 ):
-    # Create a new order
-    new_order = models.Order(
-        user_id=current_user.id,
-        status=order.status,
-        total_price=order.total_price,
-        created_at=datetime.datetime.now(),
-        updated_at=datetime.datetime.now()
-    )
-    db.add(new_order)
-    db.commit()
-    db.refresh(new_order)
-
-    # Add items to the order
-    for item in order.items:
-        order_item = models.OrderItem(
-            order_id=new_order.id,
-            product_id=item.product_id,
-            quantity=item.quantity,
-            color=item.color,
-            size=item.size,
-            price=item.price  
+    if not order.items:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Order has no items")
+    if any(item.quantity < 1 for item in order.items):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Item quantity must be at least 1")
+
+    # Price every line from the catalog in one lookup; client prices are ignored
+    product_ids = {item.product_id for item in order.items}
+    products = {
+        product.id: product
+        for product in (await db.execute(
+            select(Product.id, Product.name, Product.price).filter(Product.id.in_(product_ids))
+        )).all()
+    }
+    missing = sorted(product_ids - products.keys())
+    if missing:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Products not found: {missing}")
+    total_price = sum(products[item.product_id].price * item.quantity for item in order.items)
+
+    # Order, items and confirmation email commit together or not at all
+    now = datetime.datetime.now()
+    order_id = await db.scalar(
+        insert(models.Order)
+        .values(
+            user_id=current_user.id,
+            # New orders always start as CREATED; only admins move them on
+            status=models.OrderStatus.CREATED,
+            total_price=total_price,
+            created_at=now,
+            updated_at=now,
         )
-        db.add(order_item)
-    db.commit()
-
-    # Load the order with items
-    order_with_items = (
-        db.query(models.Order)
-        .filter(models.Order.id == new_order.id)
-        .options(joinedload(models.Order.items).joinedload(models.OrderItem.product))  # Load related products
-        .first()
+        .returning(models.Order.id)
     )
-
-    hashed_order_id = hashids.encode(new_order.id)
-
-    # Send the order confirmation email
-    try:
-        send_order_confirmation_email(
-            receiver_email=current_user.email,
-            receiver_name=current_user.full_name, 
-            order_id=new_order.id  # Use plain ID for internal communication
-        )
-    except Exception as e:
-        print(f"Error sending order confirmation email: {e}")
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, 
-            detail="Failed to send confirmation email."
-        )
+    item_rows = [
+        {
+            "order_id": order_id,
+            "product_id": item.product_id,
+            "quantity": item.quantity,
+            "color": item.color,
+            "size": item.size,
+            "price": products[item.product_id].price,
+        }
+        for item in order.items
+    ]
+    # One multi-row INSERT; rows come back in no guaranteed order, but lines
+    # that RETURNING cannot tell apart are identical anyway
+    items = (await db.execute(
+        insert(models.OrderItem).returning(
+            models.OrderItem.id,
+            models.OrderItem.product_id,
+            models.OrderItem.quantity,
+            models.OrderItem.color,
+            models.OrderItem.size,
+            models.OrderItem.price,
+        ),
+        item_rows,
+    )).all()
+
+    # The confirmation is delivered by the outbox worker
+    queue_order_confirmation_email(
+        db,
+        receiver_email=current_user.email,
+        receiver_name=current_user.full_name, 
+        order_id=order_id  # Use plain ID for internal communication
+    )
+    await db.commit()
 
     # Build the response data
     response_data = schemas.PublicOrderResponse(
-        id=hashed_order_id,  # Use hashed ID
-        plain_id=new_order.id,  # Include plain integer ID
-        user_id=order_with_items.user_id,
+        id=hashids.encode(order_id),  # Use hashed ID
+        plain_id=order_id,  # Include plain integer ID
+        user_id=current_user.id,
         user=None,  # Optional, or provide user details if needed
-        status=order_with_items.status.value,
-        total_price=order_with_items.total_price,
+        status=models.OrderStatus.CREATED.value,
+        total_price=total_price,
         items=[
             schemas.OrderItemResponse(
                 id=item.id,
                 product_id=item.product_id,
-                product_name=item.product.name,
+                product_name=products[item.product_id].name,
                 quantity=item.quantity,
                 color=item.color,
                 size=item.size.value if hasattr(item.size, 'value') else item.size,
                 price=item.price
             )
-            for item in order_with_items.items
+            for item in sorted(items, key=lambda item: item.id)
         ],
-        created_at=order_with_items.created_at,
-        updated_at=order_with_items.updated_at,
+        created_at=now,
+        updated_at=now,
     )
 
     return response_data
@@ -268,17 +282,17 @@ def create_order(
 
 
 @router.delete("/order/{order_id}", status_code=status.HTTP_204_NO_CONTENT)
-def cancel_order(order_id: str, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
+async def cancel_order(order_id: str, db: AsyncSession = Depends(database.get_db), current_user: Principal = Depends(get_current_user)):
     numeric_order_id = hashids.decode(order_id)
     if not numeric_order_id:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid order ID")
-    order = db.query(models.Order).filter(models.Order.user_id == current_user.id, models.Order.id == numeric_order_id[0]).first()
+    order = await db.scalar(select(models.Order).filter(models.Order.user_id == current_user.id, models.Order.id == numeric_order_id[0]))
     if not order:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Order not found")
     if order.status != schemas.OrderStatusEnum.PENDING:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Only pending orders can be canceled")
-    db.delete(order)
-    db.commit()
+    await db.delete(order)
+    await db.commit()
     return {"message": "Order canceled successfully"}
 
 #-----------------------------------#
@@ -286,103 +300,116 @@ def cancel_order(order_id: str, db: Session = Depends(database.get_db), current_
 #-----------------------------------#
 
 @router.post("/wishlist", response_model=schemas.WishlistItemRead)
-def add_wishlist_item(
+async def add_wishlist_item(
     item: schemas.WishlistItemCreate,
-    db: Session = Depends(database.get_db),
-    current_user: models.User = Depends(get_current_user)
+    db: AsyncSession = Depends(database.get_db),
+    current_user: Principal = Depends(get_current_user)
 ):
-    return add_to_wishlist(db, current_user.id, item.product_id, color=item.color, size=item.size)
+    return await add_to_wishlist(db, current_user.id, item.product_id, color=item.color, size=item.size)
 
 @router.get("/wishlist", response_model=List[schemas.WishlistItemRead])
-def get_wishlist(
-    db: Session = Depends(database.get_db),
-    current_user: models.User = Depends(get_current_user),
+async def get_wishlist(
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return, e.g. id,product.name,product.price"),
+    db: AsyncSession = Depends(database.get_read_db),
+    current_user: Principal = Depends(get_current_user),
 ):
-    wishlist_items = (
-        db.query(models.WishlistItem)
-        .join(models.Wishlist, models.WishlistItem.wishlist_id == models.Wishlist.id)
-        .filter(models.Wishlist.user_id == current_user.id)
-        .all()
-    )
+    fieldset = FieldSet(schemas.WishlistItemRead, models.WishlistItem, fields)
     # Return an empty list instead of raising an error
-    return wishlist_items
+    items = await load_wishlist(db, current_user.id, fieldset.options)
+    return json_response(List[fieldset.schema], items, from_attributes=True)
 
 
 
 @router.delete("/wishlist/{item_id}", response_model=schemas.Message)
-def remove_wishlist_item(item_id: int, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
-    return remove_from_wishlist(db, item_id, current_user.id)
+async def remove_wishlist_item(item_id: int, db: AsyncSession = Depends(database.get_db), current_user: Principal = Depends(get_current_user)):
+    return await remove_from_wishlist(db, item_id, current_user.id)
 
 #-----------------------------------#
 #          CART ROUTES              #
 #-----------------------------------#
 
-@router.get("/cart", response_model=schemas.Cart)
-def get_cart(db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
-    cart = db.query(models.Cart).filter(models.Cart.user_id == current_user.id).first()
-    if not cart:
-        # If the user doesn't have a cart yet, create one
-        cart = models.Cart(user_id=current_user.id)
-        db.add(cart)
-        db.commit()
-        db.refresh(cart)
-    return cart
+@router.get("/cart", response_model=schemas.CartRead)
+async def get_cart(db: AsyncSession = Depends(database.get_read_db), current_user: Principal = Depends(get_current_user)):
+    return await load_cart(db, current_user.id)
+
+@router.post("/cart/batch", response_model=schemas.CartBatchResult)
+async def batch_update_cart(
+    batch: schemas.CartBatchRequest,
+    db: AsyncSession = Depends(database.get_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    """
+    Applies an ordered list of cart and wishlist add/update/remove operations
+    in one transaction and returns the resulting cart and wishlist.
+    """
+    await apply_operations(db, current_user.id, batch.operations)
+    return schemas.CartBatchResult(
+        cart=await load_cart(db, current_user.id),
+        wishlist=await load_wishlist(db, current_user.id),
+    )
 
 # update cart item
 @router.put("/cart/{item_id}", response_model=schemas.CartItem)
-def update_cart_item(item_id: int, cart_item: schemas.CartItem, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
+async def update_cart_item(item_id: int, cart_item: schemas.CartItem, db: AsyncSession = Depends(database.get_db), current_user: Principal = Depends(get_current_user)):
     # Fetch the user's cart
-    cart = db.query(models.Cart).filter(models.Cart.user_id == current_user.id).first()
+    cart = await db.scalar(select(models.Cart).filter(models.Cart.user_id == current_user.id))
     if not cart:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cart not found")
 
     # Find the cart item by its ID and ensure it belongs to the cart
-    item = db.query(models.CartItem).filter(
+    item = await db.scalar(select(models.CartItem).filter(
         models.CartItem.id == item_id,
         models.CartItem.cart_id == cart.id
-    ).first()
+    ).options(selectinload(models.CartItem.product).selectinload(models.Product.category)))
 
     if not item:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cart item not found")
 
 
+    if (item.color, item.size) != (cart_item.color, cart_item.size):
+        # Moving to a variant already in the cart merges the two lines
+        existing = await db.scalar(select(models.CartItem).filter(
+            models.CartItem.cart_id == cart.id,
+            models.CartItem.product_id == item.product_id,
+            models.CartItem.color == cart_item.color,
+            models.CartItem.size == cart_item.size,
+        ).options(selectinload(models.CartItem.product).selectinload(models.Product.category)))
+        if existing:
+            existing.quantity += cart_item.quantity
+            await db.delete(item)
+            await db.commit()
+            return existing
+
     item.quantity = cart_item.quantity
     item.color = cart_item.color
     item.size = cart_item.size
 
-    db.commit()
-    db.refresh(item) 
+    await db.commit()
     return item
 
 @router.post("/cart", response_model=schemas.CartItem)
-def add_cart_item(cart_item: schemas.CartItem, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
-    cart = db.query(models.Cart).filter(models.Cart.user_id == current_user.id).first()
-    if not cart:
-        cart = models.Cart(user_id=current_user.id)
-        db.add(cart)
-        db.commit()
-        db.refresh(cart)
-    return add_to_cart(db, cart.id, cart_item.product.id, cart_item.quantity, color=cart_item.color, size=cart_item.size)
+async def add_cart_item(cart_item: schemas.CartItem, db: AsyncSession = Depends(database.get_db), current_user: Principal = Depends(get_current_user)):
+    return await add_to_cart(db, current_user.id, cart_item.product.id, cart_item.quantity, color=cart_item.color, size=cart_item.size)
 
 @router.delete("/cart/{item_id}", response_model=schemas.Message)
-def remove_cart_item(item_id: int, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
-    return remove_from_cart(db, item_id, current_user.id)
+async def remove_cart_item(item_id: int, db: AsyncSession = Depends(database.get_db), current_user: Principal = Depends(get_current_user)):
+    return await remove_from_cart(db, item_id, current_user.id)
 
 @router.delete("/cart/clear", response_model=schemas.Message)
-def clear_user_cart(
-    db: Session = Depends(database.get_db),
-    current_user: models.User = Depends(get_current_user)
+async def clear_user_cart(
+    db: AsyncSession = Depends(database.get_db),
+    current_user: Principal = Depends(get_current_user)
 ):
     # Find the user's cart
-    cart = db.query(models.Cart).filter(models.Cart.user_id == current_user.id).first()
+    cart = await db.scalar(select(models.Cart).filter(models.Cart.user_id == current_user.id))
     
     if not cart:
         return {"message": "Cart is already empty"}
     
     try:
         # Delete the cart associated with the user
-        db.delete(cart)
-        db.commit()
+        await db.delete(cart)
+        await db.commit()
     except Exception as e:
         print(f"Error clearing cart: {e}")
         raise HTTPException(
@@ -393,14 +420,72 @@ def clear_user_cart(
     return {"message": "Cart cleared successfully"}
 
 
+def parse_ids(ids: str) -> List[int]:
+    try:
+        parsed = [int(value) for value in ids.split(",") if value.strip()]
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ids must be comma-separated integers")
+    if len(parsed) > MAX_PAGE_SIZE:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"At most {MAX_PAGE_SIZE} ids per request")
+    return list(dict.fromkeys(parsed))
+
+async def get_products_by_ids(db: AsyncSession, loaders: Loaders, ids: List[int], fieldset: FieldSet, if_none_match: Optional[str]):
+    version = await catalog_version(db)
+    etag = make_etag(version, "ids", tuple(ids), fieldset.key)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=catalog_headers(etag))
+
+    # Products cached by earlier lookups are reused; the rest come from one IN query
+    products = {product_id: catalog_cache.get(("product", version, product_id)) for product_id in ids}
+    uncached = [product_id for product_id, product in products.items() if product is MISSING]
+    if uncached:
+        generation = catalog_cache.generation
+        for product in await loaders.products_with_categories(uncached):
+            if product is not None:
+                products[product.id] = ProductSchema.model_validate(product)
+                catalog_cache.set(("product", version, product.id), products[product.id], generation=generation)
+
+    missing = [product_id for product_id, product in products.items() if product is MISSING]
+    headers = catalog_headers(etag)
+    if missing:
+        headers["X-Missing-Ids"] = ",".join(str(product_id) for product_id in missing)
+    found = [product for product in products.values() if product is not MISSING]
+    return json_response(List[fieldset.schema], found, from_attributes=fieldset.key is not None, headers=headers)
+
 @router.get("/products", response_model=List[ProductSchema])
-def get_products(
-    db: Session = Depends(database.get_db),
+async def get_products(
+    db: AsyncSession = Depends(database.get_read_db),
+    loaders: Loaders = Depends(get_loaders),
     category_id: int = None,
     min_price: float = None,
-    max_price: float = None
+    max_price: float = None,
+    ids: Optional[str] = Query(None, description="Comma-separated product ids"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return, e.g. id,name,price,image_url"),
+    if_none_match: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None),
 ):
-    query = db.query(Product)
+    """
+    With ids, returns those products in the order given (other filters are
+    ignored) and lists ids that do not exist in the X-Missing-Ids header.
+    With fields, only those columns are read and returned.
+    """
+    fieldset = FieldSet(ProductSchema, Product, fields)
+    if ids is not None:
+        return await get_products_by_ids(db, loaders, parse_ids(ids), fieldset, if_none_match)
+
+    version = await catalog_version(db)
+    etag = make_etag(version, category_id, min_price, max_price, fieldset.key)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=catalog_headers(etag))
+
+    # Listings are the same for everyone, so they are cached already encoded
+    cache_key = ("list", version, category_id, min_price, max_price, fieldset.key)
+    payload = catalog_cache.get(cache_key)
+    if payload is not MISSING:
+        return payload.response(accept_encoding, headers=catalog_headers(etag))
+    generation = catalog_cache.generation
+
+    query = select(Product).options(*fieldset.options)
     
     # Optionally filter by category
     if category_id:
@@ -412,37 +497,115 @@ def get_products(
     if max_price is not None:
         query = query.filter(Product.price <= max_price)
     
-    return query.all()
+    products = [fieldset.schema.model_validate(product) for product in (await db.scalars(query)).all()]
+    body = type_adapter(List[fieldset.schema]).dump_json(products)
+    # Compressing a large catalog takes a while; keep it off the event loop
+    payload = await run_in_threadpool(EncodedPayload, body)
+    catalog_cache.set(cache_key, payload, generation=generation)
+    return payload.response(accept_encoding, headers=catalog_headers(etag))
+
+@router.get("/products/search", response_model=schemas.ProductSearchPage)
+async def search_catalog(
+    q: str = Query(..., min_length=1, max_length=200),
+    category_id: int = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+    db: AsyncSession = Depends(database.get_read_db),
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    Ranked product search over names and descriptions, tolerant of typos on
+    Postgres. Pass the returned next_offset as 'offset' for the next page.
+    """
+    q = " ".join(q.split())
+    if not q:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Empty search query")
+
+    version = await catalog_version(db)
+    etag = make_etag(version, "search", q, category_id, limit, offset)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=catalog_headers(etag))
+
+    cache_key = (version, q, category_id, limit, offset)
+    page = search_cache.get(cache_key)
+    if page is not MISSING:
+        return json_response(schemas.ProductSearchPage, page, headers=catalog_headers(etag))
+    generation = search_cache.generation
+
+    products, next_offset = await search_products(db, q, limit, offset, category_id)
+    page = schemas.ProductSearchPage(
+        items=[ProductSchema.model_validate(product) for product in products],
+        next_offset=next_offset,
+    )
+    search_cache.set(cache_key, page, generation=generation)
+    return json_response(schemas.ProductSearchPage, page, headers=catalog_headers(etag))
+
+@router.get("/products/autocomplete", response_model=List[schemas.AutocompleteSuggestion])
+async def autocomplete_products(
+    q: str = Query(..., max_length=200),
+    limit: int = Query(8, ge=1, le=TYPEAHEAD_MAX_RESULTS),
+    db: AsyncSession = Depends(database.get_db),
+):
+    """
+    Product and category names starting with q (or with a word starting
+    with q), most ordered first. Served from an in-process index; the
+    database is only read after catalog writes.
+    """
+    return [
+        schemas.AutocompleteSuggestion(kind=suggestion.kind, id=suggestion.id, text=suggestion.text)
+        for suggestion in await typeahead.complete(db, q, limit)
+    ]
 
 @router.get("/products/{product_id}", response_model=ProductSchema)
-def get_product(product_id: int, db: Session = Depends(database.get_db)):
-    product = db.query(Product).filter(Product.id == product_id).first()
+async def get_product(
+    product_id: int,
+    response: Response,
+    db: AsyncSession = Depends(database.get_read_db),
+    if_none_match: Optional[str] = Header(None),
+):
+    version = await catalog_version(db)
+    etag = make_etag(version, product_id)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=catalog_headers(etag))
+    response.headers.update(catalog_headers(etag))
+
+    cache_key = ("product", version, product_id)
+    product = catalog_cache.get(cache_key)
+    if product is not MISSING:
+        return product
+    generation = catalog_cache.generation
+
+    product = await db.scalar(select(Product).filter(Product.id == product_id).options(selectinload(Product.category)))
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
+    product = ProductSchema.model_validate(product)
+    catalog_cache.set(cache_key, product, generation=generation)
     return product
 
 @router.post("/add-to-newsletter", response_model=None)
-def add_to_newsletter(
+async def add_to_newsletter(
     email_data: schemas.NewsletterUserSchema,
-    db: Session = Depends(database.get_db)
+    db: AsyncSession = Depends(database.get_db)
 ):
-    existing_user = db.query(models.NewsletterUser).filter(models.NewsletterUser.email == email_data.email).first()
+    existing_user = await db.scalar(select(models.NewsletterUser).filter(models.NewsletterUser.email == email_data.email))
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered.")
     new_user = models.NewsletterUser(email=email_data.email)
     db.add(new_user)
-    db.commit()
+    await db.commit()
     return None
 
 @router.post("/referrals", status_code=status.HTTP_200_OK)
-def send_referrals(referral_request: ReferralRequest):
+async def send_referrals(referral_request: ReferralRequest, db: AsyncSession = Depends(database.get_db)):
     referrals = referral_request.referrals
 
     if not referrals:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No referrals provided.")
 
-    # Send an email to each referral
+    # Queue an email to each referral; the outbox worker sends them as one
+    # batch over pooled SMTP connections
     for referral in referrals:
-        send_promo_email(referral.email, referral.name)
+        queue_promo_email(db, referral.email, referral.name)
+    await db.commit()
 
     return {"message": "Referral emails sent successfully."}
@@ -0,0 +1,133 @@
+import itertools
+from fastapi import HTTPException, status
+from sqlalchemy import case, delete, select, update
+from database import models, schemas, db as database
+from .utils import CART_ITEM_VARIANT, get_or_create_owned_id
+
+MAX_BATCH_OPERATIONS = 200
+
+WISHLIST_ITEM_VARIANT = ["wishlist_id", "product_id", "color", "size"]
+
+Target = schemas.BatchTargetEnum
+Op = schemas.BatchOpEnum
+
+
+def validate_operations(operations: list):
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {MAX_BATCH_OPERATIONS} operations per batch",
+        )
+    for index, operation in enumerate(operations):
+        problem = None
+        if operation.op == Op.ADD:
+            if operation.product_id is None or operation.color is None or operation.size is None:
+                problem = "add needs product_id, color and size"
+            elif operation.quantity is not None and operation.quantity < 1:
+                problem = "quantity must be at least 1"
+        elif operation.op == Op.UPDATE:
+            if operation.target != Target.CART:
+                problem = "only cart lines can be updated"
+            elif operation.item_id is None or operation.quantity is None or operation.quantity < 1:
+                problem = "update needs item_id and a quantity of at least 1"
+        elif operation.item_id is None:
+            problem = "remove needs item_id"
+        if problem:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Operation {index}: {problem}")
+
+
+async def check_products(db, operations: list):
+    product_ids = {operation.product_id for operation in operations if operation.op == Op.ADD}
+    if not product_ids:
+        return
+    found = set((await db.scalars(select(models.Product.id).filter(models.Product.id.in_(product_ids)))).all())
+    missing = sorted(product_ids - found)
+    if missing:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Products not found: {missing}")
+
+
+def owned_by(model, user_id: int):
+    return select(model.id).filter(model.user_id == user_id)
+
+
+async def add_cart_items(db, user_id: int, run: list):
+    cart_id = await get_or_create_owned_id(db, models.Cart, user_id)
+    # Same variant twice in one statement would conflict with itself
+    quantities = {}
+    for operation in run:
+        key = (operation.product_id, operation.color, operation.size)
+        quantities[key] = quantities.get(key, 0) + (operation.quantity or 1)
+
+    table = models.CartItem.__table__
+    insert = database.upsert_insert(db, table).values([
+        {"cart_id": cart_id, "product_id": product_id, "color": color, "size": size, "quantity": quantity}
+        for (product_id, color, size), quantity in quantities.items()
+    ])
+    await db.execute(insert.on_conflict_do_update(
+        index_elements=CART_ITEM_VARIANT,
+        set_={"quantity": table.c.quantity + insert.excluded.quantity},
+    ))
+
+
+async def update_cart_items(db, user_id: int, run: list):
+    # Later operations on the same line win
+    quantities = {operation.item_id: operation.quantity for operation in run}
+    table = models.CartItem.__table__
+    await db.execute(
+        update(table)
+        .where(table.c.id.in_(list(quantities)), table.c.cart_id.in_(owned_by(models.Cart, user_id)))
+        .values(quantity=case(quantities, value=table.c.id))
+    )
+
+
+async def remove_cart_items(db, user_id: int, run: list):
+    table = models.CartItem.__table__
+    await db.execute(
+        delete(table).where(
+            table.c.id.in_({operation.item_id for operation in run}),
+            table.c.cart_id.in_(owned_by(models.Cart, user_id)),
+        )
+    )
+
+
+async def add_wishlist_items(db, user_id: int, run: list):
+    wishlist_id = await get_or_create_owned_id(db, models.Wishlist, user_id)
+    variants = {(operation.product_id, operation.color, operation.size) for operation in run}
+    insert = database.upsert_insert(db, models.WishlistItem.__table__).values([
+        {"wishlist_id": wishlist_id, "product_id": product_id, "color": color, "size": size}
+        for product_id, color, size in variants
+    ])
+    await db.execute(insert.on_conflict_do_nothing(index_elements=WISHLIST_ITEM_VARIANT))
+
+
+async def remove_wishlist_items(db, user_id: int, run: list):
+    table = models.WishlistItem.__table__
+    await db.execute(
+        delete(table).where(
+            table.c.id.in_({operation.item_id for operation in run}),
+            table.c.wishlist_id.in_(owned_by(models.Wishlist, user_id)),
+        )
+    )
+
+
+APPLY = {
+    (Target.CART, Op.ADD): add_cart_items,
+    (Target.CART, Op.UPDATE): update_cart_items,
+    (Target.CART, Op.REMOVE): remove_cart_items,
+    (Target.WISHLIST, Op.ADD): add_wishlist_items,
+    (Target.WISHLIST, Op.REMOVE): remove_wishlist_items,
+}
+
+
+async def apply_operations(db, user_id: int, operations: list):
+    """
+    Applies the operations in order within one transaction. Each run of
+    consecutive operations with the same target and op becomes a single
+    set-based statement. Update and remove of lines the user does not own
+    (or that no longer exist) are ignored, so replaying a sync is harmless.
+    """
+    validate_operations(operations)
+    await check_products(db, operations)
+    for key, run in itertools.groupby(operations, key=lambda operation: (operation.target, operation.op)):
+        await APPLY[key](db, user_id, list(run))
+    await db.commit()
@@ -0,0 +1,91 @@
+import hashlib
+import os
+from sqlalchemy import func, select
+from api.common.cache import MISSING, TTLCache
+from database import models, db as database
+from database.events import after_commit_of
+import dotenv
+
+dotenv.load_dotenv()
+
+CATALOG_CACHE_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", "512"))
+CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL", "300"))
+# How long browsers and shared caches may reuse a catalog response before
+# revalidating it with If-None-Match.
+CATALOG_MAX_AGE = int(os.getenv("CATALOG_MAX_AGE", "60"))
+# The version is what lets a worker notice writes made through another
+# process, so it is re-read far more often than the cached payloads and never
+# outlives max-age: a revalidation after max-age sees the new catalog.
+CATALOG_VERSION_TTL = min(float(os.getenv("CATALOG_VERSION_TTL", "5")), CATALOG_MAX_AGE)
+# Search pages are keyed by free-form queries, so they get their own, smaller
+# cache and cannot push product listings out of catalog_cache.
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "256"))
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "60"))
+
+# Holds product listings under
+# ("list", version, category_id, min_price, max_price, fields) as encoded
+# payloads and single products under ("product", version, product_id).
+# Each worker process has its own copy. Entries are keyed by the catalog
+# version, so writes made through another process are picked up once
+# version_cache expires rather than after CATALOG_CACHE_TTL.
+catalog_cache = TTLCache("catalog", maxsize=CATALOG_CACHE_SIZE, ttl=CATALOG_CACHE_TTL)
+version_cache = TTLCache("catalog_version", maxsize=1, ttl=CATALOG_VERSION_TTL)
+# Search pages under (version, q, category_id, limit, offset)
+search_cache = TTLCache("search", maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL)
+
+
+def invalidate_catalog():
+    catalog_cache.invalidate()
+    version_cache.invalidate()
+    search_cache.invalidate()
+
+
+@after_commit_of(models.Product, models.Category)
+def on_catalog_write(changes):
+    invalidate_catalog()
+    # If this request reads the catalog again, refill the cache from the primary
+    database.pin_reads_to_primary()
+
+
+async def catalog_version(db) -> str:
+    """
+    Row counts and latest updated_at of products and categories, read in one
+    round trip. Deriving it from the database (rather than a per-process
+    counter) gives every worker the same ETags.
+    """
+    version = version_cache.get("version")
+    if version is not MISSING:
+        return version
+    generation = version_cache.generation
+
+    row = (await db.execute(select(
+        select(func.count(models.Product.id)).scalar_subquery(),
+        select(func.max(models.Product.updated_at)).scalar_subquery(),
+        select(func.count(models.Category.id)).scalar_subquery(),
+        select(func.max(models.Category.updated_at)).scalar_subquery(),
+    ))).one()
+    version = "|".join(str(value) for value in row)
+    version_cache.set("version", version, generation=generation)
+    return version
+
+
+def make_etag(*parts) -> str:
+    # Weak: the same ETag covers the identity, gzip and br bodies of a
+    # response, which are equivalent but not byte-identical
+    return 'W/"' + hashlib.sha1(repr(parts).encode()).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    # If-None-Match uses the weak comparison, so W/ prefixes are ignored
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip().removeprefix("W/") for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag.removeprefix("W/") in candidates
+
+
+def catalog_headers(etag: str) -> dict:
+    return {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={CATALOG_MAX_AGE}, must-revalidate",
+        "Vary": "Accept-Encoding",
+    }
@@ -0,0 +1,62 @@
+from typing import Optional
+from sqlalchemy import and_, case, func, literal_column, or_, select
+from sqlalchemy.orm import selectinload
+from database import models
+
+SEARCH_CONFIG = "english"
+
+# Generated column added by models.PRODUCT_SEARCH_DDL (Postgres only)
+search_vector = literal_column("products.search_vector")
+
+
+def postgres_search(q: str):
+    """
+    Products whose name or description match q as a web-style query
+    ("red dress", "shirt -linen", "\"slim fit\""), or whose name is
+    trigram-similar to q so typos still match. Both conditions are served by
+    GIN indexes. Full-text rank (name weighted above description) plus name
+    similarity orders the results.
+    """
+    tsquery = func.websearch_to_tsquery(SEARCH_CONFIG, q)
+    rank = func.ts_rank_cd(search_vector, tsquery) + func.similarity(models.Product.name, q)
+    return (
+        select(models.Product)
+        .filter(or_(search_vector.op("@@")(tsquery), models.Product.name.op("%")(q)))
+        .order_by(rank.desc(), models.Product.id)
+    )
+
+
+def fallback_search(q: str):
+    """
+    LIKE matching for databases without full-text search: every word has to
+    appear in the name or description, and name matches of the whole query
+    come first. Scans the table; fine for development catalogs.
+    """
+    terms = q.split()
+    name_match = models.Product.name.icontains(q, autoescape=True)
+    return (
+        select(models.Product)
+        .filter(and_(*(
+            or_(models.Product.name.icontains(term, autoescape=True), models.Product.description.icontains(term, autoescape=True))
+            for term in terms
+        )))
+        .order_by(case((name_match, 0), else_=1), models.Product.id)
+    )
+
+
+async def search_products(db, q: str, limit: int, offset: int = 0, category_id: Optional[int] = None):
+    """
+    Returns (products, next_offset) for one page of ranked results.
+    next_offset is None on the last page.
+    """
+    if db.bind.dialect.name == "postgresql":
+        query = postgres_search(q)
+    else:
+        query = fallback_search(q)
+    if category_id:
+        query = query.filter(models.Product.category_id == category_id)
+
+    query = query.options(selectinload(models.Product.category)).offset(offset).limit(limit + 1)
+    products = (await db.scalars(query)).all()
+    next_offset = offset + limit if len(products) > limit else None
+    return products[:limit], next_offset
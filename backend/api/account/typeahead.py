@@ -0,0 +1,279 @@
+import asyncio
+import bisect
+import heapq
+import os
+import re
+import threading
+import unicodedata
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, select
+from database import models, db as database
+from database.events import after_commit_of
+import dotenv
+
+dotenv.load_dotenv()
+
+# Suggestions kept per cached prefix, and so the largest limit accepted
+TYPEAHEAD_MAX_RESULTS = int(os.getenv("TYPEAHEAD_MAX_RESULTS", "20"))
+# Prefixes matching more terms than this get their top results cached
+TYPEAHEAD_CACHE_THRESHOLD = int(os.getenv("TYPEAHEAD_CACHE_THRESHOLD", "64"))
+TYPEAHEAD_CACHE_SIZE = int(os.getenv("TYPEAHEAD_CACHE_SIZE", "20000"))
+# Full rebuilds pick up popularity from new orders
+TYPEAHEAD_REFRESH_SECONDS = float(os.getenv("TYPEAHEAD_REFRESH_SECONDS", "600"))
+
+PRODUCT = "product"
+CATEGORY = "category"
+WORD = re.compile(r"\w+")
+
+
+def normalize(text: str) -> str:
+    """
+    Lowercase words without accents, separated by single spaces.
+    """
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(WORD.findall(text.lower()))
+
+
+def terms_for(text: str) -> set:
+    # The name from each word on, so "shirt bl" finds "Linen shirt blue"
+    words = normalize(text).split()
+    return {" ".join(words[i:]) for i in range(len(words))}
+
+
+class Suggestion:
+    __slots__ = ("kind", "id", "text", "weight")
+
+    def __init__(self, kind: str, id: int, text: str, weight: float = 0):
+        self.kind = kind
+        self.id = id
+        self.text = text
+        self.weight = weight
+
+    @property
+    def key(self):
+        return (self.kind, self.id)
+
+    def rank(self):
+        return (-self.weight, self.text.lower(), self.kind, self.id)
+
+
+class TypeaheadIndex:
+    """
+    Product and category names as a sorted array of (term, kind, id). The
+    terms starting with a prefix form one contiguous slice found by bisect.
+    Top results of prefixes with many terms (the short ones) are cached, and
+    the cache entries of a name's prefixes are dropped when it changes.
+    """
+
+    def __init__(self):
+        self.terms = []
+        self.entries = {}
+        self.top_cache = {}
+
+    @classmethod
+    def build(cls, suggestions: list) -> "TypeaheadIndex":
+        index = cls()
+        for suggestion in suggestions:
+            index.entries[suggestion.key] = suggestion
+            index.terms.extend((term, suggestion.kind, suggestion.id) for term in terms_for(suggestion.text))
+        index.terms.sort()
+        return index
+
+    def complete(self, prefix: str, limit: int) -> list:
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        top = self.top_cache.get(prefix)
+        if top is None:
+            start = bisect.bisect_left(self.terms, (prefix,))
+            end = bisect.bisect_left(self.terms, (prefix + "\uffff",), start)
+            keys = {(kind, id) for _, kind, id in self.terms[start:end]}
+            top = heapq.nsmallest(TYPEAHEAD_MAX_RESULTS, (self.entries[key] for key in keys), key=Suggestion.rank)
+            if end - start > TYPEAHEAD_CACHE_THRESHOLD:
+                if len(self.top_cache) >= TYPEAHEAD_CACHE_SIZE:
+                    self.top_cache.clear()
+                self.top_cache[prefix] = top
+        return top[:limit]
+
+    def invalidate(self, terms):
+        for term in terms:
+            for end in range(1, len(term) + 1):
+                self.top_cache.pop(term[:end], None)
+
+    def remove(self, key):
+        suggestion = self.entries.pop(key, None)
+        if suggestion is None:
+            return
+        terms = terms_for(suggestion.text)
+        for term in terms:
+            position = bisect.bisect_left(self.terms, (term, *key))
+            if position < len(self.terms) and self.terms[position] == (term, *key):
+                del self.terms[position]
+        self.invalidate(terms)
+
+    def put(self, suggestion: Suggestion):
+        self.remove(suggestion.key)
+        self.entries[suggestion.key] = suggestion
+        terms = terms_for(suggestion.text)
+        for term in terms:
+            bisect.insort(self.terms, (term, suggestion.kind, suggestion.id))
+        self.invalidate(terms)
+
+    def set_weight(self, key, weight: float):
+        suggestion = self.entries.get(key)
+        if suggestion is not None and suggestion.weight != weight:
+            suggestion.weight = weight
+            self.invalidate(terms_for(suggestion.text))
+
+
+async def popularity(db, product_ids=None) -> dict:
+    query = select(models.OrderItem.product_id, func.sum(models.OrderItem.quantity)).group_by(models.OrderItem.product_id)
+    if product_ids is not None:
+        query = query.filter(models.OrderItem.product_id.in_(product_ids))
+    return {product_id: units or 0 for product_id, units in (await db.execute(query)).all()}
+
+
+class Typeahead:
+    """
+    The process-wide index plus the product and category ids written since
+    it was last brought up to date. Commit hooks (possibly on threadpool
+    threads) only record ids; the next autocomplete request reloads those
+    rows, so lookups without pending writes never touch the database.
+    """
+
+    def __init__(self):
+        self.index = None
+        self.product_category = {}
+        self._dirty_products = set()
+        self._dirty_categories = set()
+        self._rebuild = False
+        self._dirty_lock = threading.Lock()
+        self._update_lock = None
+
+    def mark_dirty(self, product_ids=(), category_ids=()):
+        with self._dirty_lock:
+            for ids, dirty in ((product_ids, self._dirty_products), (category_ids, self._dirty_categories)):
+                for id in ids:
+                    if id is None:
+                        self._rebuild = True
+                    else:
+                        dirty.add(id)
+
+    def take_dirty(self):
+        with self._dirty_lock:
+            dirty = (self._dirty_products, self._dirty_categories, self._rebuild)
+            self._dirty_products, self._dirty_categories, self._rebuild = set(), set(), False
+        return dirty
+
+    def is_current(self) -> bool:
+        return self.index is not None and not (self._dirty_products or self._dirty_categories or self._rebuild)
+
+    def update_lock(self) -> asyncio.Lock:
+        if self._update_lock is None:
+            self._update_lock = asyncio.Lock()
+        return self._update_lock
+
+    async def ensure_current(self, db):
+        if self.is_current():
+            return
+        async with self.update_lock():
+            if self.is_current():
+                return
+            products, categories, rebuild = self.take_dirty()
+            if self.index is None or rebuild:
+                await self.rebuild(db)
+            else:
+                await self.apply_changes(db, products, categories)
+
+    async def refresh(self, db):
+        async with self.update_lock():
+            self.take_dirty()
+            await self.rebuild(db)
+
+    async def rebuild(self, db):
+        weights = await popularity(db)
+        products = (await db.execute(select(models.Product.id, models.Product.name, models.Product.category_id))).all()
+        categories = (await db.execute(select(models.Category.id, models.Category.name))).all()
+        await db.commit()
+
+        category_weights = {}
+        for product in products:
+            category_weights[product.category_id] = category_weights.get(product.category_id, 0) + weights.get(product.id, 0)
+        suggestions = [
+            Suggestion(PRODUCT, product.id, product.name, weights.get(product.id, 0))
+            for product in products if product.name
+        ] + [
+            Suggestion(CATEGORY, category.id, category.name, category_weights.get(category.id, 0))
+            for category in categories if category.name
+        ]
+        # Sorting a large catalog takes a while; keep it off the event loop
+        self.index = await run_in_threadpool(TypeaheadIndex.build, suggestions)
+        self.product_category = {product.id: product.category_id for product in products}
+
+    async def apply_changes(self, db, product_ids: set, category_ids: set):
+        products = (await db.execute(
+            select(models.Product.id, models.Product.name, models.Product.category_id)
+            .filter(models.Product.id.in_(product_ids))
+        )).all() if product_ids else []
+        weights = await popularity(db, product_ids) if product_ids else {}
+        categories = (await db.execute(
+            select(models.Category.id, models.Category.name).filter(models.Category.id.in_(category_ids))
+        )).all() if category_ids else []
+        await db.commit()
+
+        index = self.index
+        affected_categories = set(category_ids)
+        for product_id in product_ids - {product.id for product in products}:
+            index.remove((PRODUCT, product_id))
+            affected_categories.add(self.product_category.pop(product_id, None))
+        for product in products:
+            affected_categories.add(self.product_category.get(product.id))
+            affected_categories.add(product.category_id)
+            self.product_category[product.id] = product.category_id
+            if product.name:
+                index.put(Suggestion(PRODUCT, product.id, product.name, weights.get(product.id, 0)))
+            else:
+                index.remove((PRODUCT, product.id))
+
+        for category_id in category_ids - {category.id for category in categories}:
+            index.remove((CATEGORY, category_id))
+        for category in categories:
+            if category.name:
+                index.put(Suggestion(CATEGORY, category.id, category.name))
+            else:
+                index.remove((CATEGORY, category.id))
+        affected_categories.discard(None)
+        category_weights = dict.fromkeys(affected_categories, 0)
+        for product_id, category_id in self.product_category.items():
+            if category_id in category_weights and (PRODUCT, product_id) in index.entries:
+                category_weights[category_id] += index.entries[(PRODUCT, product_id)].weight
+        for category_id, weight in category_weights.items():
+            index.set_weight((CATEGORY, category_id), weight)
+
+    async def complete(self, db, prefix: str, limit: int) -> list:
+        await self.ensure_current(db)
+        return self.index.complete(prefix, limit)
+
+
+typeahead = Typeahead()
+
+
+@after_commit_of(models.Product, snapshot=lambda product: product.id)
+def on_product_write(changes):
+    typeahead.mark_dirty(product_ids=changes)
+
+
+@after_commit_of(models.Category, snapshot=lambda category: category.id)
+def on_category_write(changes):
+    typeahead.mark_dirty(category_ids=changes)
+
+
+async def run_typeahead_refresh(interval: float = TYPEAHEAD_REFRESH_SECONDS):
+    while True:
+        try:
+            async with database.session_scope() as db:
+                await typeahead.refresh(db)
+        except Exception as e:
+            print(f"Error rebuilding typeahead index: {e}")
+        await asyncio.sleep(interval)
@@ -1,192 +1,246 @@
 from fastapi import HTTPException, status # type: ignore
-from sqlalchemy.orm import Session, joinedload
-from database import models
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-import os
-import dotenv
-
-dotenv.load_dotenv()
-
-EMAIL = os.getenv("EMAIL")
-PASSWORD = os.getenv("PASSWORD")
-
-def get_user_address(db: Session, user_id: int):
-    address = db.query(models.Address).filter(models.Address.user_id == user_id).first()
+from sqlalchemy import delete, literal, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import contains_eager, joinedload, selectinload
+from database import models, schemas, db as database
+from api.common.mailer import render_template
+from api.common.outbox import enqueue_email
+
+async def get_user_address(db: AsyncSession, user_id: int):
+    address = await db.scalar(select(models.Address).filter(models.Address.user_id == user_id))
     if not address:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Address not found")
     return address
 
-def get_user_orders(db: Session, user_id: int):
-    orders = db.query(models.Order).filter(models.Order.user_id == user_id).all()
+async def get_user_orders(db: AsyncSession, user_id: int):
+    orders = (await db.scalars(select(models.Order).filter(models.Order.user_id == user_id))).all()
     if not orders:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No orders found")
     return orders
 
-def get_user_wishlist(db: Session, user_id: int):
-    wishlist = db.query(models.WishlistItem).join(models.Wishlist).filter(models.Wishlist.user_id == user_id).all()
+async def get_user_wishlist(db: AsyncSession, user_id: int):
+    wishlist = (await db.scalars(
+        select(models.WishlistItem).join(models.Wishlist).filter(models.Wishlist.user_id == user_id)
+    )).all()
     if not wishlist:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Wishlist not found")
     return wishlist
 
-def get_user_cart(db: Session, user_id: int):
-    cart = db.query(models.Cart).filter(models.Cart.user_id == user_id).first()
+async def get_user_cart(db: AsyncSession, user_id: int):
+    cart = await db.scalar(select(models.Cart).filter(models.Cart.user_id == user_id))
     if not cart:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cart not found")
     return cart
 
-def get_cart_item(db: Session, cart_id: int, product_id: int):
-    cart_item = db.query(models.CartItem).filter(models.CartItem.cart_id == cart_id, models.CartItem.product_id == product_id).first()
+async def get_cart_item(db: AsyncSession, cart_id: int, product_id: int):
+    cart_item = await db.scalar(
+        select(models.CartItem).filter(models.CartItem.cart_id == cart_id, models.CartItem.product_id == product_id)
+    )
     return cart_item
 
-def add_to_wishlist(db: Session, user_id: int, product_id: int, color: str, size: str):
-    wishlist = db.query(models.Wishlist).filter(models.Wishlist.user_id == user_id).first()
-    if not wishlist:
-        wishlist = models.Wishlist(user_id=user_id)
-        db.add(wishlist)
-        db.commit()
-        db.refresh(wishlist)
+async def get_or_create_owned_id(db: AsyncSession, model, user_id: int) -> int:
+    """
+    Id of the user's cart or wishlist (model), created if missing in the same
+    statement. The no-op DO UPDATE makes RETURNING yield the existing row.
+    """
+    insert = database.upsert_insert(db, model)
+    return await db.scalar(
+        insert.values(user_id=user_id)
+        .on_conflict_do_update(index_elements=["user_id"], set_={"user_id": insert.excluded.user_id})
+        .returning(model.id)
+    )
+
+
+async def load_cart(db: AsyncSession, user_id: int) -> schemas.CartRead:
+    # Cart, items, products and categories in one joined query
+    cart = (await db.scalars(
+        select(models.Cart)
+        .outerjoin(models.Cart.items)
+        .outerjoin(models.CartItem.product)
+        .outerjoin(models.Product.category)
+        .filter(models.Cart.user_id == user_id)
+        .options(
+            contains_eager(models.Cart.items)
+            .contains_eager(models.CartItem.product)
+            .contains_eager(models.Product.category)
+        )
+        .order_by(models.CartItem.id)
+        .execution_options(populate_existing=True)
+    )).unique().first()
+    if not cart:
+        # Nothing added yet; the cart is created by the first add
+        return schemas.CartRead(id=None, user_id=user_id, items=[], item_count=0, total=0.0)
+
+    items = [
+        schemas.CartLine(
+            id=item.id,
+            product=item.product,
+            quantity=item.quantity,
+            color=item.color,
+            size=item.size,
+            line_total=item.product.price * item.quantity,
+        )
+        for item in cart.items
+        if item.product is not None
+    ]
+    return schemas.CartRead(
+        id=cart.id,
+        user_id=cart.user_id,
+        items=items,
+        item_count=sum(item.quantity for item in items),
+        total=sum(item.line_total for item in items),
+    )
+
+
+WISHLIST_LOADERS = (selectinload(models.WishlistItem.product).selectinload(models.Product.category),)
+
+
+async def load_wishlist(db: AsyncSession, user_id: int, options=WISHLIST_LOADERS):
+    return (await db.scalars(
+        select(models.WishlistItem)
+        .join(models.Wishlist, models.WishlistItem.wishlist_id == models.Wishlist.id)
+        .filter(models.Wishlist.user_id == user_id)
+        .options(*options)
+        .order_by(models.WishlistItem.id)
+        .execution_options(populate_existing=True)
+    )).all()
+
 
-    existing_item = db.query(models.WishlistItem).filter(
+async def add_to_wishlist(db: AsyncSession, user_id: int, product_id: int, color: str, size: str):
+    wishlist_id = await get_or_create_owned_id(db, models.Wishlist, user_id)
+
+    existing_item = await db.scalar(select(models.WishlistItem).filter(
         models.WishlistItem.product_id == product_id,
-        models.WishlistItem.wishlist_id == wishlist.id,
+        models.WishlistItem.wishlist_id == wishlist_id,
         models.WishlistItem.color == color,
         models.WishlistItem.size == size
-    ).first()
+    ))
 
     if existing_item:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Item already in wishlist")
 
     wishlist_item = models.WishlistItem(
         product_id=product_id,
-        wishlist_id=wishlist.id,
+        wishlist_id=wishlist_id,
         color=color,
         size=size
     )
     db.add(wishlist_item)
-    db.commit()
-    db.refresh(wishlist_item)
+    await db.commit()
+    await db.refresh(wishlist_item)
 
     # Reload with joined product for the response
-    wishlist_item = db.query(models.WishlistItem).options(
-        joinedload(models.WishlistItem.product)
-    ).filter(models.WishlistItem.id == wishlist_item.id).first()
+    wishlist_item = await db.scalar(select(models.WishlistItem).options(
+        selectinload(models.WishlistItem.product).selectinload(models.Product.category)
+    ).filter(models.WishlistItem.id == wishlist_item.id))
 
     return wishlist_item
 
 
-def remove_from_wishlist(db: Session, wishlist_item_id: int, user_id: int):
-    wishlist_item = db.query(models.WishlistItem).filter(
+async def remove_from_wishlist(db: AsyncSession, wishlist_item_id: int, user_id: int):
+    wishlist_item = await db.scalar(select(models.WishlistItem).filter(
         models.WishlistItem.id == wishlist_item_id,
         models.WishlistItem.wishlist.has(user_id=user_id)
-    ).first()
+    ))
     if not wishlist_item:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Wishlist item not found")
-    db.delete(wishlist_item)
-    db.commit()
+    await db.delete(wishlist_item)
+    await db.commit()
     return {"message": "Item removed from wishlist"}
 
-def add_to_cart(db: Session, cart_id: int, product_id: int, quantity: int, color: str, size: str):
-    cart_item = models.CartItem(
-        cart_id=cart_id,
-        product_id=product_id,
-        quantity=quantity,
-        color=color,  
-        size=size     
+CART_ITEM_VARIANT = ["cart_id", "product_id", "color", "size"]
+
+
+async def ensure_cart(db: AsyncSession, user_id: int):
+    """
+    Creates the user's cart unless it exists; concurrent callers cannot
+    create two.
+    """
+    insert = database.upsert_insert(db, models.Cart)
+    await db.execute(insert.values(user_id=user_id).on_conflict_do_nothing(index_elements=["user_id"]))
+
+
+async def upsert_cart_item(db: AsyncSession, user_id: int, product_id: int, quantity: int, color: str, size: str):
+    """
+    Adds quantity to the user's cart line for this product variant, creating
+    the line if needed, in one statement. Returns the line id, or None when
+    the user has no cart yet or the product does not exist (checked in the
+    statement itself, since SQLite does not enforce the foreign key).
+    """
+    table = models.CartItem.__table__
+    insert = database.upsert_insert(db, table).from_select(
+        CART_ITEM_VARIANT + ["quantity"],
+        select(
+            models.Cart.id,
+            literal(product_id, table.c.product_id.type),
+            literal(color, table.c.color.type),
+            literal(size, table.c.size.type),
+            literal(quantity, table.c.quantity.type),
+        ).filter(
+            models.Cart.user_id == user_id,
+            select(models.Product.id).filter(models.Product.id == product_id).exists(),
+        ),
     )
-    db.add(cart_item)
-    db.commit()
-    db.refresh(cart_item)
+    return await db.scalar(
+        insert.on_conflict_do_update(
+            index_elements=CART_ITEM_VARIANT,
+            set_={"quantity": table.c.quantity + insert.excluded.quantity},
+        ).returning(table.c.id)
+    )
+
+
+async def add_to_cart(db: AsyncSession, user_id: int, product_id: int, quantity: int, color: str, size: str):
+    cart_item_id = await upsert_cart_item(db, user_id, product_id, quantity, color, size)
+    if cart_item_id is None:
+        await ensure_cart(db, user_id)
+        cart_item_id = await upsert_cart_item(db, user_id, product_id, quantity, color, size)
+    if cart_item_id is None:
+        await db.rollback()
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
+    await db.commit()
+
+    # Reload with the product and its category for the response
+    cart_item = await db.scalar(select(models.CartItem).options(
+        joinedload(models.CartItem.product).joinedload(models.Product.category)
+    ).filter(models.CartItem.id == cart_item_id))
     return cart_item
 
 
-def remove_from_cart(db: Session, cart_item_id: int, user_id: int):
-    cart_item = db.query(models.CartItem).filter(
+async def remove_from_cart(db: AsyncSession, cart_item_id: int, user_id: int):
+    cart_item = await db.scalar(select(models.CartItem).filter(
         models.CartItem.id == cart_item_id,
         models.CartItem.cart.has(user_id=user_id)
-    ).first()
+    ))
     if not cart_item:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cart item not found")
-    db.delete(cart_item)
-    db.commit()
+    await db.delete(cart_item)
+    await db.commit()
     return {"message": "Item removed from cart"}
 
-def clear_cart(db: Session, user_id: int):
-    cart = db.query(models.Cart).filter(models.Cart.user_id == user_id).first()
+async def clear_cart(db: AsyncSession, user_id: int):
+    cart = await db.scalar(select(models.Cart).filter(models.Cart.user_id == user_id))
     if not cart:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cart not found")
 
-    db.query(models.CartItem).filter(models.CartItem.cart_id == cart.id).delete()
-    db.commit()
+    await db.execute(delete(models.CartItem).filter(models.CartItem.cart_id == cart.id))
+    await db.commit()
     return {"message": "Cart cleared successfully"}
 
-def send_promo_email(receiver_email: str, receiver_name: str):
-    sender_email = EMAIL
-    sender_password = PASSWORD
-
+def queue_promo_email(db: AsyncSession, receiver_email: str, receiver_name: str):
+    """
+    Queues a referral email in the outbox; it is sent once the caller commits.
+    """
     subject = "Your friend recommended Ladimood!"
+    html_content = render_template("promo_email.html", receiver_name=receiver_name)
+    return enqueue_email(db, receiver_email, subject, html_content)
 
-    template_path = "templates/promo_email.html"
-
-    try:
-        with open(template_path, 'r', encoding='utf-8') as file:
-            html_content = file.read()
-    except Exception as e:
-        print(f"Error reading email template: {e}")
-        raise Exception("Failed to read email template.")
-
-    html_content = html_content.replace('{{ receiver_name }}', receiver_name)
-
-    msg_root = MIMEMultipart('alternative')
-    msg_root['Subject'] = subject
-    msg_root['From'] = sender_email
-    msg_root['To'] = receiver_email
-
-    msg_html = MIMEText(html_content, 'html')
-    msg_root.attach(msg_html)
-
-    try:
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
-            server.login(sender_email, sender_password)
-            server.sendmail(sender_email, receiver_email, msg_root.as_string())
-        print(f"Email sent successfully to {receiver_email}")
-    except Exception as e:
-        print(f"Failed to send email to {receiver_email}: {e}")
-        raise Exception("Failed to send email.")
-    
-
-def send_order_confirmation_email(receiver_email: str, receiver_name: str, order_id: int):
-    sender_email = "djordjeivanovic65@gmail.com"
-    sender_password = "owlj ddmq zjce gues"
 
+def queue_order_confirmation_email(db: AsyncSession, receiver_email: str, receiver_name: str, order_id: int):
+    """
+    Queues the confirmation in the outbox; it is sent once the caller commits.
+    """
     subject = f"Order Confirmation - Order #{order_id}"
-
-    template_path = "templates/order_confirmation_email.html"
-
-    try:
-        with open(template_path, 'r', encoding='utf-8') as file:
-            html_content = file.read()
-    except Exception as e:
-        print(f"Error reading email template: {e}")
-        raise Exception("Failed to read email template.")
-
-    html_content = html_content.replace('{{ receiver_name }}', receiver_name)
-    html_content = html_content.replace('{{ order_id }}', str(order_id))
-
-    msg_root = MIMEMultipart('alternative')
-    msg_root['Subject'] = subject
-    msg_root['From'] = sender_email
-    msg_root['To'] = receiver_email
-
-    msg_html = MIMEText(html_content, 'html')
-    msg_root.attach(msg_html)
-
-    try:
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
-            server.login(sender_email, sender_password)
-            server.sendmail(sender_email, receiver_email, msg_root.as_string())
-        print(f"Order confirmation email sent successfully to {receiver_email}")
-    except Exception as e:
-        print(f"Failed to send order confirmation email to {receiver_email}: {e}")
-        raise Exception("Failed to send email.")
+    html_content = render_template(
+        "order_confirmation_email.html", receiver_name=receiver_name, order_id=order_id
+    )
+    return enqueue_email(db, receiver_email, subject, html_content)
@@ -1,13 +1,14 @@
 from fastapi import APIRouter, Depends, Cookie, HTTPException, status, Body
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from datetime import timedelta
 from database import models, schemas, db as database 
-from . import utils
+from . import utils, hashing
 from database.schemas import ForgotPasswordRequest
 from datetime import datetime
 from jwt import PyJWTError
-from api.auth.utils import get_current_user
+from api.auth.utils import Principal, get_current_user
 
 router = APIRouter()
 
@@ -15,12 +16,12 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
 
 @router.post("/register", response_model=schemas.User)
-def register_user(user: schemas.UserCreate, db: Session = Depends(database.get_db)):
+async def register_user(user: schemas.UserCreate, db: AsyncSession = Depends(database.get_db)):
    # Check if the email is already registered
-    db_user = db.query(models.User).filter(models.User.email == user.email).first()
+    db_user = await db.scalar(select(models.User).filter(models.User.email == user.email))
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
-    hashed_password = utils.get_password_hash(user.password)
+    hashed_password = await hashing.hash_password(user.password)
     
     default_role_id = 2  
     
@@ -38,34 +39,46 @@ def register_user(user: schemas.UserCreate, db: Session = Depends(database.get_d
     
     # Add and commit the user to the database
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user, ["role"])
     
     return db_user
 
 
 # Login route
 @router.post("/login", response_model=schemas.Token)
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(database.get_db)):
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(database.get_db)):
     # OAuth2PasswordRequestForm uses 'username' field by default, which we are treating as email
-    user = db.query(models.User).filter(models.User.email == form_data.username).first()
-    
-    if not user or not utils.verify_password(form_data.password, user.hashed_password):
+    user = await db.scalar(select(models.User).filter(models.User.email == form_data.username))
+    if user:
+        email, stored_hash = user.email, user.hashed_password
+    # Hand the connection back to the pool while bcrypt runs
+    await db.commit()
+
+    verified, new_hash = False, None
+    if user:
+        verified, new_hash = await hashing.verify_and_update(form_data.password, stored_hash)
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    if new_hash:
+        # Stored hash was made with a different BCRYPT_ROUNDS; upgrade it in place
+        user.hashed_password = new_hash
+        await db.commit()
+
     access_token_expires = timedelta(minutes=utils.ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = utils.create_access_token(data={"sub": user.email}, expires_delta=access_token_expires)
-    refresh_token = utils.create_refresh_token(data={"sub": user.email})
+    access_token = utils.create_access_token(data={"sub": email}, expires_delta=access_token_expires)
+    refresh_token = utils.create_refresh_token(data={"sub": email})
 
     return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
 
 
 @router.post("/token/refresh", response_model=schemas.Token)
-def refresh_access_token(refresh_token: str = Body(...), db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
+async def refresh_access_token(refresh_token: str = Body(...), db: AsyncSession = Depends(database.get_db), current_user: Principal = Depends(get_current_user)):
     # Decode the refresh token
     try:
         payload = utils.decode_token(refresh_token)
@@ -82,7 +95,7 @@ def refresh_access_token(refresh_token: str = Body(...), db: Session = Depends(d
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token payload")
 
     # Fetch the user from the database
-    user = db.query(models.User).filter(models.User.email == email).first()
+    user = await db.scalar(select(models.User).filter(models.User.email == email))
     if user is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
 
@@ -95,51 +108,53 @@ def refresh_access_token(refresh_token: str = Body(...), db: Session = Depends(d
 
 # Change password route
 @router.post("/change-password", response_model=schemas.Message)
-def change_password(
+async def change_password(
     current_password: str = Body(...), 
     new_password: str = Body(...), 
-    db: Session = Depends(database.get_db), 
-    current_user: models.User = Depends(get_current_user) 
+    db: AsyncSession = Depends(database.get_db), 
+    current_user: Principal = Depends(get_current_user) 
 ):
-    if not utils.verify_password(current_password, current_user.hashed_password):
+    user = await db.get(models.User, current_user.id)
+    if not await hashing.verify_password(current_password, user.hashed_password):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Incorrect current password")
     
-    current_user.hashed_password = utils.get_password_hash(new_password)
-    db.commit()
+    user.hashed_password = await hashing.hash_password(new_password)
+    await db.commit()
     
     return {"message": "Password changed successfully"}
 
 
 
 @router.post("/forgot-password", response_model=schemas.Message)
-def forgot_password(request: ForgotPasswordRequest, db: Session = Depends(database.get_db)):
-    user = db.query(models.User).filter(models.User.email == request.email).first()
+async def forgot_password(request: ForgotPasswordRequest, db: AsyncSession = Depends(database.get_db)):
+    user = await db.scalar(select(models.User).filter(models.User.email == request.email))
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
     
     reset_token = utils.create_reset_token(data={"sub": user.email})
-    utils.send_reset_email(email=user.email, token=reset_token)
+    utils.queue_reset_email(db, email=user.email, token=reset_token)
+    await db.commit()
     
     return {"message": "If this email is registered, you will receive instructions to reset your password."}
 
 @router.post("/reset-password", response_model=schemas.Message)
-def reset_password(token: str = Body(...), new_password: str = Body(...), db: Session = Depends(database.get_db)):
+async def reset_password(token: str = Body(...), new_password: str = Body(...), db: AsyncSession = Depends(database.get_db)):
     email = utils.verify_reset_token(token)
     if email is None:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid or expired token")
 
-    user = db.query(models.User).filter(models.User.email == email).first()
+    user = await db.scalar(select(models.User).filter(models.User.email == email))
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
 
-    user.hashed_password = utils.get_password_hash(new_password)
-    db.commit()
+    user.hashed_password = await hashing.hash_password(new_password)
+    await db.commit()
 
     return {"message": "Password reset successfully"}
 
 @router.post("/logout", response_model=schemas.Message)
-def logout(
-    current_user: models.User = Depends(get_current_user), 
-    db: Session = Depends(database.get_db)
+async def logout(
+    current_user: Principal = Depends(get_current_user), 
+    db: AsyncSession = Depends(database.get_db)
 ):
     return {"message": "Logout successful"}
\ No newline at end of file
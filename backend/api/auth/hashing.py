@@ -0,0 +1,160 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from passlib.context import CryptContext
+from database.pool import Histogram
+import dotenv
+
+dotenv.load_dotenv()
+
+# bcrypt work factor. Pick it for the production hardware with
+#   python -m api.auth.hashing --target-ms 250
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# "process" (default) keeps bcrypt off the interpreter entirely; "thread"
+# still isolates it from Starlette's shared threadpool.
+HASH_EXECUTOR = os.getenv("HASH_EXECUTOR", "process")
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(os.cpu_count() or 2)))
+# Hash jobs admitted to the executor at once; further callers wait their turn
+HASH_MAX_PENDING = int(os.getenv("HASH_MAX_PENDING", str(4 * HASH_WORKERS)))
+
+# min/max pinned to the configured cost so verify_and_update() rehashes any
+# stored hash whose cost differs, in either direction.
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+
+def hash_sync(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def verify_and_update_sync(password: str, hashed_password: str):
+    return pwd_context.verify_and_update(password, hashed_password)
+
+
+class HashingStats:
+    def __init__(self):
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.latency = Histogram()
+
+    def snapshot(self) -> dict:
+        return {
+            "executor": HASH_EXECUTOR,
+            "workers": HASH_WORKERS,
+            "max_pending": HASH_MAX_PENDING,
+            "rounds": BCRYPT_ROUNDS,
+            "waiting": self.waiting,
+            "running": self.running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "latency_seconds": {"count": self.latency.count, "sum": self.latency.sum},
+        }
+
+
+stats = HashingStats()
+_executor = None
+_slots = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        if HASH_EXECUTOR == "thread":
+            _executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="bcrypt")
+        else:
+            _executor = ProcessPoolExecutor(
+                max_workers=HASH_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+    return _executor
+
+
+def shutdown_executor():
+    global _executor, _slots
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+    _executor = _slots = None
+
+
+async def run_hashing(fn, *args):
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(HASH_MAX_PENDING)
+
+    stats.waiting += 1
+    try:
+        await _slots.acquire()
+    finally:
+        stats.waiting -= 1
+
+    stats.running += 1
+    start = time.perf_counter()
+    try:
+        result = await asyncio.get_running_loop().run_in_executor(get_executor(), fn, *args)
+    except Exception:
+        stats.failed += 1
+        raise
+    else:
+        stats.completed += 1
+        return result
+    finally:
+        stats.running -= 1
+        stats.latency.observe(time.perf_counter() - start)
+        _slots.release()
+
+
+async def hash_password(password: str) -> str:
+    return await run_hashing(hash_sync, password)
+
+
+async def verify_password(password: str, hashed_password: str) -> bool:
+    verified, _ = await run_hashing(verify_and_update_sync, password, hashed_password)
+    return verified
+
+
+async def verify_and_update(password: str, hashed_password: str):
+    """
+    Returns (verified, new_hash). new_hash is set when the stored hash uses a
+    different cost than BCRYPT_ROUNDS and should replace it.
+    """
+    return await run_hashing(verify_and_update_sync, password, hashed_password)
+
+
+def calibrate(target_ms: float, min_rounds: int = 10, max_rounds: int = 16, samples: int = 3) -> int:
+    """
+    Returns the highest cost in [min_rounds, max_rounds] whose median hash
+    time on this machine stays within target_ms (min_rounds if none does).
+    """
+    chosen = min_rounds
+    for rounds in range(min_rounds, max_rounds + 1):
+        context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=rounds)
+        timings = []
+        for _ in range(samples):
+            start = time.perf_counter()
+            context.hash("calibration-password")
+            timings.append((time.perf_counter() - start) * 1000)
+        median = statistics.median(timings)
+        print(f"rounds={rounds}: {median:.1f} ms")
+        if median > target_ms:
+            break
+        chosen = rounds
+    return chosen
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pick the bcrypt cost for a target hashing latency.")
+    parser.add_argument("--target-ms", type=float, default=250.0)
+    parser.add_argument("--min-rounds", type=int, default=10)
+    parser.add_argument("--max-rounds", type=int, default=16)
+    args = parser.parse_args()
+    print(f"BCRYPT_ROUNDS={calibrate(args.target_ms, args.min_rounds, args.max_rounds)}")
@@ -1,15 +1,19 @@
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
 import os
 from datetime import datetime, timedelta, timezone
 from datetime import datetime, timedelta
-from smtplib import SMTP_SSL
+from dataclasses import dataclass
 from typing import Optional
 from jose import ExpiredSignatureError, JWTError, jwt 
-from passlib.context import CryptContext
 from fastapi import HTTPException, status, Request
-from sqlalchemy.orm import Session
-from database import models
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import inspect
+from sqlalchemy.orm import selectinload
+from database import models, schemas
+from database.events import after_commit_of
+from api.common.cache import MISSING, TTLCache
+from api.auth import hashing
+from api.common.outbox import enqueue_email
 from fastapi.security import OAuth2PasswordBearer
 from database import db as database
 from fastapi import Depends
@@ -22,10 +26,14 @@ ALGORITHM = os.getenv("ALGORITHM")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES"))
 REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS"))
 RESET_TOKEN_EXPIRE_MINUTES = int(os.getenv("RESET_TOKEN_EXPIRE_MINUTES"))
-EMAIL = os.getenv("EMAIL")
-PASSWORD = os.getenv("PASSWORD")
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "30"))
+# Role whose users may run admin-only actions, such as sending newsletters
+ADMIN_ROLE = os.getenv("ADMIN_ROLE", "admin")
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Shared with the hashing executor; routes should await api.auth.hashing
+# instead of calling these on the event loop.
+pwd_context = hashing.pwd_context
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
@@ -67,15 +75,83 @@ def decode_token(token: str):
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+def token_subject(token: str) -> Optional[str]:
+    """
+    Subject of a valid token, or None. Only for routing decisions such as
+    read-your-writes; access checks go through get_current_user.
+    """
+    try:
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+    except JWTError:
+        return None
+
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 
-def get_current_user(
+@dataclass(frozen=True)
+class Principal:
+    """
+    Detached snapshot of the authenticated user. It carries what routes read
+    from current_user (and what schemas.User serializes), but no session
+    state and no password hash; load the User row to change anything.
+    """
+    id: int
+    email: str
+    full_name: str
+    phone_number: Optional[str]
+    is_active: bool
+    role_id: Optional[int]
+    role: Optional[schemas.Role]
+    created_at: datetime
+    updated_at: datetime
+
+    @classmethod
+    def from_user(cls, user: models.User) -> "Principal":
+        return cls(
+            id=user.id,
+            email=user.email,
+            full_name=user.full_name,
+            phone_number=user.phone_number,
+            is_active=user.is_active,
+            role_id=user.role_id,
+            role=schemas.Role.model_validate(user.role) if user.role else None,
+            created_at=user.created_at,
+            updated_at=user.updated_at,
+        )
+
+
+# Principals keyed by token subject (email). Entries are dropped when the
+# user row is committed (password, role or activation changes) and live at
+# most PRINCIPAL_CACHE_TTL seconds, which bounds staleness for writes made
+# by other worker processes.
+principal_cache = TTLCache("principals", maxsize=PRINCIPAL_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL)
+
+
+def user_emails(user: models.User):
+    # Include the previous email as well when it is being changed
+    return (user.email, *inspect(user).attrs.email.history.deleted)
+
+
+@after_commit_of(models.User, snapshot=user_emails)
+def on_user_write(changes):
+    for emails in changes:
+        if emails is None:
+            principal_cache.invalidate()
+            return
+        for email in emails:
+            principal_cache.pop(email)
+
+
+@after_commit_of(models.Role)
+def on_role_write(changes):
+    principal_cache.invalidate()
+
+
+async def get_current_user(
     token: str = Depends(oauth2_scheme),
-    db: Session = Depends(database.get_db)
+    db: AsyncSession = Depends(database.get_db)
 ):
-    print (f"Token: {token}") 
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -83,9 +159,7 @@ def get_current_user(
     )
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        print(f"Decoded payload from token: {payload}") 
         email: str = payload.get("sub")
-        print(f"Decoded email from token: {email}") 
         if email is None:
             raise credentials_exception
     except JWTError as e:
@@ -93,29 +167,38 @@ def get_current_user(
         raise credentials_exception
 
 
-    user = db.query(models.User).filter(models.User.email == email).first()
+    principal = principal_cache.get(email)
+    if principal is not MISSING:
+        return principal
+    generation = principal_cache.generation
+
+    user = await db.scalar(
+        select(models.User)
+        .filter(models.User.email == email)
+        .options(selectinload(models.User.role))
+    )
     if user is None:
         raise credentials_exception
 
-    return user
+    principal = Principal.from_user(user)
+    principal_cache.set(email, principal, generation=generation)
+    return principal
+
 
+async def get_current_admin(current_user: Principal = Depends(get_current_user)) -> Principal:
+    if current_user.role is None or current_user.role.name != ADMIN_ROLE:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin role required")
+    return current_user
 
-def send_reset_email(email: str, token: str):
+
+def queue_reset_email(db, email: str, token: str):
+    """
+    Queues the reset link in the outbox; it is sent once the caller commits.
+    """
     reset_link = f"http://localhost:3000/auth/change-password?token={token}"
     subject = "Password Reset Request"
     body = f"Click the link to reset your password: {reset_link}"
-    
-    sender_email = EMAIL
-    sender_password = PASSWORD
-    message = MIMEMultipart()
-    message["From"] = sender_email
-    message["To"] = email
-    message["Subject"] = subject
-    message.attach(MIMEText(body, "plain"))
-
-    with SMTP_SSL("smtp.gmail.com", 465) as server:
-        server.login(sender_email, sender_password)
-        server.sendmail(sender_email, email, message.as_string())
+    return enqueue_email(db, email, subject, body, subtype="plain")
 
 def create_reset_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
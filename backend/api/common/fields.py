@@ -0,0 +1,152 @@
+import copy
+import functools
+import typing
+from typing import Optional
+from fastapi import HTTPException, status
+from pydantic import BaseModel, ConfigDict, create_model
+from sqlalchemy.orm import RelationshipProperty, load_only, selectinload
+
+
+def nested_schema(annotation):
+    """
+    The model class inside Optional[...] / List[...], or None for plain fields.
+    """
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return annotation
+    for arg in typing.get_args(annotation):
+        schema = nested_schema(arg)
+        if schema is not None:
+            return schema
+    return None
+
+
+def full_tree(schema) -> dict:
+    tree = {}
+    for name, field in schema.model_fields.items():
+        nested = nested_schema(field.annotation)
+        tree[name] = full_tree(nested) if nested is not None else {}
+    return tree
+
+
+def parse_fields(schema, fields: str) -> dict:
+    """
+    "id,name,category.name" -> {"id": {}, "name": {}, "category": {"name": {}}}.
+    A nested field without sub-fields means all of it.
+    """
+    tree = {}
+    for path in (part.strip() for part in fields.split(",")):
+        if not path:
+            continue
+        node, current = tree, schema
+        for name in path.split("."):
+            if current is None or name not in current.model_fields:
+                allowed = ", ".join(current.model_fields) if current is not None else "none"
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Unknown field '{path}'. Allowed here: {allowed}",
+                )
+            node = node.setdefault(name, {})
+            current = nested_schema(current.model_fields[name].annotation)
+    if not tree:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="fields is empty")
+    return tree
+
+
+def complete(schema, tree: dict) -> dict:
+    # Bare nested fields stand for the whole nested model
+    completed = {}
+    for name, subtree in tree.items():
+        nested = nested_schema(schema.model_fields[name].annotation)
+        if nested is None:
+            completed[name] = {}
+        else:
+            completed[name] = complete(nested, subtree) if subtree else full_tree(nested)
+    return completed
+
+
+def freeze(tree: dict) -> tuple:
+    return tuple(sorted((name, freeze(subtree)) for name, subtree in tree.items()))
+
+
+def replace_schema(annotation, schema, subset):
+    if annotation is schema:
+        return subset
+    args = typing.get_args(annotation)
+    if not args:
+        return annotation
+    return typing.get_origin(annotation)[tuple(replace_schema(arg, schema, subset) for arg in args)]
+
+
+@functools.lru_cache(maxsize=256)
+def subset_model(schema, frozen: tuple):
+    """
+    A model with only the chosen fields of schema (recursively), read from
+    attributes. Cached per distinct selection.
+    """
+    fields = {}
+    for name, subtree in frozen:
+        # create_model() sets the annotation on the FieldInfo it is given,
+        # which would otherwise rewrite schema's own field
+        field = copy.copy(schema.model_fields[name])
+        annotation = field.annotation
+        nested = nested_schema(annotation)
+        if nested is not None:
+            annotation = replace_schema(annotation, nested, subset_model(nested, subtree))
+        fields[name] = (annotation, field)
+    return create_model(
+        f"{schema.__name__}Fields",
+        __config__=ConfigDict(from_attributes=True),
+        **fields,
+    )
+
+
+def loader_options(model, tree: dict, always=()) -> list:
+    """
+    load_only() for the selected columns of model plus selectinload() for the
+    selected relationships, recursively. Foreign keys of many-to-one
+    relationships are kept so the related rows can still be fetched.
+    """
+    columns = [getattr(model, name) for name in always]
+    options = []
+    for name, subtree in tree.items():
+        attribute = getattr(model, name, None)
+        if attribute is None:
+            # Computed by the route, not loaded
+            continue
+        prop = attribute.property
+        if isinstance(prop, RelationshipProperty):
+            columns += [getattr(model, column.key) for column in prop.local_columns if column.key in model.__table__.c]
+            options.append(selectinload(attribute).options(*loader_options(prop.mapper.class_, subtree)))
+        else:
+            columns.append(attribute)
+    if not columns:
+        columns = [getattr(model, column.key) for column in model.__mapper__.primary_key]
+    return [load_only(*columns)] + options
+
+
+class FieldSet:
+    """
+    A ?fields= selection on a response schema backed by model. schema is the
+    model to validate and serialize with (the full schema when no fields are
+    given), options the loader options that fetch just what it reads, and
+    key a hashable form for cache keys and ETags.
+    """
+
+    def __init__(self, schema, model, fields: Optional[str] = None, always=()):
+        tree = complete(schema, parse_fields(schema, fields)) if fields else full_tree(schema)
+        self.key = freeze(tree) if fields else None
+        self.schema = subset_model(schema, self.key) if fields else schema
+        self.options = loader_options(model, tree, always)
+
+
+@functools.lru_cache(maxsize=256)
+def page_model(page_schema, item_schema):
+    """
+    page_schema with its items list holding item_schema instead.
+    """
+    items = page_schema.model_fields["items"]
+    if nested_schema(items.annotation) is item_schema:
+        return page_schema
+    fields = {name: (field.annotation, copy.copy(field)) for name, field in page_schema.model_fields.items()}
+    fields["items"] = (replace_schema(items.annotation, nested_schema(items.annotation), item_schema), fields["items"][1])
+    return create_model(f"{page_schema.__name__}Fields", **fields)
@@ -0,0 +1,270 @@
+import os
+import re
+import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+import dotenv
+
+dotenv.load_dotenv()
+
+TEMPLATE_DIR = os.getenv("TEMPLATE_DIR", "templates")
+
+# Defaults match the Gmail account the app has always used. For local runs
+# point SMTP_HOST/SMTP_PORT at a stand-in such as
+#   python -m aiosmtpd -n -l localhost:1025
+# with SMTP_SSL=0 and an empty SMTP_USERNAME to skip AUTH.
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "465"))
+SMTP_SSL = os.getenv("SMTP_SSL", "1").lower() not in ("0", "false", "no")
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "0").lower() not in ("0", "false", "no")
+SMTP_USERNAME = os.getenv("SMTP_USERNAME", os.getenv("EMAIL"))
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD", os.getenv("PASSWORD"))
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "10"))
+EMAIL_FROM = os.getenv("EMAIL_FROM", os.getenv("EMAIL"))
+# Persistent connections kept open to the SMTP server, and so the number of
+# messages a batch sends in parallel.
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", "4"))
+# Idle connections older than this are checked with NOOP before reuse
+SMTP_IDLE_CHECK_SECONDS = float(os.getenv("SMTP_IDLE_CHECK_SECONDS", "30"))
+# Providers cap messages per session (Gmail at about 100)
+SMTP_MAX_MESSAGES_PER_CONNECTION = int(os.getenv("SMTP_MAX_MESSAGES_PER_CONNECTION", "100"))
+
+
+PLACEHOLDER = re.compile(r"{{\s*(\w+)\s*}}")
+
+
+class Template:
+    """
+    An email template split once into literal text and {{ key }} placeholders.
+    Placeholders without a value are left as they are.
+    """
+
+    def __init__(self, source: str):
+        self.parts = PLACEHOLDER.split(source)
+
+    def render(self, **values) -> str:
+        parts = self.parts[:]
+        for i in range(1, len(parts), 2):
+            key = parts[i]
+            parts[i] = str(values[key]) if key in values else "{{ " + key + " }}"
+        return "".join(parts)
+
+
+TEMPLATES = {}
+
+
+def load_templates():
+    """
+    Reads and compiles every template under TEMPLATE_DIR. Called at startup.
+    """
+    for template_name in os.listdir(TEMPLATE_DIR):
+        if template_name.endswith(".html"):
+            get_template(template_name, reload=True)
+
+
+def get_template(template_name: str, reload: bool = False) -> Template:
+    template = TEMPLATES.get(template_name)
+    if template is None or reload:
+        try:
+            with open(os.path.join(TEMPLATE_DIR, template_name), 'r', encoding='utf-8') as file:
+                template = TEMPLATES[template_name] = Template(file.read())
+        except Exception as e:
+            print(f"Error reading email template: {e}")
+            raise Exception("Failed to read email template.")
+    return template
+
+
+def render_template(template_name: str, **values) -> str:
+    return get_template(template_name).render(**values)
+
+
+def build_message(recipient: str, subject: str, body: str, subtype: str = "html") -> MIMEMultipart:
+    message = MIMEMultipart('alternative')
+    message['Subject'] = subject
+    message['From'] = EMAIL_FROM
+    message['To'] = recipient
+    message.attach(MIMEText(body, subtype))
+    return message
+
+
+def connect() -> smtplib.SMTP:
+    if SMTP_SSL:
+        server = smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT)
+    else:
+        server = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT)
+        if SMTP_STARTTLS:
+            server.starttls()
+    if SMTP_USERNAME and SMTP_PASSWORD:
+        server.login(SMTP_USERNAME, SMTP_PASSWORD)
+    return server
+
+
+class PooledConnection:
+    def __init__(self, server: smtplib.SMTP):
+        self.server = server
+        self.sent = 0
+        self.last_used = time.monotonic()
+
+
+class SMTPPool:
+    """
+    Up to SMTP_POOL_SIZE logged-in SMTP connections reused across sends, so
+    the TLS handshake and AUTH are paid once per connection rather than once
+    per message. A connection is used by one thread at a time.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.connects = 0
+        self.reused = 0
+        self.sent = 0
+        self.failed = 0
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def checkout(self) -> PooledConnection:
+        self._slots.acquire()
+        try:
+            while True:
+                with self._lock:
+                    connection = self._idle.pop() if self._idle else None
+                if connection is None:
+                    return self.open()
+                if time.monotonic() - connection.last_used < SMTP_IDLE_CHECK_SECONDS or self.is_alive(connection):
+                    self.reused += 1
+                    return connection
+                self.close_connection(connection)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def checkin(self, connection: PooledConnection):
+        connection.last_used = time.monotonic()
+        if connection.sent >= SMTP_MAX_MESSAGES_PER_CONNECTION:
+            self.close_connection(connection)
+        else:
+            with self._lock:
+                self._idle.append(connection)
+        self._slots.release()
+
+    def discard(self, connection: PooledConnection):
+        connection.server.close()
+        self._slots.release()
+
+    def open(self) -> PooledConnection:
+        connection = PooledConnection(connect())
+        self.connects += 1
+        return connection
+
+    def is_alive(self, connection: PooledConnection) -> bool:
+        try:
+            return connection.server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def close_connection(self, connection: PooledConnection):
+        try:
+            connection.server.quit()
+        except (smtplib.SMTPException, OSError):
+            connection.server.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            self.close_connection(connection)
+
+    def stats(self) -> dict:
+        return {
+            "pool_size": self.size,
+            "idle": len(self._idle),
+            "connects": self.connects,
+            "reused": self.reused,
+            "sent": self.sent,
+            "failed": self.failed,
+        }
+
+
+pool = SMTPPool(SMTP_POOL_SIZE)
+_senders = ThreadPoolExecutor(max_workers=SMTP_POOL_SIZE, thread_name_prefix="smtp")
+
+
+def send_batch(messages: list) -> list:
+    """
+    Sends (recipient, subject, body, subtype) tuples in order over one pooled
+    connection and returns an exception or None per message. A dropped
+    connection is replaced once per message; if no connection can be opened
+    the remaining messages fail with that error.
+    """
+    results = []
+    connection = None
+    try:
+        for recipient, subject, body, subtype in messages:
+            data = build_message(recipient, subject, body, subtype).as_string()
+            error = None
+            for attempt in range(2):
+                if connection is None:
+                    try:
+                        connection = pool.checkout()
+                    except (smtplib.SMTPException, OSError) as e:
+                        failed = len(messages) - len(results)
+                        pool.failed += failed
+                        return results + [e] * failed
+                try:
+                    connection.server.sendmail(EMAIL_FROM, recipient, data)
+                    connection.sent += 1
+                    error = None
+                    break
+                except (smtplib.SMTPServerDisconnected, OSError) as e:
+                    # Stale or broken connection; retry on a fresh one
+                    error = e
+                    pool.discard(connection)
+                    connection = None
+                except smtplib.SMTPException as e:
+                    # Refused by the server; the connection itself is fine
+                    error = e
+                    break
+            results.append(error)
+            if error is None:
+                pool.sent += 1
+            else:
+                pool.failed += 1
+    finally:
+        if connection is not None:
+            pool.checkin(connection)
+    return results
+
+
+def send_many(messages: list, concurrency: int = None) -> list:
+    """
+    Sends (recipient, subject, body, subtype) tuples spread over up to
+    concurrency pooled connections in parallel. Returns an exception or None
+    per message, in order. Blocking; call it from a worker thread.
+
+    smtplib does not implement SMTP PIPELINING, so each message still costs
+    its MAIL/RCPT/DATA round trips. The saving comes from skipping the
+    connect, TLS and AUTH steps and from using several connections at once.
+    """
+    if not messages:
+        return []
+    workers = min(concurrency or pool.size, pool.size, len(messages))
+    chunks = [messages[i::workers] for i in range(workers)]
+    chunk_results = list(_senders.map(send_batch, chunks))
+    results = [None] * len(messages)
+    for i, chunk in enumerate(chunk_results):
+        results[i::workers] = chunk
+    return results
+
+
+def send_message(recipient: str, subject: str, body: str, subtype: str = "html"):
+    """
+    Delivers one message over a pooled connection, raising on failure.
+    Blocking; call it from a worker thread.
+    """
+    error = send_batch([(recipient, subject, body, subtype)])[0]
+    if error is not None:
+        raise error
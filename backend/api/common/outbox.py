@@ -0,0 +1,157 @@
+import asyncio
+import datetime
+import os
+import random
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, select
+from api.common import mailer
+from database import models, db as database
+from database.events import after_commit_of
+import dotenv
+
+dotenv.load_dotenv()
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+# Upper bound on delivery latency; commits that queue mail wake the worker early
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "5"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_RETRY_BASE_SECONDS = float(os.getenv("OUTBOX_RETRY_BASE_SECONDS", "30"))
+OUTBOX_RETRY_MAX_SECONDS = float(os.getenv("OUTBOX_RETRY_MAX_SECONDS", "3600"))
+
+_worker_loop = None
+_wakeup = None
+
+
+def enqueue_email(db, recipient: str, subject: str, body: str, subtype: str = "html") -> models.EmailOutbox:
+    """
+    Adds a message to the outbox. Nothing is sent until the caller commits,
+    and nothing is sent at all if it rolls back.
+    """
+    message = models.EmailOutbox(
+        recipient=recipient,
+        subject=subject,
+        body=body,
+        subtype=subtype,
+        status=models.OutboxStatus.PENDING,
+    )
+    db.add(message)
+    return message
+
+
+def retry_delay(attempts: int) -> float:
+    """
+    Exponential backoff with jitter, capped at OUTBOX_RETRY_MAX_SECONDS.
+    """
+    delay = min(OUTBOX_RETRY_BASE_SECONDS * 2 ** (attempts - 1), OUTBOX_RETRY_MAX_SECONDS)
+    return delay * random.uniform(0.5, 1.0)
+
+
+async def process_outbox_batch(db, batch_size: int = OUTBOX_BATCH_SIZE) -> int:
+    """
+    Attempts delivery of the next batch of due messages and records the
+    outcome. Returns the number of messages attempted.
+
+    Rows stay locked (SKIP LOCKED for other workers) until the outcome is
+    committed. A crash between sending and committing resends the batch, so
+    delivery is at least once.
+    """
+    now = datetime.datetime.now()
+    messages = (await db.scalars(
+        select(models.EmailOutbox)
+        .filter(
+            models.EmailOutbox.status == models.OutboxStatus.PENDING,
+            models.EmailOutbox.next_attempt_at <= now,
+        )
+        .order_by(models.EmailOutbox.next_attempt_at, models.EmailOutbox.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )).all()
+    if not messages:
+        await db.rollback()
+        return 0
+
+    errors = await run_in_threadpool(mailer.send_many, [
+        (message.recipient, message.subject, message.body, message.subtype) for message in messages
+    ])
+    now = datetime.datetime.now()
+    for message, error in zip(messages, errors):
+        message.attempts += 1
+        if error is None:
+            message.status = models.OutboxStatus.SENT
+            message.sent_at = now
+            message.last_error = None
+        elif message.attempts >= OUTBOX_MAX_ATTEMPTS:
+            message.status = models.OutboxStatus.FAILED
+            message.last_error = str(error)[:500]
+            print(f"Giving up on email {message.id} to {message.recipient} after {message.attempts} attempts: {error}")
+        else:
+            message.next_attempt_at = now + datetime.timedelta(seconds=retry_delay(message.attempts))
+            message.last_error = str(error)[:500]
+            print(f"Failed to send email {message.id} to {message.recipient}, will retry: {error}")
+
+    await db.commit()
+    return len(messages)
+
+
+async def drain_outbox(batch_size: int = OUTBOX_BATCH_SIZE) -> int:
+    """
+    Processes batches until no message is due.
+    """
+    total = 0
+    async with database.session_scope() as db:
+        while True:
+            processed = await process_outbox_batch(db, batch_size)
+            total += processed
+            if processed < batch_size:
+                return total
+
+
+async def outbox_status(db) -> dict:
+    rows = (await db.execute(
+        select(
+            models.EmailOutbox.status,
+            func.count(models.EmailOutbox.id),
+            func.min(models.EmailOutbox.created_at),
+        ).group_by(models.EmailOutbox.status)
+    )).all()
+    counts = {status.value: 0 for status in models.OutboxStatus}
+    oldest_pending = None
+    for status, count, oldest in rows:
+        counts[models.OutboxStatus(status).value] = count
+        if models.OutboxStatus(status) == models.OutboxStatus.PENDING:
+            oldest_pending = oldest
+    return {"counts": counts, "oldest_pending": oldest_pending, "smtp": mailer.pool.stats()}
+
+
+@after_commit_of(models.EmailOutbox, snapshot=lambda message: message.status)
+def on_outbox_write(changes):
+    # Commits may happen on a threadpool thread (sync sessions)
+    if _worker_loop is None or (models.OutboxStatus.PENDING not in changes and None not in changes):
+        return
+    try:
+        _worker_loop.call_soon_threadsafe(_wakeup.set)
+    except RuntimeError:
+        pass
+
+
+async def run_outbox_worker(interval: float = OUTBOX_POLL_SECONDS):
+    global _worker_loop, _wakeup
+    _worker_loop = asyncio.get_running_loop()
+    _wakeup = asyncio.Event()
+    try:
+        while True:
+            _wakeup.clear()
+            try:
+                await drain_outbox()
+            except Exception as e:
+                print(f"Error draining email outbox: {e}")
+            try:
+                await asyncio.wait_for(_wakeup.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        _worker_loop = _wakeup = None
+
+
+if __name__ == "__main__":
+    print(f"Attempted {asyncio.run(drain_outbox())} emails")
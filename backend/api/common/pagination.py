@@ -0,0 +1,58 @@
+import base64
+import datetime
+from typing import Optional
+from fastapi import HTTPException, status
+from sqlalchemy import tuple_
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(created_at: datetime.datetime, row_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, row_id = raw.rsplit("|", 1)
+        return datetime.datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+async def keyset_page(db, query, created_at_column, id_column, limit: int, after: Optional[str] = None, before: Optional[str] = None):
+    """
+    Returns (rows, next_cursor, prev_cursor) for query, newest first, keyed on
+    (created_at, id). The row-value comparison plus ORDER BY on the same pair
+    lets the database walk a (created_at, id) index straight to the page, so
+    deep pages cost the same as the first one.
+    """
+    if after and before:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Use either 'after' or 'before', not both")
+
+    key = tuple_(created_at_column, id_column)
+    if before:
+        # Walk backwards (oldest first) from the cursor, then flip the page
+        query = query.filter(key > tuple_(*decode_cursor(before)))
+        query = query.order_by(created_at_column.asc(), id_column.asc())
+    else:
+        if after:
+            query = query.filter(key < tuple_(*decode_cursor(after)))
+        query = query.order_by(created_at_column.desc(), id_column.desc())
+
+    rows = (await db.scalars(query.limit(limit + 1))).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if before:
+        rows = rows[::-1]
+
+    next_cursor = prev_cursor = None
+    if rows:
+        first, last = rows[0], rows[-1]
+        if (has_more and not before) or before:
+            next_cursor = encode_cursor(last.created_at, last.id)
+        if after or (before and has_more):
+            prev_cursor = encode_cursor(first.created_at, first.id)
+    return rows, next_cursor, prev_cursor
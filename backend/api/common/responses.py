@@ -0,0 +1,107 @@
+import functools
+import gzip
+import os
+from typing import Optional
+import brotli
+from fastapi import Response
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware, GZipResponder
+from pydantic import TypeAdapter
+import dotenv
+
+dotenv.load_dotenv()
+
+# Bodies smaller than this are not worth compressing (also used by GZipMiddleware)
+COMPRESS_MINIMUM_SIZE = int(os.getenv("COMPRESS_MINIMUM_SIZE", "1000"))
+# Pre-encoded payloads are compressed once per cache fill, so favour size
+PAYLOAD_GZIP_LEVEL = int(os.getenv("PAYLOAD_GZIP_LEVEL", "9"))
+PAYLOAD_BROTLI_QUALITY = int(os.getenv("PAYLOAD_BROTLI_QUALITY", "9"))
+
+
+@functools.lru_cache(maxsize=None)
+def type_adapter(response_type) -> TypeAdapter:
+    # Building an adapter compiles its validator and serializer; do it once per type
+    return TypeAdapter(response_type)
+
+
+def json_response(response_type, content, from_attributes: bool = False, headers: dict = None, status_code: int = 200) -> Response:
+    """
+    Serializes content as response_type straight to JSON bytes with a cached
+    TypeAdapter. FastAPI skips response_model handling for a returned
+    Response, so content is checked once here instead of being validated,
+    converted to dicts and then encoded. content must already be of
+    response_type (models built by the route, or cached ones), or ORM objects
+    with from_attributes=True, which are validated in the same pass.
+    Keep response_model on the route for the OpenAPI schema.
+    """
+    adapter = type_adapter(response_type)
+    if from_attributes:
+        content = adapter.validate_python(content, from_attributes=True)
+    return Response(adapter.dump_json(content), status_code=status_code, headers=headers, media_type="application/json")
+
+
+def negotiate_encoding(accept_encoding: Optional[str], available) -> str:
+    """
+    Picks the Accept-Encoding coding with the highest q among available,
+    preferring br over gzip on ties; "identity" when none is acceptable.
+    """
+    weights = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        weight = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[name] = weight
+
+    best, best_weight = "identity", 0.0
+    for encoding in ("br", "gzip"):
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if encoding in available and weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+class EncodedPayload:
+    """
+    A response body kept ready in every content coding served (identity,
+    gzip and br), so a cache hit only picks one and writes it out.
+    """
+
+    def __init__(self, body: bytes, media_type: str = "application/json"):
+        self.media_type = media_type
+        self.bodies = {"identity": body}
+        if len(body) >= COMPRESS_MINIMUM_SIZE:
+            self.bodies["gzip"] = gzip.compress(body, compresslevel=PAYLOAD_GZIP_LEVEL, mtime=0)
+            self.bodies["br"] = brotli.compress(body, quality=PAYLOAD_BROTLI_QUALITY)
+
+    def response(self, accept_encoding: Optional[str], headers: dict = None) -> Response:
+        encoding = negotiate_encoding(accept_encoding, self.bodies)
+        headers = dict(headers or {})
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(self.bodies[encoding], headers=headers, media_type=self.media_type)
+
+
+class NegotiatedGZipMiddleware(GZipMiddleware):
+    """
+    GZipMiddleware that honours q-values ("gzip;q=0" means no gzip) instead
+    of looking for "gzip" anywhere in Accept-Encoding. Responses that already
+    carry a Content-Encoding pass through untouched.
+    """
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            accept_encoding = Headers(scope=scope).get("Accept-Encoding")
+            if negotiate_encoding(accept_encoding, ("gzip",)) == "gzip":
+                responder = GZipResponder(self.app, self.minimum_size, compresslevel=self.compresslevel)
+                await responder(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
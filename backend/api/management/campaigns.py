@@ -0,0 +1,266 @@
+import argparse
+import asyncio
+import datetime
+import os
+import socket
+import time
+import uuid
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import or_, select, update
+from api.common import mailer
+from database import models, db as database
+import dotenv
+
+dotenv.load_dotenv()
+
+# Subscribers read, rendered and checkpointed together
+CAMPAIGN_BATCH_SIZE = int(os.getenv("CAMPAIGN_BATCH_SIZE", "200"))
+# Messages in flight at once, capped by the SMTP pool size
+CAMPAIGN_CONCURRENCY = int(os.getenv("CAMPAIGN_CONCURRENCY", str(mailer.SMTP_POOL_SIZE)))
+# Average send rate ceiling, to stay under the provider's limits
+CAMPAIGN_RATE_PER_SECOND = float(os.getenv("CAMPAIGN_RATE_PER_SECOND", "10"))
+# How long a sender's claim on a campaign lasts without a checkpoint. A batch
+# has to be sent within it; a crashed sender's campaign is free after it.
+CAMPAIGN_LEASE_SECONDS = float(os.getenv("CAMPAIGN_LEASE_SECONDS", "300"))
+
+# Names this process in NewsletterCampaign.lease_owner
+PROCESS_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# Campaign id -> task sending it in this process
+running_campaigns = {}
+
+
+class RateLimiter:
+    """
+    Spaces out acquire(count) calls so that on average no more than rate
+    messages per second are released.
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0
+        self.next_at = time.monotonic()
+
+    async def acquire(self, count: int = 1):
+        now = time.monotonic()
+        start = max(self.next_at, now)
+        self.next_at = start + count * self.interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+
+async def next_subscribers(db, after_id: int, limit: int):
+    # Keyset on the primary key; each batch is a short indexed read
+    return (await db.execute(
+        select(models.NewsletterUser.id, models.NewsletterUser.email)
+        .filter(models.NewsletterUser.id > after_id)
+        .order_by(models.NewsletterUser.id)
+        .limit(limit)
+    )).all()
+
+
+def lease_expiry() -> datetime.datetime:
+    return datetime.datetime.now() + datetime.timedelta(seconds=CAMPAIGN_LEASE_SECONDS)
+
+
+def lease_held_elsewhere(campaign: models.NewsletterCampaign) -> bool:
+    return (
+        campaign.lease_owner not in (None, PROCESS_ID)
+        and campaign.lease_expires_at is not None
+        and campaign.lease_expires_at > datetime.datetime.now()
+    )
+
+
+async def claim_campaign(db, campaign_id: int) -> bool:
+    """
+    Takes the sending lease of a RUNNING campaign in one conditional UPDATE.
+    Of several processes claiming at once (e.g. every worker resuming at
+    startup) exactly one wins; the others must not send anything.
+    """
+    result = await db.execute(
+        update(models.NewsletterCampaign)
+        .where(
+            models.NewsletterCampaign.id == campaign_id,
+            models.NewsletterCampaign.status == models.CampaignStatus.RUNNING,
+            or_(
+                models.NewsletterCampaign.lease_owner.is_(None),
+                models.NewsletterCampaign.lease_owner == PROCESS_ID,
+                models.NewsletterCampaign.lease_expires_at < datetime.datetime.now(),
+            ),
+        )
+        .values(lease_owner=PROCESS_ID, lease_expires_at=lease_expiry())
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    return result.rowcount == 1
+
+
+async def release_campaign(db, campaign_id: int):
+    await db.execute(
+        update(models.NewsletterCampaign)
+        .where(models.NewsletterCampaign.id == campaign_id, models.NewsletterCampaign.lease_owner == PROCESS_ID)
+        .values(lease_owner=None, lease_expires_at=None)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+
+
+async def save_checkpoint(db, campaign_id: int, previous_id: int, values: dict) -> bool:
+    """
+    Applies values, and renews this process's lease, only if the checkpoint
+    is still at previous_id and the lease is still ours, so two senders of
+    the same campaign cannot both advance it.
+    """
+    result = await db.execute(
+        update(models.NewsletterCampaign)
+        .where(
+            models.NewsletterCampaign.id == campaign_id,
+            models.NewsletterCampaign.last_subscriber_id == previous_id,
+            models.NewsletterCampaign.status.in_([models.CampaignStatus.RUNNING, models.CampaignStatus.PAUSED]),
+            models.NewsletterCampaign.lease_owner == PROCESS_ID,
+        )
+        .values(lease_expires_at=lease_expiry(), **values)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    return result.rowcount == 1
+
+
+async def mark_running(db, campaign: models.NewsletterCampaign):
+    campaign.status = models.CampaignStatus.RUNNING
+    if campaign.started_at is None:
+        campaign.started_at = datetime.datetime.now()
+    await db.commit()
+
+
+async def send_campaign(campaign_id: int, batch_size: int = None, concurrency: int = None, rate: float = None):
+    """
+    Mails every subscriber after the campaign's checkpoint in id order,
+    checkpointing progress and statistics after each batch. Does nothing
+    unless it wins the campaign's lease. Stops after the current batch when
+    the campaign is paused. Calling it again resumes after the last
+    checkpoint; only a batch interrupted mid-send can be sent twice.
+    """
+    batch_size = batch_size or CAMPAIGN_BATCH_SIZE
+    concurrency = min(concurrency or CAMPAIGN_CONCURRENCY, mailer.SMTP_POOL_SIZE)
+    limiter = RateLimiter(rate or CAMPAIGN_RATE_PER_SECOND)
+
+    async with database.session_scope() as db:
+        if not await claim_campaign(db, campaign_id):
+            print(f"Campaign {campaign_id} is not running or is being sent by another process")
+            return
+        try:
+            await send_batches(db, campaign_id, batch_size, concurrency, limiter)
+        finally:
+            await release_campaign(db, campaign_id)
+
+
+async def send_batches(db, campaign_id: int, batch_size: int, concurrency: int, limiter: RateLimiter):
+    campaign = await db.get(models.NewsletterCampaign, campaign_id)
+    template = mailer.Template(campaign.body)
+    subject = campaign.subject
+    last_id = campaign.last_subscriber_id
+    await db.commit()
+
+    while True:
+        subscribers = await next_subscribers(db, last_id, batch_size)
+        await db.commit()
+        if not subscribers:
+            await save_checkpoint(db, campaign_id, last_id, {
+                "status": models.CampaignStatus.COMPLETED,
+                "finished_at": datetime.datetime.now(),
+            })
+            return
+
+        started = time.monotonic()
+        messages = [
+            (subscriber.email, subject, template.render(email=subscriber.email), "html")
+            for subscriber in subscribers
+        ]
+        errors = []
+        for i in range(0, len(messages), concurrency):
+            chunk = messages[i:i + concurrency]
+            await limiter.acquire(len(chunk))
+            errors += await run_in_threadpool(mailer.send_many, chunk, concurrency)
+
+        failures = [error for error in errors if error is not None]
+        values = {
+            "last_subscriber_id": subscribers[-1].id,
+            "sent_count": models.NewsletterCampaign.sent_count + len(errors) - len(failures),
+            "failed_count": models.NewsletterCampaign.failed_count + len(failures),
+            "send_seconds": models.NewsletterCampaign.send_seconds + (time.monotonic() - started),
+        }
+        if failures:
+            values["last_error"] = str(failures[-1])[:500]
+            print(f"Campaign {campaign_id}: {len(failures)} of {len(errors)} emails failed: {failures[-1]}")
+        if not await save_checkpoint(db, campaign_id, last_id, values):
+            print(f"Campaign {campaign_id} was advanced by another sender, stopping")
+            return
+        last_id = subscribers[-1].id
+
+        status = await db.scalar(
+            select(models.NewsletterCampaign.status).filter(models.NewsletterCampaign.id == campaign_id)
+        )
+        await db.commit()
+        if status != models.CampaignStatus.RUNNING:
+            return
+
+
+async def run_campaign(campaign_id: int):
+    try:
+        await send_campaign(campaign_id)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        print(f"Error sending campaign {campaign_id}: {e}")
+
+
+def start_campaign(campaign_id: int) -> bool:
+    """
+    Starts sending in the background unless this process already is.
+    """
+    task = running_campaigns.get(campaign_id)
+    if task is not None and not task.done():
+        return False
+    task = asyncio.create_task(run_campaign(campaign_id))
+    running_campaigns[campaign_id] = task
+
+    def forget(done):
+        if running_campaigns.get(campaign_id) is done:
+            del running_campaigns[campaign_id]
+
+    task.add_done_callback(forget)
+    return True
+
+
+async def resume_campaigns():
+    """
+    Restarts campaigns left RUNNING by a previous process. Every worker
+    calls this at startup; claim_campaign lets only one of them send each.
+    """
+    async with database.session_scope() as db:
+        campaign_ids = (await db.scalars(
+            select(models.NewsletterCampaign.id).filter(models.NewsletterCampaign.status == models.CampaignStatus.RUNNING)
+        )).all()
+    for campaign_id in campaign_ids:
+        start_campaign(campaign_id)
+
+
+def stop_campaigns():
+    for task in running_campaigns.values():
+        task.cancel()
+
+
+async def main(campaign_id: int):
+    async with database.session_scope() as db:
+        campaign = await db.get(models.NewsletterCampaign, campaign_id)
+        if campaign is None or campaign.status == models.CampaignStatus.COMPLETED:
+            print(f"Campaign {campaign_id} not found or already completed")
+            return
+        await mark_running(db, campaign)
+    await send_campaign(campaign_id)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Send or resume a newsletter campaign in the foreground.")
+    parser.add_argument("campaign_id", type=int)
+    asyncio.run(main(parser.parse_args().campaign_id))
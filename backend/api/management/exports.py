@@ -0,0 +1,111 @@
+import csv
+import datetime
+import io
+import json
+from sqlalchemy import func, select
+from database import models, db as database
+
+# Rows fetched per round trip from the server-side cursor. Only one batch is
+# held in memory at a time, whatever the size of the table.
+EXPORT_BATCH_SIZE = 1000
+
+
+def sales_export_query(date_from: datetime.datetime = None, date_to: datetime.datetime = None):
+    query = (
+        select(
+            models.SalesRecord.id,
+            models.SalesRecord.order_id,
+            models.SalesRecord.user_id,
+            models.User.email.label("user_email"),
+            models.SalesRecord.buyer_name,
+            models.SalesRecord.date_of_sale,
+            models.SalesRecord.price,
+        )
+        .outerjoin(models.User, models.User.id == models.SalesRecord.user_id)
+        .order_by(models.SalesRecord.id)
+    )
+    if date_from:
+        query = query.filter(models.SalesRecord.date_of_sale >= date_from)
+    if date_to:
+        query = query.filter(models.SalesRecord.date_of_sale < date_to)
+    return query
+
+
+def orders_export_query(date_from: datetime.datetime = None, date_to: datetime.datetime = None):
+    item_totals = (
+        select(
+            models.OrderItem.order_id,
+            func.count(models.OrderItem.id).label("item_count"),
+            func.sum(models.OrderItem.quantity).label("units"),
+        )
+        .group_by(models.OrderItem.order_id)
+        .subquery()
+    )
+    query = (
+        select(
+            models.Order.id,
+            models.Order.user_id,
+            models.User.email.label("user_email"),
+            models.Order.status,
+            models.Order.total_price,
+            func.coalesce(item_totals.c.item_count, 0).label("item_count"),
+            func.coalesce(item_totals.c.units, 0).label("units"),
+            models.Order.created_at,
+            models.Order.updated_at,
+        )
+        .outerjoin(models.User, models.User.id == models.Order.user_id)
+        .outerjoin(item_totals, item_totals.c.order_id == models.Order.id)
+        .order_by(models.Order.id)
+    )
+    if date_from:
+        query = query.filter(models.Order.created_at >= date_from)
+    if date_to:
+        query = query.filter(models.Order.created_at < date_to)
+    return query
+
+
+def to_plain(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if hasattr(value, "value"):
+        return value.value
+    return value
+
+
+def encode_csv(columns, rows, include_header: bool) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if include_header:
+        writer.writerow(columns)
+    for row in rows:
+        writer.writerow([to_plain(value) for value in row])
+    return buffer.getvalue()
+
+
+def encode_ndjson(columns, rows) -> str:
+    return "".join(
+        json.dumps({column: to_plain(value) for column, value in zip(columns, row)}) + "\n"
+        for row in rows
+    )
+
+
+async def stream_export(query, export_format: str):
+    """
+    Yields the encoded export one cursor batch at a time. The generator owns
+    its session so the cursor stays open for as long as the response streams.
+    """
+    columns = list(query.selected_columns.keys())
+    query = query.execution_options(yield_per=EXPORT_BATCH_SIZE)
+
+    # Long-running full reads are what the replica is for
+    async with database.session_scope(replica=True) as db:
+        result = await db.stream(query)
+        wrote_header = False
+        async for rows in result.partitions(EXPORT_BATCH_SIZE):
+            if export_format == "csv":
+                yield encode_csv(columns, rows, include_header=not wrote_header)
+                wrote_header = True
+            else:
+                yield encode_ndjson(columns, rows)
+        if export_format == "csv" and not wrote_header:
+            yield encode_csv(columns, [], include_header=True)
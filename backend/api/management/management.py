@@ -1,10 +1,26 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session, joinedload
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from typing import List, Optional
+import datetime
 from database import models, schemas, db as database
+from database.loaders import Loaders, get_loaders
+from database.pool import POOL_METRICS
+from api.common.cache import CACHES
+from api.auth import hashing
+from api.auth.utils import Principal, get_current_admin
+from api.common.outbox import drain_outbox, outbox_status
+from api.common.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, keyset_page
+from api.common.responses import json_response
 import dotenv
 import os
-from .utils import send_contact_email
+from .utils import queue_contact_email
+from .exports import orders_export_query, sales_export_query, stream_export
+from .rollups import bucket_start, refresh_rollups
+from .campaigns import lease_held_elsewhere, mark_running, running_campaigns, start_campaign
 
 
 dotenv.load_dotenv()
@@ -17,10 +33,35 @@ RESET_TOKEN_EXPIRE_MINUTES = int(os.getenv("RESET_TOKEN_EXPIRE_MINUTES"))
 
 router = APIRouter()
 
-def to_order_response(db_order: models.Order, db: Session) -> schemas.OrderResponse:
-    db_user = db.query(models.User).filter(models.User.id == db_order.user_id).first()
+ORDER_ITEMS_LOADER = (
+    selectinload(models.Order.items)
+    .selectinload(models.OrderItem.product)
+    .selectinload(models.Product.category)
+)
 
-    db_address = db.query(models.Address).filter(models.Address.user_id == db_order.user_id).first()
+# Everything to_order_response reads, loaded as one IN-batched query per
+# relationship so the number of round trips does not grow with the orders.
+ORDER_RESPONSE_LOADERS = (
+    ORDER_ITEMS_LOADER,
+    selectinload(models.Order.user).selectinload(models.User.role),
+    selectinload(models.Order.user).selectinload(models.User.address),
+)
+
+SALES_RECORD_LOADERS = (
+    selectinload(models.SalesRecord.user).selectinload(models.User.role),
+    selectinload(models.SalesRecord.order)
+    .selectinload(models.Order.items)
+    .selectinload(models.OrderItem.product)
+    .selectinload(models.Product.category),
+)
+
+
+def to_order_response(db_order: models.Order) -> schemas.OrderResponse:
+    """
+    Expects db_order to be loaded with ORDER_RESPONSE_LOADERS.
+    """
+    db_user = db_order.user
+    db_address = db_user.address[0] if db_user and db_user.address else None
 
     user_schema = None
     if db_user:
@@ -80,28 +121,23 @@ def to_order_response(db_order: models.Order, db: Session) -> schemas.OrderRespo
 
 
 @router.get("/sales", response_model=List[schemas.SalesRecord])
-def get_sales_records(db: Session = Depends(database.get_db)):
+async def get_sales_records(db: AsyncSession = Depends(database.get_read_db)):
     """
     Retrieve all sales records along with user and order details.
     """
-    sales_records = (
-        db.query(models.SalesRecord)
-        .options(
-            joinedload(models.SalesRecord.user),   
-            joinedload(models.SalesRecord.order)    
-        )
-        .all()
-    )
-    return sales_records
+    sales_records = (await db.scalars(
+        select(models.SalesRecord)
+        .options(*SALES_RECORD_LOADERS)
+    )).all()
+    return json_response(List[schemas.SalesRecord], sales_records, from_attributes=True)
 
 
 @router.post("/sales", response_model=schemas.SalesRecord)
-def create_sales_record(request: schemas.SalesRecordCreate, db: Session = Depends(database.get_db)):
+async def create_sales_record(request: schemas.SalesRecordCreate, db: AsyncSession = Depends(database.get_db)):
     # Check if a sales record with the same user_id and order_id already exists
-    existing_sales_record = (
-        db.query(models.SalesRecord)
+    existing_sales_record = await db.scalar(
+        select(models.SalesRecord)
         .filter(models.SalesRecord.user_id == request.user_id, models.SalesRecord.order_id == request.order_id)
-        .first()
     )
     
     if existing_sales_record:
@@ -119,46 +155,116 @@ def create_sales_record(request: schemas.SalesRecordCreate, db: Session = Depend
         price=request.price,
     )
     db.add(db_sales_record)
-    db.commit()
-    db.refresh(db_sales_record)
+    try:
+        await db.commit()
+    except IntegrityError:
+        # Lost a race with a concurrent create (uq_sales_user_id_order_id)
+        await db.rollback()
+        raise HTTPException(
+            status_code=400, 
+            detail="A sales record for this user and order already exists."
+        )
+
+    # Reload with the user and order for the response
+    db_sales_record = await db.scalar(
+        select(models.SalesRecord)
+        .filter(models.SalesRecord.id == db_sales_record.id)
+        .options(*SALES_RECORD_LOADERS)
+    )
     return db_sales_record
 
 
-@router.get("/orders", response_model=List[schemas.OrderResponse])
-def get_all_orders_with_address(db: Session = Depends(database.get_db)):
+EXPORT_MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+def export_response(query, name: str, export_format: str) -> StreamingResponse:
+    return StreamingResponse(
+        stream_export(query, export_format),
+        media_type=EXPORT_MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{name}.{export_format}"'},
+    )
+
+
+@router.get("/export/sales")
+async def export_sales(
+    export_format: str = Query("csv", alias="format", pattern="^(csv|ndjson)$"),
+    date_from: Optional[datetime.datetime] = None,
+    date_to: Optional[datetime.datetime] = None,
+    admin: Principal = Depends(get_current_admin),
+):
     """
-    Get all orders along with user details, addresses, and order items.
+    Stream sales records (optionally within [date_from, date_to)) as CSV or NDJSON.
     """
-    orders = db.query(models.Order).all()
-    if not orders:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="No orders found"
-        )
-    return [to_order_response(order, db) for order in orders]
+    return export_response(sales_export_query(date_from, date_to), "sales", export_format)
+
+
+@router.get("/export/orders")
+async def export_orders(
+    export_format: str = Query("csv", alias="format", pattern="^(csv|ndjson)$"),
+    date_from: Optional[datetime.datetime] = None,
+    date_to: Optional[datetime.datetime] = None,
+    admin: Principal = Depends(get_current_admin),
+):
+    """
+    Stream orders (optionally created within [date_from, date_to)) as CSV or NDJSON.
+    """
+    return export_response(orders_export_query(date_from, date_to), "orders", export_format)
+
+
+@router.get("/orders", response_model=schemas.OrderResponsePage)
+async def get_all_orders_with_address(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    order_status: Optional[schemas.OrderStatusEnum] = Query(None, alias="status"),
+    created_from: Optional[datetime.datetime] = None,
+    created_to: Optional[datetime.datetime] = None,
+    db: AsyncSession = Depends(database.get_read_db),
+):
+    """
+    Get a page of orders, newest first, along with user details, addresses,
+    and order items.
+    """
+    query = select(models.Order).options(*ORDER_RESPONSE_LOADERS)
+    if order_status:
+        query = query.filter(models.Order.status == order_status)
+    if created_from:
+        query = query.filter(models.Order.created_at >= created_from)
+    if created_to:
+        query = query.filter(models.Order.created_at < created_to)
+
+    orders, next_cursor, prev_cursor = await keyset_page(
+        db, query, models.Order.created_at, models.Order.id, limit, after=after, before=before
+    )
+    return json_response(schemas.OrderResponsePage, schemas.OrderResponsePage(
+        items=[to_order_response(order) for order in orders],
+        next_cursor=next_cursor,
+        prev_cursor=prev_cursor,
+    ))
 
 
 @router.get("/orders/{order_id}", response_model=schemas.OrderResponse)
-def get_single_order(order_id: int, db: Session = Depends(database.get_db)):
-    order = db.query(models.Order).filter(models.Order.id == order_id).first()
+async def get_single_order(order_id: int, db: AsyncSession = Depends(database.get_read_db)):
+    order = await db.scalar(select(models.Order).filter(models.Order.id == order_id).options(*ORDER_RESPONSE_LOADERS))
     if not order:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Order with ID {order_id} not found"
         )
-    return to_order_response(order, db)
+    return to_order_response(order)
 
 
 
 @router.put("/orders/{order_id}/status", response_model=schemas.OrderResponse)
-def update_order_status(
+async def update_order_status(
     order_id: int,
     request: schemas.UpdateStatusRequest,
-    db: Session = Depends(database.get_db)
+    db: AsyncSession = Depends(database.get_db)
 ):
     """
     Updates the status of an order and logs the change if necessary.
     """
-    order = db.query(models.Order).filter(models.Order.id == order_id).first()
+    order = await db.scalar(select(models.Order).filter(models.Order.id == order_id).options(*ORDER_RESPONSE_LOADERS))
 
     if not order:
         raise HTTPException(
@@ -172,16 +278,249 @@ def update_order_status(
             detail=f"Invalid order status: {request.status}. Allowed statuses are: {list(schemas.OrderStatusEnum.__members__.keys())}",
         )
     order.status = request.status
-    db.commit()
-    db.refresh(order)
+    await db.commit()
+
+    return to_order_response(order)
+
+
+#-----------------------------------#
+#            ANALYTICS              #
+#-----------------------------------#
+
+def rollup_range(query, column, date_from: Optional[datetime.date], date_to: Optional[datetime.date]):
+    if date_from:
+        query = query.filter(column >= date_from)
+    if date_to:
+        query = query.filter(column < date_to)
+    return query
+
+
+@router.get("/analytics/sales", response_model=List[schemas.SalesBucket])
+async def get_sales_analytics(
+    granularity: str = Query("day", pattern="^(day|week|month)$"),
+    date_from: Optional[datetime.date] = None,
+    date_to: Optional[datetime.date] = None,
+    db: AsyncSession = Depends(database.get_read_db),
+):
+    """
+    Revenue, order count, average order value and units per day, week or
+    month, served from the daily sales rollup.
+    """
+    rows = (await db.scalars(
+        rollup_range(select(models.SalesDailyRollup), models.SalesDailyRollup.day, date_from, date_to)
+        .order_by(models.SalesDailyRollup.day)
+    )).all()
+
+    buckets = {}
+    for row in rows:
+        bucket = buckets.setdefault(bucket_start(row.day, granularity), {"revenue": 0.0, "order_count": 0, "units": 0})
+        bucket["revenue"] += row.revenue
+        bucket["order_count"] += row.order_count
+        bucket["units"] += row.units
+
+    return [
+        schemas.SalesBucket(
+            period_start=period_start,
+            average_order_value=values["revenue"] / values["order_count"] if values["order_count"] else 0.0,
+            **values,
+        )
+        for period_start, values in buckets.items()
+    ]
+
+
+@router.get("/analytics/products", response_model=List[schemas.ProductSales])
+async def get_product_analytics(
+    date_from: Optional[datetime.date] = None,
+    date_to: Optional[datetime.date] = None,
+    limit: int = Query(50, ge=1, le=500),
+    db: AsyncSession = Depends(database.get_read_db),
+    loaders: Loaders = Depends(get_loaders),
+):
+    """
+    Best selling products by revenue, served from the product daily rollup.
+    """
+    rollup = models.ProductDailyRollup
+    revenue = func.sum(rollup.revenue).label("revenue")
+    rows = (await db.execute(
+        rollup_range(
+            select(
+                rollup.product_id,
+                func.max(rollup.category_id).label("category_id"),
+                revenue,
+                func.sum(rollup.order_count).label("order_count"),
+                func.sum(rollup.units).label("units"),
+            ),
+            rollup.day, date_from, date_to,
+        )
+        .group_by(rollup.product_id)
+        .order_by(revenue.desc())
+        .limit(limit)
+    )).all()
 
-    return to_order_response(order, db)
+    products = await loaders.products.load_many([row.product_id for row in rows])
+    return [
+        schemas.ProductSales(product_name=product.name if product else None, **row._mapping)
+        for row, product in zip(rows, products)
+    ]
+
+
+@router.get("/analytics/categories", response_model=List[schemas.CategorySales])
+async def get_category_analytics(
+    date_from: Optional[datetime.date] = None,
+    date_to: Optional[datetime.date] = None,
+    db: AsyncSession = Depends(database.get_read_db),
+    loaders: Loaders = Depends(get_loaders),
+):
+    """
+    Revenue per category, served from the product daily rollup.
+    """
+    rollup = models.ProductDailyRollup
+    revenue = func.sum(rollup.revenue).label("revenue")
+    rows = (await db.execute(
+        rollup_range(
+            select(
+                rollup.category_id,
+                revenue,
+                func.sum(rollup.order_count).label("order_count"),
+                func.sum(rollup.units).label("units"),
+            ),
+            rollup.day, date_from, date_to,
+        )
+        .group_by(rollup.category_id)
+        .order_by(revenue.desc())
+    )).all()
+
+    categories = await loaders.categories.load_many([row.category_id for row in rows])
+    return [
+        schemas.CategorySales(category_name=category.name if category else None, **row._mapping)
+        for row, category in zip(rows, categories)
+    ]
+
+
+@router.post("/analytics/refresh")
+async def refresh_analytics(admin: Principal = Depends(get_current_admin)):
+    """
+    Recomputes the rollups of every day with pending sales changes now.
+    """
+    return {"processed": await refresh_rollups()}
+
+
+@router.get("/db/pool")
+async def get_pool_status(admin: Principal = Depends(get_current_admin)):
+    """
+    Live connection pool state and checkout wait-time histogram per engine.
+    """
+    return [metrics.snapshot() for metrics in POOL_METRICS.values()]
+
+
+@router.get("/cache")
+async def get_cache_stats(admin: Principal = Depends(get_current_admin)):
+    """
+    Hit, miss and eviction counters of the in-process caches.
+    """
+    return [cache.stats() for cache in CACHES.values()]
+
+
+@router.get("/hashing")
+async def get_hashing_stats(admin: Principal = Depends(get_current_admin)):
+    """
+    Password hashing executor queue depth, cost and latency.
+    """
+    return hashing.stats.snapshot()
+
+
+@router.get("/outbox")
+async def get_outbox_status(db: AsyncSession = Depends(database.get_db), admin: Principal = Depends(get_current_admin)):
+    """
+    Email outbox message counts by status and the age of the oldest pending one.
+    """
+    return await outbox_status(db)
+
+
+@router.post("/outbox/drain")
+async def drain_email_outbox(admin: Principal = Depends(get_current_admin)):
+    """
+    Delivers every due outbox message now instead of waiting for the worker.
+    """
+    return {"attempted": await drain_outbox()}
+
+
+def to_campaign_response(campaign: models.NewsletterCampaign) -> schemas.Campaign:
+    response = schemas.Campaign.model_validate(campaign)
+    if campaign.send_seconds:
+        response.messages_per_second = campaign.sent_count / campaign.send_seconds
+    return response
+
+
+async def get_campaign_or_404(db: AsyncSession, campaign_id: int) -> models.NewsletterCampaign:
+    campaign = await db.get(models.NewsletterCampaign, campaign_id)
+    if not campaign:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Campaign not found")
+    return campaign
+
+
+@router.post("/newsletter/campaigns", response_model=schemas.Campaign)
+async def create_campaign(
+    data: schemas.CampaignCreate,
+    db: AsyncSession = Depends(database.get_db),
+    admin: Principal = Depends(get_current_admin),
+):
+    campaign = models.NewsletterCampaign(
+        name=data.name, subject=data.subject, body=data.body, status=models.CampaignStatus.DRAFT
+    )
+    db.add(campaign)
+    await db.commit()
+    await db.refresh(campaign)
+    return to_campaign_response(campaign)
+
+
+@router.get("/newsletter/campaigns", response_model=List[schemas.Campaign])
+async def get_campaigns(db: AsyncSession = Depends(database.get_db), admin: Principal = Depends(get_current_admin)):
+    campaigns = (await db.scalars(
+        select(models.NewsletterCampaign).order_by(models.NewsletterCampaign.id.desc())
+    )).all()
+    return [to_campaign_response(campaign) for campaign in campaigns]
+
+
+@router.get("/newsletter/campaigns/{campaign_id}", response_model=schemas.Campaign)
+async def get_campaign(campaign_id: int, db: AsyncSession = Depends(database.get_db), admin: Principal = Depends(get_current_admin)):
+    return to_campaign_response(await get_campaign_or_404(db, campaign_id))
+
+
+@router.post("/newsletter/campaigns/{campaign_id}/send", response_model=schemas.Campaign)
+async def send_newsletter_campaign(campaign_id: int, db: AsyncSession = Depends(database.get_db), admin: Principal = Depends(get_current_admin)):
+    """
+    Starts the campaign, or resumes it after the last checkpoint if it was
+    paused or interrupted.
+    """
+    campaign = await get_campaign_or_404(db, campaign_id)
+    if campaign.status == models.CampaignStatus.COMPLETED:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Campaign already completed")
+    if campaign_id in running_campaigns or lease_held_elsewhere(campaign):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Campaign is already sending")
+    await mark_running(db, campaign)
+    start_campaign(campaign_id)
+    return to_campaign_response(campaign)
+
+
+@router.post("/newsletter/campaigns/{campaign_id}/pause", response_model=schemas.Campaign)
+async def pause_newsletter_campaign(campaign_id: int, db: AsyncSession = Depends(database.get_db), admin: Principal = Depends(get_current_admin)):
+    """
+    Stops the campaign after the batch in flight has been checkpointed.
+    """
+    campaign = await get_campaign_or_404(db, campaign_id)
+    if campaign.status != models.CampaignStatus.RUNNING:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Campaign is not running")
+    campaign.status = models.CampaignStatus.PAUSED
+    await db.commit()
+    return to_campaign_response(campaign)
 
 
 @router.post("/contact", response_model=schemas.Message)
-def contact_form(data: schemas.ContactForm):
+async def contact_form(data: schemas.ContactForm, db: AsyncSession = Depends(database.get_db)):
     try:
-        send_contact_email(data.name, data.email, data.phone, data.message, data.inquiry_type)
+        queue_contact_email(db, data.name, data.email, data.phone, data.message, data.inquiry_type)
+        await db.commit()
         return {"message": "Contact form submitted successfully."}
     except Exception as e:
         raise HTTPException(status_code=500, detail="Failed to send contact form email.")
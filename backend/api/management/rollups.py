@@ -0,0 +1,200 @@
+import asyncio
+import datetime
+import itertools
+import os
+from collections import defaultdict
+from sqlalchemy import Date, and_, delete, event, func, insert, inspect, or_, select, union
+from sqlalchemy.orm import Session
+from database import models, db as database
+import dotenv
+
+dotenv.load_dotenv()
+
+# Change markers consumed per transaction
+ROLLUP_BATCH_SIZE = int(os.getenv("ROLLUP_BATCH_SIZE", "5000"))
+# Days recomputed per sales query
+ROLLUP_DAYS_PER_QUERY = int(os.getenv("ROLLUP_DAYS_PER_QUERY", "31"))
+ROLLUP_INTERVAL_SECONDS = float(os.getenv("ROLLUP_INTERVAL_SECONDS", "60"))
+
+WATERMARK_NAME = "sales"
+
+
+def sale_days(sale: models.SalesRecord):
+    # The day before and after an edit, or of an inserted or deleted sale
+    history = inspect(sale).attrs.date_of_sale.history
+    values = history.sum() if history.has_changes() else [sale.date_of_sale]
+    return {value.date() for value in values if value is not None}
+
+
+@event.listens_for(Session, "before_flush")
+def record_sales_changes(session, flush_context, instances):
+    for sale in itertools.chain(session.new, session.dirty, session.deleted):
+        if isinstance(sale, models.SalesRecord) and (sale not in session.dirty or session.is_modified(sale)):
+            session.add_all(models.SalesRollupChange(day=day) for day in sale_days(sale))
+
+
+@event.listens_for(Session, "do_orm_execute")
+def record_bulk_sales_changes(orm_execute_state):
+    if (
+        (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete)
+        and orm_execute_state.bind_mapper is models.SalesRecord.__mapper__
+    ):
+        orm_execute_state.session.add(models.SalesRollupChange(day=None))
+
+
+async def lock_rollups(db) -> models.RollupWatermark:
+    # FOR UPDATE keeps two workers from recomputing the same days at once
+    watermark = await db.scalar(
+        select(models.RollupWatermark)
+        .filter(models.RollupWatermark.name == WATERMARK_NAME)
+        .with_for_update()
+        .execution_options(populate_existing=True)
+    )
+    if watermark is None:
+        watermark = models.RollupWatermark(name=WATERMARK_NAME)
+        db.add(watermark)
+    watermark.updated_at = datetime.datetime.now()
+    return watermark
+
+
+def on_days(column, days):
+    return or_(*(
+        and_(column >= datetime.datetime.combine(day, datetime.time.min),
+             column < datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time.min))
+        for day in days
+    ))
+
+
+async def recompute_days(db, days: list):
+    """
+    Replaces the rollup rows of days with totals computed from the sales and
+    order items as they are now, so recomputing a day twice is harmless.
+    """
+    await db.execute(delete(models.SalesDailyRollup).filter(models.SalesDailyRollup.day.in_(days)))
+    await db.execute(delete(models.ProductDailyRollup).filter(models.ProductDailyRollup.day.in_(days)))
+    sales = (await db.execute(
+        select(models.SalesRecord.order_id, models.SalesRecord.date_of_sale, models.SalesRecord.price)
+        .filter(on_days(models.SalesRecord.date_of_sale, days))
+    )).all()
+    if not sales:
+        return
+
+    day_of_order = {sale.order_id: sale.date_of_sale.date() for sale in sales}
+    items = (await db.execute(
+        select(
+            models.OrderItem.order_id,
+            models.OrderItem.product_id,
+            models.Product.category_id,
+            models.OrderItem.quantity,
+            models.OrderItem.price,
+        )
+        .outerjoin(models.Product, models.Product.id == models.OrderItem.product_id)
+        .filter(models.OrderItem.order_id.in_(list(day_of_order)))
+    )).all()
+
+    daily = defaultdict(lambda: {"revenue": 0.0, "order_count": 0, "units": 0})
+    for sale in sales:
+        bucket = daily[sale.date_of_sale.date()]
+        bucket["revenue"] += sale.price
+        bucket["order_count"] += 1
+
+    per_product = defaultdict(lambda: {"revenue": 0.0, "orders": set(), "units": 0, "category_id": None})
+    for item in items:
+        if item.product_id is None:
+            continue
+        day = day_of_order[item.order_id]
+        quantity = item.quantity or 0
+        daily[day]["units"] += quantity
+        bucket = per_product[(day, item.product_id)]
+        bucket["revenue"] += item.price * quantity
+        bucket["units"] += quantity
+        bucket["orders"].add(item.order_id)
+        bucket["category_id"] = item.category_id
+
+    await db.execute(insert(models.SalesDailyRollup), [
+        {"day": day, **values} for day, values in daily.items()
+    ])
+    if per_product:
+        await db.execute(insert(models.ProductDailyRollup), [
+            {
+                "day": day,
+                "product_id": product_id,
+                "category_id": values["category_id"],
+                "revenue": values["revenue"],
+                "order_count": len(values["orders"]),
+                "units": values["units"],
+            }
+            for (day, product_id), values in per_product.items()
+        ])
+
+
+async def process_batch(db, batch_size: int = ROLLUP_BATCH_SIZE) -> int:
+    """
+    Recomputes the days named by the next batch of change markers and drops
+    those markers in the same transaction. Returns the number of markers
+    processed. Markers commit with the sales change itself, so a sale whose
+    transaction commits late is still picked up, and edits and deletes
+    through the ORM are reflected. Raw SQL writes and ON DELETE CASCADE
+    bypass the markers; insert a NULL-day marker after those.
+    """
+    await lock_rollups(db)
+    changes = (await db.execute(
+        select(models.SalesRollupChange.id, models.SalesRollupChange.day)
+        .order_by(models.SalesRollupChange.id)
+        .limit(batch_size)
+    )).all()
+    if not changes:
+        await db.rollback()
+        return 0
+
+    days = {change.day for change in changes}
+    if None in days:
+        # Every day that has sales or rollup rows, deduplicated by the database
+        days = set((await db.scalars(union(
+            select(func.date(models.SalesRecord.date_of_sale, type_=Date)),
+            select(models.SalesDailyRollup.day),
+            select(models.ProductDailyRollup.day),
+        ))).all())
+    days = sorted(days)
+    for i in range(0, len(days), ROLLUP_DAYS_PER_QUERY):
+        await recompute_days(db, days[i:i + ROLLUP_DAYS_PER_QUERY])
+
+    await db.execute(
+        delete(models.SalesRollupChange).filter(models.SalesRollupChange.id.in_([change.id for change in changes]))
+    )
+    await db.commit()
+    return len(changes)
+
+
+async def refresh_rollups(batch_size: int = ROLLUP_BATCH_SIZE) -> int:
+    """
+    Processes batches until the rollups have caught up with the sales table.
+    """
+    total = 0
+    async with database.session_scope() as db:
+        while True:
+            processed = await process_batch(db, batch_size)
+            total += processed
+            if processed < batch_size:
+                return total
+
+
+async def run_rollup_worker(interval: float = ROLLUP_INTERVAL_SECONDS):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await refresh_rollups()
+        except Exception as e:
+            print(f"Error refreshing sales rollups: {e}")
+
+
+def bucket_start(day: datetime.date, granularity: str) -> datetime.date:
+    if granularity == "week":
+        return day - datetime.timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    return day
+
+
+if __name__ == "__main__":
+    print(f"Processed {asyncio.run(refresh_rollups())} sales records")
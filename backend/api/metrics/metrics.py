@@ -0,0 +1,92 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+from database.db import READ_ROUTING
+from database.pool import POOL_METRICS
+from api.common.cache import CACHES
+from api.auth import hashing
+from api.auth.utils import Principal, get_current_admin
+
+router = APIRouter()
+
+
+def format_labels(labels: dict) -> str:
+    return ",".join(f'{key}="{value}"' for key, value in labels.items())
+
+
+def render_pool_metrics() -> list:
+    lines = [
+        "# TYPE db_pool_checked_out gauge",
+        "# TYPE db_pool_idle gauge",
+        "# TYPE db_pool_overflow gauge",
+        "# TYPE db_pool_checkouts_total counter",
+        "# TYPE db_pool_timeouts_total counter",
+        "# TYPE db_pool_invalidations_total counter",
+        "# TYPE db_pool_checkout_wait_seconds histogram",
+        "# TYPE db_queries_total counter",
+        "# TYPE db_query_seconds histogram",
+    ]
+    for name, metrics in POOL_METRICS.items():
+        snapshot = metrics.snapshot()
+        labels = format_labels({"engine": name})
+        for gauge in ("checked_out", "idle", "overflow"):
+            if snapshot[gauge] is not None:
+                lines.append(f"db_pool_{gauge}{{{labels}}} {snapshot[gauge]}")
+        lines.append(f"db_pool_checkouts_total{{{labels}}} {snapshot['checkouts']}")
+        lines.append(f"db_pool_timeouts_total{{{labels}}} {snapshot['timeouts']}")
+        lines.append(f"db_pool_invalidations_total{{{labels}}} {snapshot['invalidations']}")
+        for bucket in snapshot["wait_seconds"]["buckets"]:
+            bucket_labels = format_labels({"engine": name, "le": bucket["le"]})
+            lines.append(f"db_pool_checkout_wait_seconds_bucket{{{bucket_labels}}} {bucket['count']}")
+        lines.append(f"db_pool_checkout_wait_seconds_sum{{{labels}}} {snapshot['wait_seconds']['sum']}")
+        lines.append(f"db_pool_checkout_wait_seconds_count{{{labels}}} {snapshot['wait_seconds']['count']}")
+        lines.append(f"db_queries_total{{{labels}}} {snapshot['queries']}")
+        for bucket in snapshot["query_seconds"]["buckets"]:
+            bucket_labels = format_labels({"engine": name, "le": bucket["le"]})
+            lines.append(f"db_query_seconds_bucket{{{bucket_labels}}} {bucket['count']}")
+        lines.append(f"db_query_seconds_sum{{{labels}}} {snapshot['query_seconds']['sum']}")
+        lines.append(f"db_query_seconds_count{{{labels}}} {snapshot['query_seconds']['count']}")
+    lines.append("# TYPE db_read_sessions_total counter")
+    for target, count in READ_ROUTING.items():
+        lines.append(f"db_read_sessions_total{{{format_labels({'target': target})}}} {count}")
+    return lines
+
+
+def render_cache_metrics() -> list:
+    lines = ["# TYPE cache_entries gauge"]
+    counters = ("hits", "misses", "evictions", "expirations", "invalidations")
+    lines += [f"# TYPE cache_{counter}_total counter" for counter in counters]
+    for name, cache in CACHES.items():
+        stats = cache.stats()
+        labels = format_labels({"cache": name})
+        lines.append(f"cache_entries{{{labels}}} {stats['size']}")
+        for counter in counters:
+            lines.append(f"cache_{counter}_total{{{labels}}} {stats[counter]}")
+    return lines
+
+
+def render_hashing_metrics() -> list:
+    stats = hashing.stats
+    lines = [
+        "# TYPE password_hash_waiting gauge",
+        f"password_hash_waiting {stats.waiting}",
+        "# TYPE password_hash_running gauge",
+        f"password_hash_running {stats.running}",
+        "# TYPE password_hash_failures_total counter",
+        f"password_hash_failures_total {stats.failed}",
+        "# TYPE password_hash_seconds histogram",
+    ]
+    for bound, count in stats.latency.cumulative():
+        le = "+Inf" if bound == float("inf") else bound
+        lines.append(f"password_hash_seconds_bucket{{{format_labels({'le': le})}}} {count}")
+    lines.append(f"password_hash_seconds_sum {stats.latency.sum}")
+    lines.append(f"password_hash_seconds_count {stats.latency.count}")
+    return lines
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics(admin: Principal = Depends(get_current_admin)):
+    """
+    Prometheus text exposition of the process-local metrics. Admin only, like
+    the /management diagnostics: scrape it with an admin's bearer token.
+    """
+    return "\n".join(render_pool_metrics() + render_cache_metrics() + render_hashing_metrics()) + "\n"
@@ -0,0 +1,129 @@
+"""
+Per-item cost of serializing the large list responses, before and after the
+json_response fast path (api/common/responses.py).
+
+    python -m benchmarks.serialization --items 1000 --repeat 20
+
+"before" is what FastAPI does with a returned object and a response_model:
+validate it against the response field, dump it to Python, then encode it
+with the response class. For orders it also includes building the nested
+schemas by hand, as get_orders used to. "after" validates ORM objects (or
+takes already validated models) and encodes them in one TypeAdapter pass.
+No database is needed; the ORM objects are transient.
+"""
+import argparse
+import asyncio
+import datetime
+import time
+from typing import List
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from api.common.responses import json_response
+from database import models, schemas
+
+
+def make_orders(count: int, items_per_order: int = 3) -> list:
+    now = datetime.datetime.now()
+    category = models.Category(id=1, name="Shirts")
+    products = [
+        models.Product(id=i, name=f"Product {i}", description="A product", price=10.0 + i, image_url=None,
+                       category_id=1, category=category, created_at=now, updated_at=now)
+        for i in range(1, 11)
+    ]
+    return [
+        models.Order(
+            id=order_id, user_id=1, status=models.OrderStatus.CREATED, total_price=30.0, created_at=now, updated_at=now,
+            items=[
+                models.OrderItem(id=order_id * 10 + i, product=products[(order_id + i) % 10], quantity=1,
+                                 color="red", size=models.SizeEnum.M, price=10.0)
+                for i in range(items_per_order)
+            ],
+        )
+        for order_id in range(1, count + 1)
+    ]
+
+
+def build_orders_by_hand(orders: list) -> schemas.OrderPage:
+    # The nested construction get_orders used before json_response
+    return schemas.OrderPage(items=[
+        schemas.Order(
+            id=order.id,
+            user_id=order.user_id,
+            status=order.status.value,
+            total_price=order.total_price,
+            items=[
+                schemas.OrderItem(
+                    id=item.id,
+                    product=schemas.Product(
+                        id=item.product.id,
+                        name=item.product.name,
+                        description=item.product.description,
+                        price=item.product.price,
+                        created_at=item.product.created_at,
+                        updated_at=item.product.updated_at,
+                        category=schemas.Category(id=item.product.category.id, name=item.product.category.name),
+                    ),
+                    quantity=item.quantity,
+                    color=item.color,
+                    size=item.size.value,
+                    price=item.price,
+                )
+                for item in order.items
+            ],
+            created_at=order.created_at,
+            updated_at=order.updated_at,
+        )
+        for order in orders
+    ])
+
+
+async def fastapi_render(response_type, content, response_class) -> bytes:
+    field = create_response_field(name="response", type_=response_type)
+    return response_class(await serialize_response(field=field, response_content=content)).body
+
+
+def timed(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(count: int, repeat: int):
+    orders = make_orders(count)
+    # The catalog cache holds validated models, so that is what lists start from
+    products = [schemas.Product.model_validate(orders[i % len(orders)].items[0].product) for i in range(count)]
+
+    cases = {
+        "orders": {
+            "before (by hand + response_model + JSONResponse)":
+                lambda: asyncio.run(fastapi_render(schemas.OrderPage, build_orders_by_hand(orders), JSONResponse)),
+            "before (by hand + response_model + ORJSONResponse)":
+                lambda: asyncio.run(fastapi_render(schemas.OrderPage, build_orders_by_hand(orders), ORJSONResponse)),
+            "after (json_response from ORM)":
+                lambda: json_response(schemas.OrderPage, {"items": orders}, from_attributes=True).body,
+        },
+        "products": {
+            "before (response_model + JSONResponse)":
+                lambda: asyncio.run(fastapi_render(List[schemas.Product], products, JSONResponse)),
+            "after (json_response of cached models)":
+                lambda: json_response(List[schemas.Product], products).body,
+        },
+    }
+    for name, variants in cases.items():
+        print(f"{name} ({count} items, best of {repeat}):")
+        for label, fn in variants.items():
+            fn()
+            seconds = timed(fn, repeat)
+            print(f"  {label:52s} {seconds * 1e6 / count:8.2f} us/item")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time list response serialization per item.")
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    main(args.items, args.repeat)
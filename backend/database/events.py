@@ -0,0 +1,46 @@
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+
+def after_commit_of(*model_classes, snapshot=lambda target: target):
+    """
+    Decorator registering fn(changes) to run after any commit that inserted,
+    updated or deleted rows of model_classes. changes holds snapshot(target)
+    for every flushed instance, taken at flush time while it is still
+    loaded, and None for each bulk ORM insert/update/delete statement. Rolled
+    back changes are discarded.
+    """
+    def register(fn):
+        key = ("after_commit_of", fn.__module__, fn.__qualname__)
+        mappers = {model.__mapper__ for model in model_classes}
+
+        def record(mapper, connection, target):
+            session = object_session(target)
+            if session is not None:
+                session.info.setdefault(key, []).append(snapshot(target))
+
+        for model in model_classes:
+            for name in ("after_insert", "after_update", "after_delete"):
+                event.listen(model, name, record)
+
+        @event.listens_for(Session, "do_orm_execute")
+        def record_bulk(orm_execute_state):
+            if (
+                (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete)
+                and orm_execute_state.bind_mapper in mappers
+            ):
+                orm_execute_state.session.info.setdefault(key, []).append(None)
+
+        @event.listens_for(Session, "after_commit")
+        def dispatch(session):
+            changes = session.info.pop(key, None)
+            if changes:
+                fn(changes)
+
+        @event.listens_for(Session, "after_rollback")
+        def discard(session):
+            session.info.pop(key, None)
+
+        return fn
+
+    return register
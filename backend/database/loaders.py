@@ -0,0 +1,80 @@
+import asyncio
+from fastapi import Depends
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+from database import models, db as database
+
+
+class Loader:
+    """
+    Coalesces load(key) calls made within the same turn of the event loop
+    into one batch_fn(keys) call, and remembers every result for the life of
+    the loader. batch_fn returns {key: value}; keys it leaves out load as
+    None. Meant to live for one request.
+    """
+
+    def __init__(self, batch_fn, lock: asyncio.Lock):
+        self.batch_fn = batch_fn
+        self.lock = lock
+        self._futures = {}
+        self._queue = []
+        self._task = None
+
+    def load(self, key) -> asyncio.Future:
+        future = self._futures.get(key)
+        if future is None:
+            future = self._futures[key] = asyncio.get_running_loop().create_future()
+            self._queue.append(key)
+            if self._task is None:
+                self._task = asyncio.create_task(self.dispatch())
+        return future
+
+    async def load_many(self, keys) -> list:
+        return list(await asyncio.gather(*(self.load(key) for key in keys)))
+
+    async def dispatch(self):
+        # Give tasks scheduled alongside this one (asyncio.gather of
+        # coroutines) a turn to add their keys first
+        await asyncio.sleep(0)
+        # One session can only run one statement at a time, so batches of
+        # all loaders sharing it go one after the other.
+        async with self.lock:
+            keys, self._queue, self._task = self._queue, [], None
+            try:
+                found = await self.batch_fn(keys)
+            except Exception as e:
+                for key in keys:
+                    self._futures.pop(key).set_exception(e)
+                return
+        for key in keys:
+            self._futures[key].set_result(found.get(key))
+
+
+def by_id(db, model, *options):
+    async def batch(ids):
+        rows = (await db.scalars(select(model).filter(model.id.in_(ids)).options(*options))).all()
+        return {row.id: row for row in rows}
+    return batch
+
+
+class Loaders:
+    """
+    Per-request loaders over one session. Products are loaded without their
+    category; loading the categories through the same session lets
+    product.category resolve from the identity map without another query.
+    """
+
+    def __init__(self, db):
+        lock = asyncio.Lock()
+        self.products = Loader(by_id(db, models.Product), lock)
+        self.categories = Loader(by_id(db, models.Category), lock)
+        self.users = Loader(by_id(db, models.User, selectinload(models.User.role)), lock)
+
+    async def products_with_categories(self, ids) -> list:
+        products = await self.products.load_many(ids)
+        await self.categories.load_many({product.category_id for product in products if product and product.category_id})
+        return products
+
+
+async def get_loaders(db=Depends(database.get_read_db)) -> Loaders:
+    return Loaders(db)
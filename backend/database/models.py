@@ -1,14 +1,19 @@
 from sqlalchemy import (
+    DDL,
     Boolean,
     Column,
     ForeignKey,
     Integer,
     String,
+    Text,
     Float,
+    Date,
     DateTime,
     Enum,
+    Index,
 )
-from sqlalchemy.orm import relationship
+from sqlalchemy import event
+from sqlalchemy.orm import column_property, relationship
 from sqlalchemy.ext.declarative import declarative_base
 import datetime
 import enum
@@ -32,6 +37,19 @@ class OrderStatus(str, enum.Enum):
     CANCELLED = "CANCELLED"
 
 
+class OutboxStatus(str, enum.Enum):
+    PENDING = "PENDING"
+    SENT = "SENT"
+    FAILED = "FAILED"
+
+
+class CampaignStatus(str, enum.Enum):
+    DRAFT = "DRAFT"
+    RUNNING = "RUNNING"
+    PAUSED = "PAUSED"
+    COMPLETED = "COMPLETED"
+
+
 class Role(Base):
     __tablename__ = "roles"
 
@@ -73,6 +91,10 @@ class Address(Base):
 
     user = relationship("User", back_populates="address")
 
+    __table_args__ = (
+        Index("ix_address_user_id", "user_id"),
+    )
+
 
 class Category(Base):
     __tablename__ = "categories"
@@ -80,6 +102,8 @@ class Category(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, unique=True, index=True)
     description = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.now)
+    updated_at = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
 
     products = relationship("Product", back_populates="category", cascade="all, delete-orphan")
 
@@ -98,6 +122,27 @@ class Product(Base):
 
     category = relationship("Category", back_populates="products")
 
+    # Catalog listings filter by category and a price range
+    __table_args__ = (
+        Index("ix_products_category_id_price", "category_id", "price"),
+    )
+
+
+# Product search (api/account/search.py) on Postgres: a generated tsvector
+# over name and description with a GIN index, and a trigram index on name for
+# typo-tolerant matching. Not mapped on the model, since other databases have
+# no tsvector; migration 0005 adds the same objects to existing databases.
+PRODUCT_SEARCH_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "ALTER TABLE products ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(description, '')), 'B')) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_products_search_vector ON products USING gin (search_vector)",
+    "CREATE INDEX IF NOT EXISTS ix_products_name_trgm ON products USING gin (name gin_trgm_ops)",
+]
+for statement in PRODUCT_SEARCH_DDL:
+    event.listen(Product.__table__, "after_create", DDL(statement).execute_if(dialect="postgresql"))
+
 
 class Cart(Base):
     __tablename__ = "cart"
@@ -108,6 +153,11 @@ class Cart(Base):
     user = relationship("User", back_populates="cart")
     items = relationship("CartItem", back_populates="cart", cascade="all, delete-orphan")
 
+    # One cart per user, so concurrent first adds cannot create two
+    __table_args__ = (
+        Index("uq_cart_user_id", "user_id", unique=True),
+    )
+
 
 class CartItem(Base):
     __tablename__ = "cart_items"
@@ -122,6 +172,11 @@ class CartItem(Base):
     cart = relationship("Cart", back_populates="items")
     product = relationship("Product")
 
+    # Conflict target of the add-to-cart upsert
+    __table_args__ = (
+        Index("uq_cart_items_variant", "cart_id", "product_id", "color", "size", unique=True),
+    )
+
 
 class Order(Base):
     __tablename__ = "orders"
@@ -137,6 +192,13 @@ class Order(Base):
     items = relationship("OrderItem", back_populates="order", cascade="all, delete-orphan")
     sales_records = relationship("SalesRecord", back_populates="order", cascade="all, delete-orphan")
 
+    # Keyset pagination walks these newest first on (created_at, id)
+    __table_args__ = (
+        Index("ix_orders_created_at_id", "created_at", "id"),
+        Index("ix_orders_user_id_created_at_id", "user_id", "created_at", "id"),
+        Index("ix_orders_status_created_at_id", "status", "created_at", "id"),
+    )
+
 
 class OrderItem(Base):
     __tablename__ = 'order_items'
@@ -151,6 +213,12 @@ class OrderItem(Base):
     order = relationship("Order", back_populates="items")
     product = relationship("Product")
 
+    # Loading an order's items, and popularity/rollups grouping by product
+    __table_args__ = (
+        Index("ix_order_items_order_id", "order_id"),
+        Index("ix_order_items_product_id", "product_id"),
+    )
+
 
 class Wishlist(Base):
     __tablename__ = "wishlist"
@@ -161,6 +229,10 @@ class Wishlist(Base):
     user = relationship("User", back_populates="wishlist")
     items = relationship("WishlistItem", back_populates="wishlist", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        Index("uq_wishlist_user_id", "user_id", unique=True),
+    )
+
 
 class WishlistItem(Base):
     __tablename__ = "wishlist_items"
@@ -174,6 +246,10 @@ class WishlistItem(Base):
     wishlist = relationship("Wishlist", back_populates="items")
     product = relationship("Product")
 
+    __table_args__ = (
+        Index("uq_wishlist_items_variant", "wishlist_id", "product_id", "color", "size", unique=True),
+    )
+
 
 class SalesRecord(Base):
     __tablename__ = "sales"
@@ -181,16 +257,111 @@ class SalesRecord(Base):
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     order_id = Column(Integer, ForeignKey("orders.id", ondelete="CASCADE"), nullable=False)
-    date_of_sale = Column(DateTime, nullable=False)
+    # The old value is loaded on change so the rollups can recompute its day too
+    date_of_sale = column_property(Column(DateTime, nullable=False), active_history=True)
     buyer_name = Column(String, nullable=False)
     price = Column(Float, nullable=False)
 
     user = relationship("User", back_populates="sales_records")
     order = relationship("Order", back_populates="sales_records")
 
+    # One sales record per (user, order), checked by create_sales_record
+    __table_args__ = (
+        Index("uq_sales_user_id_order_id", "user_id", "order_id", unique=True),
+        Index("ix_sales_order_id", "order_id"),
+    )
+
 
 class NewsletterUser(Base):
     __tablename__ = "newsletter_users"
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     email = Column(String, unique=True, index=True)
     created_at = Column(DateTime, default=datetime.datetime.now)
+
+
+class NewsletterCampaign(Base):
+    __tablename__ = "newsletter_campaigns"
+
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    name = Column(String, nullable=False)
+    subject = Column(String, nullable=False)
+    # HTML with {{ email }} placeholders, rendered per subscriber
+    body = Column(Text, nullable=False)
+    status = Column(Enum(CampaignStatus, name="campaign_status_enum"), nullable=False, default=CampaignStatus.DRAFT)
+    # Checkpoint: subscribers are mailed in id order up to and including this one
+    last_subscriber_id = Column(Integer, nullable=False, default=0)
+    sent_count = Column(Integer, nullable=False, default=0)
+    failed_count = Column(Integer, nullable=False, default=0)
+    send_seconds = Column(Float, nullable=False, default=0)
+    last_error = Column(String, nullable=True)
+    # Sending lease: only the process named here sends, until the lease expires
+    lease_owner = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.now)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
+
+
+# Pre-aggregated analytics, maintained incrementally from the sales table by
+# api/management/rollups.py so dashboards never scan sales/orders/order_items.
+class SalesDailyRollup(Base):
+    __tablename__ = "sales_daily_rollup"
+
+    day = Column(Date, primary_key=True)
+    revenue = Column(Float, nullable=False, default=0)
+    order_count = Column(Integer, nullable=False, default=0)
+    units = Column(Integer, nullable=False, default=0)
+
+
+class ProductDailyRollup(Base):
+    __tablename__ = "product_daily_rollup"
+
+    day = Column(Date, primary_key=True)
+    product_id = Column(Integer, primary_key=True)
+    category_id = Column(Integer, nullable=True, index=True)
+    revenue = Column(Float, nullable=False, default=0)
+    order_count = Column(Integer, nullable=False, default=0)
+    units = Column(Integer, nullable=False, default=0)
+
+
+# One row per rollup, locked FOR UPDATE while a worker refreshes it
+class RollupWatermark(Base):
+    __tablename__ = "rollup_watermarks"
+
+    name = Column(String, primary_key=True)
+    updated_at = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
+
+
+# Days whose rollups are out of date. Written in the same transaction as the
+# sales change (see api/management/rollups.py), so a change becomes visible
+# to the rollup worker exactly when the sale itself does. day is NULL after
+# bulk statements, whose days are unknown: every day is recomputed.
+class SalesRollupChange(Base):
+    __tablename__ = "sales_rollup_changes"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    day = Column(Date, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.now)
+
+
+# Outgoing mail, written in the same transaction as the change that triggers
+# it and delivered by api/common/outbox.py.
+class EmailOutbox(Base):
+    __tablename__ = "email_outbox"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    recipient = Column(String, nullable=False)
+    subject = Column(String, nullable=False)
+    body = Column(Text, nullable=False)
+    subtype = Column(String, nullable=False, default="html")
+    status = Column(Enum(OutboxStatus, name="outbox_status_enum"), nullable=False, default=OutboxStatus.PENDING)
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.datetime.now)
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.now)
+    sent_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_email_outbox_status_next_attempt_at", "status", "next_attempt_at"),
+    )
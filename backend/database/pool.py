@@ -0,0 +1,191 @@
+import os
+import threading
+import time
+from sqlalchemy import event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+import dotenv
+
+dotenv.load_dotenv()
+
+# Connection pool sizing. Each engine (and each worker process) gets its own
+# pool, so the effective connection count is workers * (size + overflow).
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1").lower() not in ("0", "false", "no")
+
+# Upper bounds (seconds) of the checkout wait-time and query-time histogram buckets
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    def __init__(self, buckets=WAIT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def cumulative(self):
+        """
+        Returns (upper bound, cumulative count) pairs, ending with +Inf.
+        """
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class PoolMetrics:
+    def __init__(self, name: str):
+        self.name = name
+        self.engine = None
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.wait_time = Histogram()
+        self.queries = 0
+        self.query_time = Histogram()
+        # Pool events fire on whichever thread checks a connection in or out
+        self._lock = threading.Lock()
+
+    def increment(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def attach(self, engine):
+        self.engine = engine
+
+        @event.listens_for(engine, "connect")
+        def on_connect(dbapi_connection, connection_record):
+            self.increment("connects")
+
+        @event.listens_for(engine, "checkout")
+        def on_checkout(dbapi_connection, connection_record, connection_proxy):
+            self.increment("checkouts")
+
+        @event.listens_for(engine, "checkin")
+        def on_checkin(dbapi_connection, connection_record):
+            self.increment("checkins")
+
+        @event.listens_for(engine, "invalidate")
+        def on_invalidate(dbapi_connection, connection_record, exception):
+            self.increment("invalidations")
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def on_before_execute(conn, cursor, statement, parameters, context, executemany):
+            context._query_started = time.perf_counter()
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def on_after_execute(conn, cursor, statement, parameters, context, executemany):
+            self.increment("queries")
+            self.query_time.observe(time.perf_counter() - context._query_started)
+
+    def snapshot(self) -> dict:
+        pool = self.engine.pool if self.engine is not None else None
+        sized = isinstance(pool, QueuePool)
+        with self._lock:
+            counters = {
+                "connects": self.connects,
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "invalidations": self.invalidations,
+                "timeouts": self.timeouts,
+                "queries": self.queries,
+            }
+        return {
+            "engine": self.name,
+            "pool_class": type(pool).__name__ if pool is not None else None,
+            "size": pool.size() if sized else None,
+            "checked_out": pool.checkedout() if sized else counters["checkouts"] - counters["checkins"],
+            "idle": pool.checkedin() if sized else None,
+            "overflow": max(pool.overflow(), 0) if sized else None,
+            "max_overflow": MAX_OVERFLOW if sized else None,
+            "connects": counters["connects"],
+            "checkouts": counters["checkouts"],
+            "checkins": counters["checkins"],
+            "invalidations": counters["invalidations"],
+            "timeouts": counters["timeouts"],
+            "wait_seconds": histogram_snapshot(self.wait_time),
+            "queries": counters["queries"],
+            "query_seconds": histogram_snapshot(self.query_time),
+        }
+
+
+def histogram_snapshot(histogram: Histogram) -> dict:
+    with histogram._lock:
+        count, total, cumulative = histogram.count, histogram.sum, histogram.cumulative()
+    return {
+        "count": count,
+        "sum": total,
+        "buckets": [
+            {"le": "+Inf" if bound == float("inf") else bound, "count": bucket_count}
+            for bound, bucket_count in cumulative
+        ],
+    }
+
+
+# Engine name -> PoolMetrics, read by the admin and /metrics endpoints
+POOL_METRICS = {}
+
+
+def timed_pool_class(base, metrics: PoolMetrics):
+    """
+    Builds a pool class that records how long each checkout waited. The
+    class (not the instance) carries the metrics so they survive
+    engine.dispose(), which recreates the pool from self.__class__.
+    """
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return base.connect(self)
+        except exc.TimeoutError:
+            metrics.increment("timeouts")
+            raise
+        finally:
+            metrics.wait_time.observe(time.perf_counter() - start)
+
+    return type("Timed" + base.__name__, (base,), {"connect": connect})
+
+
+def engine_options(url: str, name: str) -> dict:
+    """
+    Returns the create_engine/create_async_engine keyword arguments for url
+    and registers a PoolMetrics under name. Sizing only applies when the
+    dialect uses a QueuePool (not e.g. NullPool or in-memory SQLite).
+    """
+    metrics = POOL_METRICS[name] = PoolMetrics(name)
+    parsed = make_url(url)
+    base = parsed.get_dialect().get_pool_class(parsed)
+
+    options = {"pool_pre_ping": POOL_PRE_PING, "pool_recycle": POOL_RECYCLE}
+    if issubclass(base, QueuePool):
+        options.update(
+            poolclass=timed_pool_class(base, metrics),
+            pool_size=POOL_SIZE,
+            max_overflow=MAX_OVERFLOW,
+            pool_timeout=POOL_TIMEOUT,
+        )
+    return options
+
+
+def instrument(engine, name: str):
+    POOL_METRICS[name].attach(getattr(engine, "sync_engine", engine))
+    return engine
@@ -112,6 +112,22 @@ class Product(ProductBase):
         from_attributes = True
 
 
+class ProductSearchPage(BaseModel):
+    items: List[Product]
+    next_offset: Optional[int] = None
+
+
+class AutocompleteKindEnum(str, Enum):
+    PRODUCT = "product"
+    CATEGORY = "category"
+
+
+class AutocompleteSuggestion(BaseModel):
+    kind: AutocompleteKindEnum
+    id: int
+    text: str
+
+
 # CART AND ORDERING SCHEMAS #
 class CartItem(BaseModel):
     id: int
@@ -131,6 +147,17 @@ class Cart(BaseModel):
     class Config:
         from_attributes = True
 
+class CartLine(CartItem):
+    line_total: float
+
+class CartRead(BaseModel):
+    # None until the user first adds something
+    id: Optional[int] = None
+    user_id: int
+    items: List[CartLine]
+    item_count: int
+    total: float
+
 class OrderItem(BaseModel):
     id: Optional[int] = None
     product: Product 
@@ -198,16 +225,30 @@ class Order(BaseModel):
         from_attributes = True
 
 
+class OrderPage(BaseModel):
+    items: List[Order]
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+
+class OrderResponsePage(BaseModel):
+    items: List[OrderResponse]
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+
+
 class OrderItemCreate(BaseModel):
     product_id: int  
     quantity: int
     color: str
     size: SizeEnum
-    price: float 
+    # Ignored; line prices come from the catalog
+    price: Optional[float] = None
 
+# No status: new orders are always CREATED, and a status sent by the client
+# is ignored like any other unknown field
 class OrderCreate(BaseModel):
-    status: OrderStatusEnum
-    total_price: float
+    # Ignored; the total is computed from catalog prices
+    total_price: Optional[float] = None
     items: List[OrderItemCreate]
 
 
@@ -235,12 +276,41 @@ class Wishlist(BaseModel):
     class Config:
         from_attributes = True
 
+
+# BATCH CART/WISHLIST SCHEMAS #
+class BatchTargetEnum(str, Enum):
+    CART = "cart"
+    WISHLIST = "wishlist"
+
+class BatchOpEnum(str, Enum):
+    ADD = "add"
+    UPDATE = "update"
+    REMOVE = "remove"
+
+class CartBatchOperation(BaseModel):
+    target: BatchTargetEnum
+    op: BatchOpEnum
+    # add: product variant and, for the cart, quantity to add (default 1)
+    product_id: Optional[int] = None
+    color: Optional[str] = None
+    size: Optional[SizeEnum] = None
+    quantity: Optional[int] = None
+    # update (cart only, sets quantity) and remove: the line id
+    item_id: Optional[int] = None
+
+class CartBatchRequest(BaseModel):
+    operations: List[CartBatchOperation]
+
+class CartBatchResult(BaseModel):
+    cart: CartRead
+    wishlist: List[WishlistItemRead]
+
 class SalesRecordBase(BaseModel):
     user_id: int
     order_id: int
 
 class SalesRecordCreate(SalesRecordBase):
-    date_of_sale: datetime
+    date_of_sale: datetime.datetime
     buyer_name: str
     price: float
 
@@ -252,7 +322,7 @@ class SalesRecord(SalesRecordBase):
     id: int
     user: Optional["User"]
     order: Optional["Order"]
-    date_of_sale: datetime
+    date_of_sale: datetime.datetime
     buyer_name: str
     price: float
 
@@ -262,6 +332,30 @@ class SalesRecord(SalesRecordBase):
 
 
 
+# ANALYTICS SCHEMAS #
+class SalesBucket(BaseModel):
+    period_start: datetime.date
+    revenue: float
+    order_count: int
+    average_order_value: float
+    units: int
+
+class ProductSales(BaseModel):
+    product_id: int
+    product_name: Optional[str] = None
+    category_id: Optional[int] = None
+    revenue: float
+    order_count: int
+    units: int
+
+class CategorySales(BaseModel):
+    category_id: Optional[int] = None
+    category_name: Optional[str] = None
+    revenue: float
+    order_count: int
+    units: int
+
+
 class UpdateStatusRequest(BaseModel):
     status: OrderStatusEnum
 
@@ -275,6 +369,35 @@ class NewsletterUserSchema(BaseModel):
     class Config:
         from_attributes = True
 
+class CampaignStatusEnum(str, Enum):
+    DRAFT = "DRAFT"
+    RUNNING = "RUNNING"
+    PAUSED = "PAUSED"
+    COMPLETED = "COMPLETED"
+
+class CampaignCreate(BaseModel):
+    name: str
+    subject: str
+    body: str
+
+class Campaign(BaseModel):
+    id: int
+    name: str
+    subject: str
+    status: CampaignStatusEnum
+    last_subscriber_id: int
+    sent_count: int
+    failed_count: int
+    send_seconds: float
+    messages_per_second: Optional[float] = None
+    last_error: Optional[str] = None
+    created_at: datetime.datetime
+    started_at: Optional[datetime.datetime] = None
+    finished_at: Optional[datetime.datetime] = None
+
+    class Config:
+        from_attributes = True
+
 
 # REFERRAL SCHEMAS #
 class Referral(BaseModel):
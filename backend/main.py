@@ -1,12 +1,22 @@
+import asyncio
+import os
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from database import models, db as database
-from api.auth import auth
+from api.auth import auth, hashing, utils
 from api.account import account
+from api.account.typeahead import run_typeahead_refresh
 from api.management import management
+from api.management.rollups import run_rollup_worker
+from api.common import mailer
+from api.common.responses import COMPRESS_MINIMUM_SIZE, NegotiatedGZipMiddleware
+from api.common.outbox import run_outbox_worker
+from api.management.campaigns import resume_campaigns, stop_campaigns
+from api.metrics import metrics
 
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 
 models.Base.metadata.create_all(bind=database.engine)
@@ -26,9 +36,48 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Pins a client's reads to the primary for a few seconds after it writes,
+# when a read replica is configured
+app.add_middleware(database.ReadYourWritesMiddleware, token_subject=utils.token_subject)
+
+# Compresses the other large responses (order lists, exports, metrics).
+# The pre-encoded catalog listings pass through untouched.
+app.add_middleware(NegotiatedGZipMiddleware, minimum_size=COMPRESS_MINIMUM_SIZE)
+
 
 
 app.include_router(auth.router, prefix="/api/auth", tags=["auth"])
 app.include_router(account.router, prefix="/api/account", tags=["account"])
 app.include_router(management.router, prefix="/api/management", tags=["management"])
+# /metrics requires an admin bearer token, like the /api/management diagnostics
+app.include_router(metrics.router, tags=["metrics"])
+
+
+# Set BACKGROUND_WORKERS=0 to run the API without its periodic jobs (tests,
+# or when the jobs run in a dedicated process instead).
+BACKGROUND_WORKERS = os.getenv("BACKGROUND_WORKERS", "1").lower() not in ("0", "false", "no")
+background_tasks = []
+
+
+@app.on_event("startup")
+async def load_email_templates():
+    mailer.load_templates()
+
+
+@app.on_event("startup")
+async def start_background_workers():
+    if BACKGROUND_WORKERS:
+        background_tasks.append(asyncio.create_task(run_rollup_worker()))
+        background_tasks.append(asyncio.create_task(run_outbox_worker()))
+        background_tasks.append(asyncio.create_task(run_typeahead_refresh()))
+        await resume_campaigns()
+
 
+@app.on_event("shutdown")
+async def stop_background_workers():
+    for task in background_tasks:
+        task.cancel()
+    background_tasks.clear()
+    stop_campaigns()
+    hashing.shutdown_executor()
+    mailer.pool.close()
@@ -0,0 +1,36 @@
+"""order keyset pagination indexes
+
+The tables themselves are created by models.Base.metadata.create_all() on
+startup; this revision only adds what create_all() cannot add to tables
+that already exist.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 12:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index("ix_orders_created_at_id", "orders", ["created_at", "id"], if_not_exists=True)
+    op.create_index("ix_orders_user_id_created_at_id", "orders", ["user_id", "created_at", "id"], if_not_exists=True)
+    op.create_index("ix_orders_status_created_at_id", "orders", ["status", "created_at", "id"], if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_orders_status_created_at_id", table_name="orders")
+    op.drop_index("ix_orders_user_id_created_at_id", table_name="orders")
+    op.drop_index("ix_orders_created_at_id", table_name="orders")
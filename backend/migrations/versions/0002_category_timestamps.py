@@ -0,0 +1,40 @@
+"""category timestamps
+
+Categories get created_at/updated_at like products so the catalog version
+(used for product list ETags) changes when a category is edited.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 12:30:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, Sequence[str], None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    existing = {column["name"] for column in sa.inspect(op.get_bind()).get_columns("categories")}
+    for name in ("created_at", "updated_at"):
+        if name not in existing:
+            op.add_column("categories", sa.Column(name, sa.DateTime(), nullable=True))
+    op.execute(
+        "UPDATE categories SET created_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP "
+        "WHERE updated_at IS NULL"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table("categories") as batch_op:
+        batch_op.drop_column("updated_at")
+        batch_op.drop_column("created_at")
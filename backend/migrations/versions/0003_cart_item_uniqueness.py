@@ -0,0 +1,62 @@
+"""cart and cart item uniqueness
+
+One cart per user and one cart_items row per (cart, product, color, size),
+so adding to the cart can upsert. Existing duplicates are merged first:
+extra carts of a user hand their items to the oldest cart, and duplicate
+items are folded into the oldest row with their quantities summed.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 13:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, Sequence[str], None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+SAME_VARIANT = (
+    "d.cart_id = cart_items.cart_id AND d.product_id = cart_items.product_id "
+    "AND d.color = cart_items.color AND d.size = cart_items.size"
+)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute(
+        "UPDATE cart_items SET cart_id = ("
+        "  SELECT MIN(keep.id) FROM cart keep JOIN cart dup ON dup.user_id = keep.user_id"
+        "  WHERE dup.id = cart_items.cart_id"
+        ") WHERE cart_id IN ("
+        "  SELECT c.id FROM cart c WHERE c.id > (SELECT MIN(k.id) FROM cart k WHERE k.user_id = c.user_id)"
+        ")"
+    )
+    op.execute(
+        "DELETE FROM cart WHERE id > (SELECT MIN(k.id) FROM cart k WHERE k.user_id = cart.user_id)"
+    )
+    op.execute(
+        f"UPDATE cart_items SET quantity = (SELECT SUM(d.quantity) FROM cart_items d WHERE {SAME_VARIANT}) "
+        f"WHERE id = (SELECT MIN(d.id) FROM cart_items d WHERE {SAME_VARIANT}) "
+        f"AND EXISTS (SELECT 1 FROM cart_items d WHERE {SAME_VARIANT} AND d.id <> cart_items.id)"
+    )
+    op.execute(
+        f"DELETE FROM cart_items WHERE id > (SELECT MIN(d.id) FROM cart_items d WHERE {SAME_VARIANT})"
+    )
+    op.create_index("uq_cart_user_id", "cart", ["user_id"], unique=True, if_not_exists=True)
+    op.create_index(
+        "uq_cart_items_variant", "cart_items", ["cart_id", "product_id", "color", "size"],
+        unique=True, if_not_exists=True,
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("uq_cart_items_variant", table_name="cart_items")
+    op.drop_index("uq_cart_user_id", table_name="cart")
@@ -0,0 +1,57 @@
+"""wishlist and wishlist item uniqueness
+
+One wishlist per user and one wishlist_items row per (wishlist, product,
+color, size), so batch wishlist adds can insert with ON CONFLICT DO NOTHING.
+Existing duplicates are merged first: extra wishlists of a user hand their
+items to the oldest one, and duplicate items keep only the oldest row.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 13:30:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004'
+down_revision: Union[str, Sequence[str], None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+SAME_VARIANT = (
+    "d.wishlist_id = wishlist_items.wishlist_id AND d.product_id = wishlist_items.product_id "
+    "AND d.color = wishlist_items.color AND d.size = wishlist_items.size"
+)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute(
+        "UPDATE wishlist_items SET wishlist_id = ("
+        "  SELECT MIN(keep.id) FROM wishlist keep JOIN wishlist dup ON dup.user_id = keep.user_id"
+        "  WHERE dup.id = wishlist_items.wishlist_id"
+        ") WHERE wishlist_id IN ("
+        "  SELECT w.id FROM wishlist w WHERE w.id > (SELECT MIN(k.id) FROM wishlist k WHERE k.user_id = w.user_id)"
+        ")"
+    )
+    op.execute(
+        "DELETE FROM wishlist WHERE id > (SELECT MIN(k.id) FROM wishlist k WHERE k.user_id = wishlist.user_id)"
+    )
+    op.execute(
+        f"DELETE FROM wishlist_items WHERE id > (SELECT MIN(d.id) FROM wishlist_items d WHERE {SAME_VARIANT})"
+    )
+    op.create_index("uq_wishlist_user_id", "wishlist", ["user_id"], unique=True, if_not_exists=True)
+    op.create_index(
+        "uq_wishlist_items_variant", "wishlist_items", ["wishlist_id", "product_id", "color", "size"],
+        unique=True, if_not_exists=True,
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("uq_wishlist_items_variant", table_name="wishlist_items")
+    op.drop_index("uq_wishlist_user_id", table_name="wishlist")
@@ -0,0 +1,64 @@
+"""foreign key and lookup indexes
+
+Indexes for the foreign keys and filters the routes look rows up by that no
+existing index leads with: a user's address, an order's items, order items
+by product (popularity and rollups), catalog listings by category and price,
+and sales records by (user, order), unique since create_sales_record allows
+only one. Orders by user and by (status, created_at), carts and wishlists by
+user, and their items by cart/wishlist are already covered by the keyset
+and uniqueness indexes of 0001, 0003 and 0004.
+
+Data change: the unique (user, order) index cannot be built while duplicate
+sales records exist, so all but the oldest record of each pair are deleted.
+They cannot be merged, since each one is a full copy of the sale and summing
+them would double-count revenue. The deleted rows are copied to
+sales_duplicates_0006 first; downgrade() puts them back. Drop that table once
+the rows have been reviewed. 0008 rebuilds every sales rollup, which drops
+the removed rows from the analytics as well.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 14:30:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0006'
+down_revision: Union[str, Sequence[str], None] = '0005'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index("ix_address_user_id", "address", ["user_id"], if_not_exists=True)
+    op.create_index("ix_order_items_order_id", "order_items", ["order_id"], if_not_exists=True)
+    op.create_index("ix_order_items_product_id", "order_items", ["product_id"], if_not_exists=True)
+    op.create_index("ix_products_category_id_price", "products", ["category_id", "price"], if_not_exists=True)
+    duplicates = (
+        "id > ("
+        "  SELECT MIN(d.id) FROM sales d WHERE d.user_id = sales.user_id AND d.order_id = sales.order_id"
+        ")"
+    )
+    op.execute(f"CREATE TABLE sales_duplicates_0006 AS SELECT * FROM sales WHERE {duplicates}")
+    op.execute(f"DELETE FROM sales WHERE {duplicates}")
+    op.create_index("uq_sales_user_id_order_id", "sales", ["user_id", "order_id"], unique=True, if_not_exists=True)
+    op.create_index("ix_sales_order_id", "sales", ["order_id"], if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_sales_order_id", table_name="sales")
+    op.drop_index("uq_sales_user_id_order_id", table_name="sales")
+    if sa.inspect(op.get_bind()).has_table("sales_duplicates_0006"):
+        op.execute("INSERT INTO sales SELECT * FROM sales_duplicates_0006")
+        op.drop_table("sales_duplicates_0006")
+    op.drop_index("ix_products_category_id_price", table_name="products")
+    op.drop_index("ix_order_items_product_id", table_name="order_items")
+    op.drop_index("ix_order_items_order_id", table_name="order_items")
+    op.drop_index("ix_address_user_id", table_name="address")
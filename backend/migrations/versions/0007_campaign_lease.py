@@ -0,0 +1,67 @@
+"""newsletter campaign sending lease
+
+Adds lease_owner/lease_expires_at to newsletter_campaigns. A sender claims a
+RUNNING campaign by setting them in one conditional UPDATE, so when several
+worker processes resume campaigns at startup only one of them sends.
+newsletter_campaigns itself has no earlier migration (the app creates it on
+startup), so it is created here, lease columns included, when missing.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 15:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0007'
+down_revision: Union[str, Sequence[str], None] = '0006'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table("newsletter_campaigns"):
+        op.create_table(
+            "newsletter_campaigns",
+            sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+            sa.Column("name", sa.String(), nullable=False),
+            sa.Column("subject", sa.String(), nullable=False),
+            sa.Column("body", sa.Text(), nullable=False),
+            sa.Column(
+                "status",
+                sa.Enum("DRAFT", "RUNNING", "PAUSED", "COMPLETED", name="campaign_status_enum"),
+                nullable=False,
+            ),
+            sa.Column("last_subscriber_id", sa.Integer(), nullable=False),
+            sa.Column("sent_count", sa.Integer(), nullable=False),
+            sa.Column("failed_count", sa.Integer(), nullable=False),
+            sa.Column("send_seconds", sa.Float(), nullable=False),
+            sa.Column("last_error", sa.String(), nullable=True),
+            sa.Column("lease_owner", sa.String(), nullable=True),
+            sa.Column("lease_expires_at", sa.DateTime(), nullable=True),
+            sa.Column("created_at", sa.DateTime(), nullable=True),
+            sa.Column("started_at", sa.DateTime(), nullable=True),
+            sa.Column("finished_at", sa.DateTime(), nullable=True),
+            sa.Column("updated_at", sa.DateTime(), nullable=True),
+        )
+        op.create_index("ix_newsletter_campaigns_id", "newsletter_campaigns", ["id"])
+        return
+    existing = {column["name"] for column in inspector.get_columns("newsletter_campaigns")}
+    if "lease_owner" not in existing:
+        op.add_column("newsletter_campaigns", sa.Column("lease_owner", sa.String(), nullable=True))
+    if "lease_expires_at" not in existing:
+        op.add_column("newsletter_campaigns", sa.Column("lease_expires_at", sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table("newsletter_campaigns") as batch_op:
+        batch_op.drop_column("lease_expires_at")
+        batch_op.drop_column("lease_owner")
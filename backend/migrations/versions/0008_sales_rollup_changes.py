@@ -0,0 +1,61 @@
+"""sales rollup change markers
+
+The rollups were advanced by an id watermark over sales, which skipped a
+sale whose transaction committed after a higher id had been rolled up and
+never saw edits or deletes. Changes to sales now add a sales_rollup_changes
+row in the same transaction and the worker recomputes those days. A NULL-day
+marker is added here so the first run rebuilds every day, and the unused
+rollup_watermarks.last_id is dropped. rollup_watermarks has no earlier
+migration (the app creates it on startup), so it is created here, without
+last_id, when missing.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18 15:30:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0008'
+down_revision: Union[str, Sequence[str], None] = '0007'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table("sales_rollup_changes"):
+        op.create_table(
+            "sales_rollup_changes",
+            sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+            sa.Column("day", sa.Date(), nullable=True),
+            sa.Column("created_at", sa.DateTime(), nullable=True),
+        )
+    op.execute("INSERT INTO sales_rollup_changes (day, created_at) VALUES (NULL, CURRENT_TIMESTAMP)")
+    if not inspector.has_table("rollup_watermarks"):
+        op.create_table(
+            "rollup_watermarks",
+            sa.Column("name", sa.String(), primary_key=True),
+            sa.Column("updated_at", sa.DateTime(), nullable=True),
+        )
+    elif "last_id" in {column["name"] for column in inspector.get_columns("rollup_watermarks")}:
+        with op.batch_alter_table("rollup_watermarks") as batch_op:
+            batch_op.drop_column("last_id")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Rolled-up sales are not tracked by id any more; start the watermark over
+    with op.batch_alter_table("rollup_watermarks") as batch_op:
+        batch_op.add_column(sa.Column("last_id", sa.Integer(), nullable=False, server_default="0"))
+    inspector = sa.inspect(op.get_bind())
+    for table in ("sales_daily_rollup", "product_daily_rollup"):
+        if inspector.has_table(table):
+            op.execute(f"DELETE FROM {table}")
+    op.drop_table("sales_rollup_changes")
@@ -1,5 +1,19 @@
+import datetime as dt
+import email
+import itertools
+import os
 import pytest
+import re
+import socketserver
+import threading
 from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+os.environ.setdefault("BACKGROUND_WORKERS", "0")
+
 from main import app
 from database import models, db as database
 from api.auth.utils import *  # noqa: F403
@@ -7,6 +21,13 @@ from api.auth.utils import *  # noqa: F403
 client = TestClient(app)
 
 
+@pytest.fixture(scope="module", autouse=True)
+def app_client():
+    # Run every request on one event loop so pooled async connections stay valid
+    with client:
+        yield client
+
+
 @pytest.fixture(scope="module")
 def test_db():
     models.Base.metadata.create_all(bind=database.engine)
@@ -112,3 +133,946 @@ def test_forgot_password(test_db):
     assert response.status_code == 200, f"Response status code was {response.status_code} with response body {response.text}"
     assert response.json()["message"] == "If this email is registered, you will receive instructions to reset your password."
 
+
+_seed_ids = itertools.count()
+
+
+def seed_orders(db, count, items_per_order=2):
+    _, products = seed_products(db, *[10.0] * items_per_order)
+    for _ in range(count):
+        user = models.User(email=f"buyer{next(_seed_ids)}@example.com", full_name="Buyer", hashed_password="")
+        user.address = [models.Address(street_address="Street 1", city="City", postal_code="11000", country="RS")]
+        order = models.Order(user=user, status=models.OrderStatus.PENDING, total_price=10.0 * items_per_order)
+        order.items = [
+            models.OrderItem(product=product, quantity=1, color="black", size=models.SizeEnum.M, price=product.price)
+            for product in products
+        ]
+        db.add(order)
+    db.commit()
+
+
+def seed_products(db, *prices, description=""):
+    """
+    A fresh category with one product per price; returns (category, products).
+    """
+    category = models.Category(name=f"Category {next(_seed_ids)}")
+    products = [
+        models.Product(name=f"Product {next(_seed_ids)}", description=description, price=price, category=category)
+        for price in prices
+    ]
+    db.add_all(products)
+    db.commit()
+    return category, products
+
+
+def register_user(full_name="Customer"):
+    """
+    Registers and logs in a fresh user; returns (email, Authorization headers).
+    One /me request warms the principal cache, so query counts taken
+    afterwards do not include the user lookup.
+    """
+    email = f"{full_name.lower()}{next(_seed_ids)}@example.com"
+    client.post("/api/auth/register", json={"email": email, "password": "secret", "full_name": full_name})
+    token = client.post("/api/auth/login", data={"username": email, "password": "secret"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    client.get("/api/account/me", headers=headers)
+    return email, headers
+
+
+@pytest.fixture
+def customer(test_db):
+    return register_user()
+
+
+@pytest.fixture(scope="module")
+def admin_headers(test_db):
+    role = test_db.query(models.Role).filter(models.Role.name == ADMIN_ROLE).first() or models.Role(name=ADMIN_ROLE)
+    email, headers = register_user("Admin")
+    user = test_db.query(models.User).filter(models.User.email == email).one()
+    user.role = role
+    test_db.commit()
+    return headers
+
+
+def capture_queries(fn):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engines = [database.engine, database.async_engine.sync_engine]
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        fn()
+    finally:
+        for engine in engines:
+            event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    return statements
+
+
+def count_queries(fn):
+    return len(capture_queries(fn))
+
+
+def test_admin_order_list_query_count_is_flat(test_db):
+    seed_orders(test_db, 3)
+    response = client.get("/api/management/orders?limit=100")
+    assert response.status_code == 200
+    small = count_queries(lambda: client.get("/api/management/orders?limit=100"))
+
+    seed_orders(test_db, 30)
+    response = client.get("/api/management/orders?limit=100")
+    assert response.status_code == 200
+    orders = response.json()["items"]
+    assert len(orders) >= 33
+    assert all(order["address"] is not None for order in orders[:30])
+    large = count_queries(lambda: client.get("/api/management/orders?limit=100"))
+
+    assert small == large
+
+
+def test_pool_snapshot_reports_checkouts_idle_and_wait_times(test_db, monkeypatch, admin_headers):
+    from database import pool
+    # The sync engine has a QueuePool on SQLite files (aiosqlite uses NullPool)
+    monkeypatch.setattr(database, "DB_ASYNC", False)
+
+    def snapshot():
+        return next(entry for entry in client.get("/api/management/db/pool", headers=admin_headers).json() if entry["engine"] == "primary")
+
+    assert client.get("/api/management/db/pool").status_code == 401
+    before = snapshot()
+    for _ in range(3):
+        assert client.get("/api/management/orders?limit=5").status_code == 200
+    after = snapshot()
+
+    assert after["pool_class"].startswith("Timed") and after["size"] == pool.POOL_SIZE
+    assert after["checkouts"] >= before["checkouts"] + 3
+    assert after["checkins"] >= before["checkins"] + 3
+    assert 1 <= after["idle"] <= after["size"]
+    # Every checkout goes through the timed connect()
+    assert after["wait_seconds"]["count"] >= before["wait_seconds"]["count"] + 3
+    buckets = [bucket["count"] for bucket in after["wait_seconds"]["buckets"]]
+    assert buckets == sorted(buckets) and buckets[-1] == after["wait_seconds"]["count"]
+
+    # Counters are updated from many threads at once
+    metrics = pool.PoolMetrics("test")
+    threads = [threading.Thread(target=lambda: [metrics.increment("checkouts") for _ in range(10000)]) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert metrics.checkouts == 80000
+
+
+def test_admin_order_keyset_pagination(test_db):
+    seed_orders(test_db, 12, items_per_order=1)
+    expected = [order["id"] for order in client.get("/api/management/orders?limit=100").json()["items"]]
+
+    seen, pages, cursor = [], [], None
+    while True:
+        url = "/api/management/orders?limit=5" + (f"&after={cursor}" if cursor else "")
+        page = client.get(url).json()
+        seen += [order["id"] for order in page["items"]]
+        pages.append(page)
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    assert seen == expected
+
+    # Stepping back from the last page returns the previous page unchanged
+    previous = client.get(f"/api/management/orders?limit=5&before={pages[-1]['prev_cursor']}").json()
+    assert [order["id"] for order in previous["items"]] == [order["id"] for order in pages[-2]["items"]]
+
+    response = client.get("/api/management/orders?after=not-a-cursor")
+    assert response.status_code == 400
+
+
+def test_order_export_streams_in_batches(test_db, monkeypatch, admin_headers):
+    from api.management import exports
+    monkeypatch.setattr(exports, "EXPORT_BATCH_SIZE", 4)
+    seed_orders(test_db, 10, items_per_order=1)
+    total = test_db.query(models.Order).count()
+
+    assert client.get("/api/management/export/orders").status_code == 401
+    assert client.get("/api/management/export/sales").status_code == 401
+
+    response = client.get("/api/management/export/orders?format=ndjson", headers=admin_headers)
+    assert response.status_code == 200
+    assert len(response.text.splitlines()) == total
+
+    response = client.get("/api/management/export/orders", headers=admin_headers)
+    lines = response.text.splitlines()
+    assert lines[0].startswith("id,user_id,user_email,status")
+    assert len(lines) == total + 1
+
+
+def test_sales_rollups_are_incremental(test_db, admin_headers):
+    seed_orders(test_db, 3, items_per_order=2)
+    orders = test_db.query(models.Order).order_by(models.Order.id.desc()).limit(3).all()
+    day = dt.datetime(2024, 3, 4, 12)
+    for order in orders[:2]:
+        test_db.add(models.SalesRecord(user_id=order.user_id, order_id=order.id, date_of_sale=day, buyer_name="Buyer", price=20.0))
+    test_db.commit()
+
+    assert client.post("/api/management/analytics/refresh").status_code == 401
+    assert client.post("/api/management/analytics/refresh", headers=admin_headers).json()["processed"] == 2
+    assert client.post("/api/management/analytics/refresh", headers=admin_headers).json()["processed"] == 0
+
+    test_db.add(models.SalesRecord(user_id=orders[2].user_id, order_id=orders[2].id, date_of_sale=day + dt.timedelta(days=1), buyer_name="Buyer", price=30.0))
+    test_db.commit()
+    assert client.post("/api/management/analytics/refresh", headers=admin_headers).json()["processed"] == 1
+
+    weekly = client.get("/api/management/analytics/sales?granularity=week&date_from=2024-03-01&date_to=2024-03-31").json()
+    assert weekly == [{"period_start": "2024-03-04", "revenue": 70.0, "order_count": 3, "average_order_value": 70.0 / 3, "units": 6}]
+
+    products = client.get("/api/management/analytics/products?date_from=2024-03-01&date_to=2024-03-31").json()
+    assert [product["units"] for product in products] == [3, 3]
+
+
+def test_sales_rollups_follow_late_commits_edits_and_deletes(test_db, admin_headers):
+    seed_orders(test_db, 3, items_per_order=1)
+    orders = test_db.query(models.Order).order_by(models.Order.id.desc()).limit(3).all()
+    day = dt.datetime(2024, 5, 6, 12)
+    client.post("/api/management/analytics/refresh", headers=admin_headers)
+    sales = [
+        models.SalesRecord(user_id=order.user_id, order_id=order.id, date_of_sale=day, buyer_name="Buyer", price=10.0)
+        for order in orders[:2]
+    ]
+    test_db.add(sales[1])
+    test_db.commit()
+    assert client.post("/api/management/analytics/refresh", headers=admin_headers).json()["processed"] == 1
+
+    # A lower id committed after a higher one was rolled up
+    sales[0].id = sales[1].id - 1000
+    test_db.add(sales[0])
+    test_db.commit()
+    sales[1].price = 25.0
+    test_db.commit()
+    client.post("/api/management/analytics/refresh", headers=admin_headers)
+    daily = client.get("/api/management/analytics/sales?date_from=2024-05-06&date_to=2024-05-07").json()
+    assert [(bucket["revenue"], bucket["order_count"]) for bucket in daily] == [(35.0, 2)]
+
+    # Moving a sale to another day and deleting one reach both days
+    sales[1].date_of_sale = day + dt.timedelta(days=1)
+    test_db.delete(sales[0])
+    test_db.commit()
+    assert client.post("/api/management/analytics/refresh", headers=admin_headers).json()["processed"] == 3
+    daily = client.get("/api/management/analytics/sales?date_from=2024-05-06&date_to=2024-05-08").json()
+    assert [(bucket["period_start"], bucket["revenue"]) for bucket in daily] == [("2024-05-07", 25.0)]
+
+    # A bulk statement leaves a NULL-day marker: every day is rebuilt
+    test_db.query(models.SalesRecord).filter(models.SalesRecord.id == sales[1].id).update({"price": 40.0})
+    test_db.commit()
+    assert test_db.query(models.SalesRollupChange).filter(models.SalesRollupChange.day.is_(None)).count() == 1
+    client.post("/api/management/analytics/refresh", headers=admin_headers)
+    daily = client.get("/api/management/analytics/sales?date_from=2024-05-06&date_to=2024-05-08").json()
+    assert [(bucket["period_start"], bucket["revenue"]) for bucket in daily] == [("2024-05-07", 40.0)]
+
+
+def test_catalog_cache_serves_hits_and_drops_on_write(test_db, admin_headers):
+    from api.account.catalog import catalog_cache
+    seed_orders(test_db, 1, items_per_order=1)
+    product = test_db.query(models.Product).order_by(models.Product.id.desc()).first()
+
+    assert client.get("/api/account/products").status_code == 200
+    assert count_queries(lambda: client.get("/api/account/products")) == 0
+    assert count_queries(lambda: client.get(f"/api/account/products/{product.id}")) > 0
+    assert count_queries(lambda: client.get(f"/api/account/products/{product.id}")) == 0
+
+    invalidations = catalog_cache.invalidations
+    product.price = 99.0
+    test_db.commit()
+    assert catalog_cache.invalidations == invalidations + 1
+    assert client.get(f"/api/account/products/{product.id}").json()["price"] == 99.0
+
+    assert client.get("/api/management/cache").status_code == 401
+    stats = {entry["cache"]: entry for entry in client.get("/api/management/cache", headers=admin_headers).json()}
+    assert stats["catalog"]["invalidations"] == catalog_cache.invalidations
+
+
+def test_catalog_version_expires_within_max_age(test_db):
+    from api.account.catalog import CATALOG_MAX_AGE, version_cache
+    seed_orders(test_db, 1, items_per_order=1)
+    product = test_db.query(models.Product).order_by(models.Product.id.desc()).first()
+    assert client.get(f"/api/account/products/{product.id}").status_code == 200
+    assert version_cache.ttl <= CATALOG_MAX_AGE
+
+    # A write committed by another worker does not reach this process's
+    # invalidation hooks; the listing follows once the version is re-read
+    other_worker = create_engine(database.engine.url.render_as_string(hide_password=False), poolclass=NullPool)
+    with other_worker.begin() as connection:
+        connection.execute(models.Product.__table__.update().where(models.Product.id == product.id).values(price=123.0))
+    other_worker.dispose()
+    assert client.get(f"/api/account/products/{product.id}").json()["price"] != 123.0
+    version_cache.invalidate()  # stands in for the version TTL running out
+    assert client.get(f"/api/account/products/{product.id}").json()["price"] == 123.0
+    test_db.expire_all()
+
+
+def test_catalog_etag_revalidation(test_db):
+    from api.account.catalog import invalidate_catalog
+    seed_orders(test_db, 1, items_per_order=1)
+    response = client.get("/api/account/products")
+    etag = response.headers["etag"]
+    assert "max-age" in response.headers["cache-control"]
+
+    # Only the catalog version is read to answer a conditional request
+    invalidate_catalog()
+    responses = []
+    statements = capture_queries(lambda: responses.append(client.get("/api/account/products", headers={"If-None-Match": etag})))
+    assert responses[0].status_code == 304
+    assert responses[0].content == b""
+    assert len(statements) == 1 and "count(" in statements[0]
+
+    product = test_db.query(models.Product).first()
+    product.name = "Renamed"
+    test_db.commit()
+    response = client.get("/api/account/products", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+
+
+def test_principal_cache_skips_users_query_and_drops_on_change(test_db, customer):
+    email, headers = customer
+
+    assert client.get("/api/account/me", headers=headers).status_code == 200
+    assert count_queries(lambda: client.get("/api/account/me", headers=headers)) == 0
+
+    user = test_db.query(models.User).filter(models.User.email == email).first()
+    user.full_name = "Renamed"
+    test_db.commit()
+    assert client.get("/api/account/me", headers=headers).json()["full_name"] == "Renamed"
+
+
+def test_login_rehashes_password_with_configured_cost(test_db, admin_headers):
+    from passlib.context import CryptContext
+    from api.auth import hashing
+
+    email = f"rehash{next(_seed_ids)}@example.com"
+    weak_hash = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4).hash("secret")
+    user = models.User(email=email, hashed_password=weak_hash, full_name="Rehash", is_active=True, role_id=2)
+    test_db.add(user)
+    test_db.commit()
+    completed = hashing.stats.completed
+
+    response = client.post("/api/auth/login", data={"username": email, "password": "secret"})
+    assert response.status_code == 200
+    assert hashing.stats.completed == completed + 1
+    test_db.refresh(user)
+    assert user.hashed_password != weak_hash
+    assert f"$2b${hashing.BCRYPT_ROUNDS:02d}$" in user.hashed_password
+    assert client.post("/api/auth/login", data={"username": email, "password": "secret"}).status_code == 200
+    assert client.post("/api/auth/login", data={"username": email, "password": "wrong"}).status_code == 401
+
+    # A hash job that raises counts as failed, not completed
+    completed, failed = hashing.stats.completed, hashing.stats.failed
+    with pytest.raises(ValueError):
+        client.portal.call(hashing.verify_password, "secret", "not-a-hash")
+    assert (hashing.stats.completed, hashing.stats.failed) == (completed, failed + 1)
+
+    assert client.get("/api/management/hashing").status_code == 401
+    assert client.get("/api/management/hashing", headers=admin_headers).json()["failed"] == hashing.stats.failed
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """
+    Minimal local SMTP stand-in that records delivered messages.
+    """
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        self.messages = []
+        super().__init__(("127.0.0.1", 0), SMTPSinkHandler)
+
+
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.wfile.write(b"220 sink\r\n")
+        recipients, data = [], None
+        for line in self.rfile:
+            if data is not None:
+                if line.rstrip(b"\r\n") == b".":
+                    self.server.messages.append((recipients, b"".join(data).decode()))
+                    recipients, data = [], None
+                    self.wfile.write(b"250 OK\r\n")
+                else:
+                    data.append(line)
+                continue
+            command = line.decode().strip().upper()
+            if command.startswith("RCPT TO:"):
+                recipients.append(line.decode().strip()[8:].strip("<> "))
+            if command == "DATA":
+                data = []
+                self.wfile.write(b"354 go ahead\r\n")
+            elif command == "QUIT":
+                self.wfile.write(b"221 bye\r\n")
+                return
+            else:
+                self.wfile.write(b"250 OK\r\n")
+
+
+@pytest.fixture
+def smtp_sink(monkeypatch):
+    from api.common import mailer
+
+    sink = SMTPSink()
+    threading.Thread(target=sink.serve_forever, daemon=True).start()
+    monkeypatch.setattr(mailer, "SMTP_HOST", "127.0.0.1")
+    monkeypatch.setattr(mailer, "SMTP_PORT", sink.server_address[1])
+    monkeypatch.setattr(mailer, "SMTP_SSL", False)
+    monkeypatch.setattr(mailer, "SMTP_USERNAME", None)
+    yield sink
+    mailer.pool.close()
+    sink.shutdown()
+    sink.server_close()
+
+
+def test_contact_form_is_delivered_through_outbox(test_db, smtp_sink, monkeypatch, admin_headers):
+    from api.common import mailer
+
+    assert client.post("/api/management/outbox/drain").status_code == 401
+    assert client.get("/api/management/outbox").status_code == 401
+    client.post("/api/management/outbox/drain", headers=admin_headers)
+    form = {"name": "Ana", "email": "ana@example.com", "phone": "1", "message": "Hi", "inquiry_type": "General"}
+    monkeypatch.setenv("RECIPIENT_EMAIL", "shop@example.com")
+
+    # SMTP being down does not fail the request; the message waits in the outbox
+    monkeypatch.setattr(mailer, "SMTP_PORT", 1)
+    assert client.post("/api/management/contact", json=form).status_code == 200
+    assert client.post("/api/management/outbox/drain", headers=admin_headers).json()["attempted"] == 1
+    message = test_db.query(models.EmailOutbox).order_by(models.EmailOutbox.id.desc()).first()
+    assert (message.status, message.attempts) == (models.OutboxStatus.PENDING, 1)
+    assert message.next_attempt_at > dt.datetime.now()
+
+    monkeypatch.setattr(mailer, "SMTP_PORT", smtp_sink.server_address[1])
+    message.next_attempt_at = dt.datetime.now()
+    test_db.commit()
+    assert client.post("/api/management/outbox/drain", headers=admin_headers).json()["attempted"] == 1
+    test_db.refresh(message)
+    assert (message.status, message.attempts) == (models.OutboxStatus.SENT, 2)
+    assert len(smtp_sink.messages) == 1
+    recipients, data = smtp_sink.messages[0]
+    assert recipients == ["shop@example.com"]
+    assert "New Contact Form Submission - General" in data
+
+
+def test_referrals_are_batched_over_pooled_connections(test_db, smtp_sink, admin_headers):
+    from api.common import mailer
+
+    client.post("/api/management/outbox/drain", headers=admin_headers)
+    mailer.pool.close()
+    connects = mailer.pool.connects
+    referrals = [{"name": f"Friend {i}", "email": f"friend{i}@example.com"} for i in range(50)]
+
+    assert client.post("/api/account/referrals", json={"referrals": referrals}).status_code == 200
+    assert client.post("/api/management/outbox/drain", headers=admin_headers).json()["attempted"] == 50
+
+    assert sorted(recipients[0] for recipients, _ in smtp_sink.messages) == sorted(r["email"] for r in referrals)
+    assert mailer.pool.connects - connects <= mailer.SMTP_POOL_SIZE
+    bodies = [
+        email.message_from_string(data).get_payload()[0].get_payload(decode=True).decode()
+        for _, data in smtp_sink.messages
+    ]
+    assert any("Friend 7" in body for body in bodies)
+    assert not any("{{" in body for body in bodies)
+
+
+def test_newsletter_campaign_resumes_from_checkpoint(test_db, smtp_sink, monkeypatch, admin_headers):
+    import time
+    from api.management import campaigns
+
+    monkeypatch.setattr(campaigns, "CAMPAIGN_BATCH_SIZE", 4)
+    monkeypatch.setattr(campaigns, "CAMPAIGN_RATE_PER_SECOND", 1000)
+    batch = next(_seed_ids)
+    subscribers = [models.NewsletterUser(email=f"reader{batch}-{i}@example.com") for i in range(25)]
+    test_db.add_all(subscribers)
+    test_db.commit()
+
+    body = {"name": "Spring", "subject": "New arrivals", "body": "<p>Hello {{ email }}</p>"}
+    assert client.post("/api/management/newsletter/campaigns", json=body).status_code == 401
+    campaign = client.post("/api/management/newsletter/campaigns", json=body, headers=admin_headers).json()
+    assert campaign["status"] == "DRAFT"
+
+    # Interrupted after the tenth subscriber
+    row = test_db.get(models.NewsletterCampaign, campaign["id"])
+    row.status, row.last_subscriber_id = models.CampaignStatus.PAUSED, subscribers[9].id
+    test_db.commit()
+    remaining = test_db.query(models.NewsletterUser).filter(models.NewsletterUser.id > subscribers[9].id).count()
+
+    assert client.post(f"/api/management/newsletter/campaigns/{campaign['id']}/send", headers=admin_headers).status_code == 200
+    deadline = time.monotonic() + 10
+    while client.get(f"/api/management/newsletter/campaigns/{campaign['id']}", headers=admin_headers).json()["status"] != "COMPLETED":
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+    campaign = client.get(f"/api/management/newsletter/campaigns/{campaign['id']}", headers=admin_headers).json()
+    assert (campaign["sent_count"], campaign["failed_count"]) == (remaining, 0)
+    assert campaign["messages_per_second"] > 0
+    recipients = [recipients[0] for recipients, _ in smtp_sink.messages]
+    assert sorted(recipients) == sorted(subscriber.email for subscriber in subscribers[10:])
+    assert client.post(f"/api/management/newsletter/campaigns/{campaign['id']}/send", headers=admin_headers).status_code == 409
+
+
+def test_only_the_lease_holder_sends_a_campaign(test_db, smtp_sink, monkeypatch, admin_headers):
+    from api.management import campaigns
+
+    monkeypatch.setattr(campaigns, "CAMPAIGN_RATE_PER_SECOND", 1000)
+    batch = next(_seed_ids)
+    subscribers = [models.NewsletterUser(email=f"lease{batch}-{i}@example.com") for i in range(3)]
+    test_db.add_all(subscribers)
+    test_db.commit()
+    campaign = models.NewsletterCampaign(
+        name="Lease", subject="Hi", body="<p>Hi</p>", status=models.CampaignStatus.RUNNING,
+        last_subscriber_id=subscribers[0].id - 1,
+        lease_owner="other-host:1:abc", lease_expires_at=dt.datetime.now() + dt.timedelta(minutes=5),
+    )
+    test_db.add(campaign)
+    test_db.commit()
+
+    # Another worker holds the lease: neither a resume nor /send here mails anyone
+    client.portal.call(campaigns.send_campaign, campaign.id)
+    assert smtp_sink.messages == []
+    assert client.post(f"/api/management/newsletter/campaigns/{campaign.id}/send", headers=admin_headers).status_code == 409
+
+    # Its lease ran out (the process died), so this one takes over
+    campaign.lease_expires_at = dt.datetime.now() - dt.timedelta(seconds=1)
+    test_db.commit()
+    client.portal.call(campaigns.send_campaign, campaign.id)
+    test_db.refresh(campaign)
+    assert campaign.status == models.CampaignStatus.COMPLETED and campaign.lease_owner is None
+    assert len(smtp_sink.messages) == 3
+
+
+
+def test_create_order_prices_server_side_in_one_transaction(test_db, customer):
+    _, products = seed_products(test_db, 12.5, 30.0)
+    _, headers = customer
+
+    order = {"status": "DELIVERED", "total_price": 0.01, "items": [
+        {"product_id": products[0].id, "quantity": 2, "color": "black", "size": "M", "price": 0.01},
+        {"product_id": products[1].id, "quantity": 1, "color": "white", "size": "L"},
+    ]}
+    responses = []
+    statements = capture_queries(lambda: responses.append(client.post("/api/account/orders", json=order, headers=headers)))
+    assert responses[0].status_code == 200, responses[0].text
+    data = responses[0].json()
+    assert data["total_price"] == 55.0
+    assert data["status"] == "CREATED"
+    assert [item["price"] for item in data["items"]] == [12.5, 30.0]
+    # One product lookup, then one multi-row item insert
+    assert [statement.split()[2] for statement in statements if statement.startswith("INSERT")] == [
+        "orders", "order_items", "email_outbox",
+    ]
+    assert len([statement for statement in statements if statement.startswith("SELECT")]) == 1
+
+    saved = test_db.get(models.Order, data["plain_id"])
+    assert saved.total_price == 55.0 and len(saved.items) == 2
+    assert saved.status == models.OrderStatus.CREATED
+
+    order["items"][1]["product_id"] = 10 ** 9
+    assert client.post("/api/account/orders", json=order, headers=headers).status_code == 404
+
+
+def test_order_and_product_lists_keep_the_response_model_shape(test_db, customer):
+    # json_response must emit what FastAPI's response_model handling did
+    category, products = seed_products(test_db, 8.0, 3.5)
+    email, headers = customer
+    order = {"status": "CREATED", "total_price": 0, "items": [
+        {"product_id": product.id, "quantity": 1, "color": "black", "size": "M"} for product in products
+    ]}
+    assert client.post("/api/account/orders", json=order, headers=headers).status_code == 200
+
+    page = client.get("/api/account/orders", headers=headers).json()
+    assert set(page) == {"items", "next_cursor", "prev_cursor"}
+    assert set(page["items"][0]) == {"id", "user_id", "status", "total_price", "items", "created_at", "updated_at"}
+    assert set(page["items"][0]["items"][0]) == {"id", "product", "quantity", "color", "size", "price"}
+    assert set(page["items"][0]["items"][0]["product"]) == {
+        "id", "name", "description", "price", "image_url", "category", "created_at", "updated_at",
+    }
+    user = test_db.query(models.User).filter(models.User.email == email).one()
+    saved = test_db.query(models.Order).filter(models.Order.user_id == user.id).all()
+    assert page["items"] == [schemas.Order.model_validate(row, from_attributes=True).model_dump(mode="json") for row in saved]
+
+    listing = client.get(f"/api/account/products?category_id={category.id}").json()
+    assert sorted(listing, key=lambda product: product["id"]) == [
+        schemas.Product.model_validate(product, from_attributes=True).model_dump(mode="json") for product in products
+    ]
+    assert set(listing[0]["category"]) == {"id", "name", "description"}
+
+
+def test_add_to_cart_upserts_the_variant_line(test_db, customer):
+    _, (product,) = seed_products(test_db, 15.0)
+    email, headers = customer
+    product_data = client.get(f"/api/account/products/{product.id}").json()
+    line = {"id": 0, "product": product_data, "quantity": 1, "color": "black", "size": "M"}
+
+    first = client.post("/api/account/cart", json=line, headers=headers).json()
+    statements = capture_queries(lambda: client.post("/api/account/cart", json={**line, "quantity": 2}, headers=headers))
+    second = client.post("/api/account/cart", json=line, headers=headers).json()
+
+    assert second["id"] == first["id"] and second["quantity"] == 4
+    # upsert, then the response reload
+    assert [statement.split()[0] for statement in statements] == ["INSERT", "SELECT"]
+    user = test_db.query(models.User).filter(models.User.email == email).one()
+    assert test_db.query(models.Cart).filter(models.Cart.user_id == user.id).count() == 1
+    assert test_db.query(models.CartItem).join(models.Cart).filter(models.Cart.user_id == user.id).count() == 1
+
+    missing = client.post("/api/account/cart", json={**line, "product": {**product_data, "id": 10 ** 9}}, headers=headers)
+    assert missing.status_code == 404
+    assert test_db.query(models.CartItem).filter(models.CartItem.product_id == 10 ** 9).count() == 0
+
+
+def test_cart_read_is_one_query_with_totals(test_db, customer):
+    category, products = seed_products(test_db, 15.0, 4.5)
+    _, headers = customer
+
+    responses = []
+    statements = capture_queries(lambda: responses.append(client.get("/api/account/cart", headers=headers)))
+    assert responses[0].json() == {"id": None, "user_id": responses[0].json()["user_id"], "items": [], "item_count": 0, "total": 0.0}
+    assert [statement.split()[0] for statement in statements] == ["SELECT"]
+
+    for product, quantity in zip(products, (2, 3)):
+        line = {"id": 0, "product": client.get(f"/api/account/products/{product.id}").json(), "quantity": quantity, "color": "black", "size": "M"}
+        client.post("/api/account/cart", json=line, headers=headers)
+
+    responses.clear()
+    assert count_queries(lambda: responses.append(client.get("/api/account/cart", headers=headers))) == 1
+    cart = responses[0].json()
+    assert [item["line_total"] for item in cart["items"]] == [30.0, 13.5]
+    assert (cart["item_count"], cart["total"]) == (5, 43.5)
+    assert cart["items"][0]["product"]["category"]["id"] == category.id
+
+
+def test_cart_batch_applies_operations_in_one_commit(test_db, customer):
+    _, products = seed_products(test_db, 10.0, 2.5)
+    _, headers = customer
+    first, second = (product.id for product in products)
+
+    def add(target, product_id, quantity=None):
+        return {"target": target, "op": "add", "product_id": product_id, "color": "red", "size": "L", "quantity": quantity}
+
+    response = client.post("/api/account/cart/batch", json={"operations": [
+        add("cart", first, 1), add("cart", first, 2), add("cart", second, 1),
+        add("wishlist", first), add("wishlist", first),
+    ]}, headers=headers)
+    assert response.status_code == 200
+    cart = response.json()["cart"]
+    lines = {item["product"]["id"]: item for item in cart["items"]}
+    assert (lines[first]["quantity"], lines[second]["quantity"]) == (3, 1)
+    assert [item["product"]["id"] for item in response.json()["wishlist"]] == [first]
+
+    statements = capture_queries(lambda: client.post("/api/account/cart/batch", json={"operations": [
+        {"target": "cart", "op": "update", "item_id": lines[first]["id"], "quantity": 5},
+        {"target": "cart", "op": "remove", "item_id": lines[second]["id"]},
+        {"target": "cart", "op": "remove", "item_id": 10 ** 9},
+    ]}, headers=headers))
+    assert sum(statement.split()[0] in ("UPDATE", "DELETE") for statement in statements) == 2
+    cart = client.get("/api/account/cart", headers=headers).json()
+    assert [(item["product"]["id"], item["quantity"]) for item in cart["items"]] == [(first, 5)]
+
+    response = client.post("/api/account/cart/batch", json={"operations": [add("cart", 10 ** 9)]}, headers=headers)
+    assert response.status_code == 404
+    response = client.post("/api/account/cart/batch", json={"operations": [{"target": "wishlist", "op": "update", "item_id": 1, "quantity": 2}]}, headers=headers)
+    assert response.status_code == 400
+
+
+def test_product_search_pages_ranked_matches(test_db):
+    from sqlalchemy.dialects import postgresql
+    from api.account.search import postgres_search
+
+    marker = f"zq{next(_seed_ids)}"
+    category = models.Category(name=f"Category {next(_seed_ids)}")
+    test_db.add_all([
+        models.Product(name=f"Linen shirt {marker}", description="Light summer shirt", price=30.0, category=category),
+        models.Product(name=f"Wool coat {marker}", description="Pairs with a linen shirt", price=90.0, category=category),
+        models.Product(name=f"Denim jacket {marker}", description="Classic", price=60.0, category=category),
+    ])
+    test_db.commit()
+
+    page = client.get("/api/account/products/search", params={"q": f"shirt {marker}", "limit": 1}).json()
+    assert [item["name"] for item in page["items"]] == [f"Linen shirt {marker}"]
+    page = client.get("/api/account/products/search", params={"q": f"shirt {marker}", "limit": 1, "offset": page["next_offset"]}).json()
+    assert ([item["name"] for item in page["items"]], page["next_offset"]) == ([f"Wool coat {marker}"], None)
+    assert client.get("/api/account/products/search", params={"q": "  "}).status_code == 400
+
+    # Search pages live in their own cache and never evict catalog entries
+    from api.account.catalog import catalog_cache, search_cache
+    catalog_size = len(catalog_cache._entries)
+    for n in range(search_cache.maxsize + 1):
+        client.get("/api/account/products/search", params={"q": f"{marker} {n}"})
+    assert len(search_cache._entries) == search_cache.maxsize
+    assert len(catalog_cache._entries) == catalog_size
+
+    sql = str(postgres_search("linen shrit").compile(dialect=postgresql.dialect()))
+    assert "products.search_vector @@ websearch_to_tsquery" in sql
+    assert "products.name %% " in sql
+
+
+def test_autocomplete_ranks_by_popularity_and_follows_writes(test_db, customer):
+    marker = f"tq{next(_seed_ids)}"
+    category = models.Category(name=f"{marker} Shirts")
+    plain, popular = (models.Product(name=f"{marker} shirt {label}", description="", price=10.0, category=category) for label in ("plain", "popular"))
+    test_db.add_all([plain, popular])
+    test_db.commit()
+    _, headers = customer
+    client.post("/api/account/orders", json={"status": "CREATED", "items": [{"product_id": popular.id, "quantity": 3, "color": "red", "size": "M"}]}, headers=headers)
+
+    suggestions = client.get("/api/account/products/autocomplete", params={"q": marker}).json()
+    assert [(s["kind"], s["id"]) for s in suggestions] == [("product", popular.id), ("category", category.id), ("product", plain.id)]
+    assert count_queries(lambda: client.get("/api/account/products/autocomplete", params={"q": "SHIRT P"})) == 0
+
+    plain.name = f"{marker} blouse"
+    test_db.commit()
+    suggestions = client.get("/api/account/products/autocomplete", params={"q": f"{marker} blo"}).json()
+    assert [s["text"] for s in suggestions] == [f"{marker} blouse"]
+    assert client.get("/api/account/products/autocomplete", params={"q": f"{marker} shirt pl"}).json() == []
+
+
+def test_products_by_ids_in_one_query_with_missing_reported(test_db):
+    category, products = seed_products(test_db, 5.0, 5.0, 5.0)
+    wanted = [products[2].id, 10 ** 9, products[0].id, products[2].id]
+    client.get("/api/account/products", params={"ids": "1"})
+
+    responses = []
+    statements = capture_queries(lambda: responses.append(client.get("/api/account/products", params={"ids": ",".join(map(str, wanted))})))
+    assert [product["id"] for product in responses[0].json()] == [products[2].id, products[0].id]
+    assert responses[0].json()[0]["category"]["name"] == category.name
+    assert responses[0].headers["X-Missing-Ids"] == str(10 ** 9)
+    assert sum("FROM products" in statement for statement in statements) == 1
+    assert sum("FROM categories" in statement for statement in statements) == 1
+    assert client.get("/api/account/products", params={"ids": "1,x"}).status_code == 400
+
+
+def test_loader_coalesces_loads_into_one_batch():
+    import asyncio
+    from database.loaders import Loader
+
+    calls = []
+
+    async def batch(keys):
+        calls.append(sorted(keys))
+        return {key: key * 10 for key in keys if key != 3}
+
+    async def run():
+        loader = Loader(batch, asyncio.Lock())
+        first = await asyncio.gather(loader.load(1), loader.load(2), loader.load(1), loader.load_many([3, 2]))
+        second = await loader.load_many([2, 4])
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first == [10, 20, 10, [None, 20]]
+    assert second == [20, 40]
+    assert calls == [[1, 2, 3], [4]]
+
+
+def test_sparse_fieldsets_narrow_columns_and_payload(test_db, customer):
+    marker = f"Sparse {next(_seed_ids)}"
+    category = models.Category(name=marker)
+    product = models.Product(name=marker, description="x" * 500, price=12.0, image_url="a.png", category=category)
+    test_db.add(product)
+    test_db.commit()
+
+    category_id, product_id = category.id, product.id
+
+    responses = []
+    statements = capture_queries(lambda: responses.append(
+        client.get("/api/account/products", params={"category_id": category_id, "fields": "id,name,price,image_url"})
+    ))
+    assert responses[0].json() == [{"id": product_id, "name": marker, "price": 12.0, "image_url": "a.png"}]
+    products_select = next(statement for statement in statements if "\nFROM products \nWHERE" in statement)
+    assert "description" not in products_select
+    assert not any("categories.id IN" in statement for statement in statements)
+
+    nested = client.get("/api/account/products", params={"ids": str(product_id), "fields": "name,category.name"}).json()
+    assert nested == [{"name": marker, "category": {"name": marker}}]
+
+    _, headers = customer
+    client.post("/api/account/orders", json={"status": "CREATED", "items": [{"product_id": product_id, "quantity": 2, "color": "red", "size": "M"}]}, headers=headers)
+    client.post("/api/account/wishlist", json={"product_id": product_id, "color": "red", "size": "M"}, headers=headers)
+
+    page = client.get("/api/account/orders", params={"fields": "total_price,items.quantity,items.product.name"}, headers=headers).json()
+    assert page["items"] == [{"total_price": 24.0, "items": [{"quantity": 2, "product": {"name": marker}}]}]
+    statements = capture_queries(lambda: client.get("/api/account/orders", params={"fields": "id,status"}, headers=headers))
+    assert not any("FROM order_items" in statement for statement in statements)
+
+    wishlist = client.get("/api/account/wishlist", params={"fields": "product.price"}, headers=headers).json()
+    assert wishlist == [{"product": {"price": 12.0}}]
+    assert client.get("/api/account/products", params={"fields": "id,secret"}).status_code == 400
+
+
+def test_catalog_listing_is_served_pre_encoded(test_db):
+    category, _ = seed_products(test_db, *[1.0] * 20, description="d" * 200)
+    params = {"category_id": category.id}
+
+    client.get("/api/account/products", params=params)
+    responses = []
+    assert count_queries(lambda: responses.append(client.get("/api/account/products", params=params, headers={"Accept-Encoding": "gzip"}))) == 0
+    # The client decodes gzip itself
+    assert responses[0].headers["Content-Encoding"] == "gzip"
+    assert len(responses[0].json()) == 20
+
+    plain = client.get("/api/account/products", params=params, headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in plain.headers and len(plain.json()) == 20
+    refused = client.get("/api/account/products", params=params, headers={"Accept-Encoding": "gzip;q=0, br;q=0"})
+    assert "Content-Encoding" not in refused.headers
+    compressed = client.get("/api/account/products", params=params, headers={"Accept-Encoding": "gzip, br"})
+    assert compressed.headers["Content-Encoding"] == "br" and len(compressed.json()) == 20
+    # Equivalent bodies in different codings share one weak validator
+    assert compressed.headers["ETag"].startswith('W/"') and compressed.headers["ETag"] == plain.headers["ETag"]
+    revalidated = client.get("/api/account/products", params=params, headers={"Accept-Encoding": "br", "If-None-Match": plain.headers["ETag"]})
+    assert revalidated.status_code == 304
+
+    seed_orders(test_db, 5)
+    orders = client.get("/api/management/orders", headers={"Accept-Encoding": "gzip"})
+    assert orders.headers["Content-Encoding"] == "gzip" and orders.json()["items"]
+
+
+def full_scans(fn):
+    """
+    Tables read without an index by the SELECTs fn issues, from the query
+    plan of each statement run on its own connection just before it. Postgres
+    is told to avoid sequential scans, so small test tables still show
+    whether an index could serve the lookup.
+    """
+    tables = set(models.Base.metadata.tables)
+    scans = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if not statement.lstrip().upper().startswith("SELECT"):
+            return
+        if conn.dialect.name == "postgresql":
+            cursor.execute("SET enable_seqscan = off")
+            cursor.execute("EXPLAIN " + statement, parameters)
+            plan = [row[0] for row in cursor.fetchall()]
+            cursor.execute("RESET enable_seqscan")
+            found = [re.search(r"Seq Scan on (\w+)", line) for line in plan]
+        else:
+            cursor.execute("EXPLAIN QUERY PLAN " + statement, parameters)
+            plan = [row[-1] for row in cursor.fetchall()]
+            found = [re.fullmatch(r"SCAN (?:TABLE )?(\w+)", line) for line in plan]
+        scans.extend((match.group(1), statement) for match in found if match and match.group(1) in tables)
+
+    engines = [database.engine, database.async_engine.sync_engine]
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        fn()
+    finally:
+        for engine in engines:
+            event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    return scans
+
+
+def test_hot_lookups_use_indexes(test_db, customer):
+    seed_orders(test_db, 3)
+    order = test_db.query(models.Order).order_by(models.Order.id.desc()).first()
+    category_id = order.items[0].product.category_id
+    _, headers = customer
+    client.post("/api/account/address", json={"street_address": "Street 1", "city": "City", "postal_code": "11000", "country": "RS"}, headers=headers)
+    line = {"id": 0, "product": client.get(f"/api/account/products/{order.items[0].product_id}").json(), "quantity": 1, "color": "black", "size": "M"}
+    client.post("/api/account/cart", json=line, headers=headers)
+    client.post("/api/account/wishlist", json={"product_id": line["product"]["id"], "color": "black", "size": "M"}, headers=headers)
+    sale = {"user_id": order.user_id, "order_id": order.id, "date_of_sale": "2024-03-01T10:00:00", "buyer_name": "Buyer", "price": 20.0}
+
+    def hot_paths():
+        for path in ("/api/account/orders", "/api/account/cart", "/api/account/wishlist", "/api/account/address"):
+            assert client.get(path, headers=headers).status_code == 200
+        assert client.get("/api/account/products", params={"category_id": category_id, "min_price": 5}).status_code == 200
+        assert client.get("/api/management/orders", params={"status": "PENDING"}).status_code == 200
+        assert client.get(f"/api/management/orders/{order.id}").status_code == 200
+        assert client.post("/api/management/sales", json=sale).status_code == 200
+        assert client.post("/api/management/sales", json=sale).status_code == 400
+
+    assert full_scans(hot_paths) == []
+
+
+def test_reads_go_to_replica_except_after_own_writes(test_db, customer, admin_headers, tmp_path, monkeypatch):
+    _, headers = customer
+
+    # A second SQLite file stands in for a replica that has not caught up yet
+    replica_url = f"sqlite:///{tmp_path / 'replica.db'}"
+    replica = create_engine(replica_url, poolclass=NullPool)
+    models.Base.metadata.create_all(bind=replica)
+    monkeypatch.setattr(database, "ReplicaSessionLocal", sessionmaker(bind=replica, autoflush=False))
+    monkeypatch.setattr(database, "AsyncReplicaSessionLocal", async_sessionmaker(
+        bind=create_async_engine(database.to_async_url(replica_url), poolclass=NullPool), autoflush=False, expire_on_commit=False,
+    ))
+    monkeypatch.setattr(database, "_primary_until_by_subject", {})
+    client.cookies.clear()
+    routed = dict(database.READ_ROUTING)
+
+    try:
+        assert client.get("/api/account/address", headers=headers).status_code == 404
+        assert database.READ_ROUTING["replica"] == routed["replica"] + 1
+
+        address = {"street_address": "Street 1", "city": "City", "postal_code": "11000", "country": "RS"}
+        assert client.post("/api/account/address", json=address, headers=headers).status_code == 200
+        assert database.READ_PRIMARY_COOKIE in client.cookies
+        assert client.get("/api/account/address", headers=headers).json()["city"] == "City"
+        assert database.READ_ROUTING["primary"] == routed["primary"] + 1
+
+        # A cross-site client never sends the SameSite cookie back; its token
+        # subject still pins it, and nobody else
+        client.cookies.clear()
+        assert client.get("/api/account/address", headers=headers).json()["city"] == "City"
+        assert database.READ_ROUTING["primary"] == routed["primary"] + 2
+        client.cookies.set(database.READ_PRIMARY_COOKIE, "0")
+        assert client.get("/api/account/products").status_code == 200
+        assert database.READ_ROUTING["replica"] == routed["replica"] + 2
+
+        # A catalog write pins only the request that made it, not every reader
+        seed_products(test_db, 10.0)
+        assert client.get("/api/account/products").status_code == 200
+        assert database.READ_ROUTING["replica"] == routed["replica"] + 3
+
+        database._primary_until_by_subject.clear()
+        assert client.get("/api/account/address", headers=headers).status_code == 404
+    finally:
+        client.cookies.clear()
+        replica.dispose()
+
+    assert client.get("/metrics").status_code == 401
+    metrics = client.get("/metrics", headers=admin_headers).text
+    assert 'db_queries_total{engine="primary' in metrics and 'db_read_sessions_total{target="replica"}' in metrics
+
+
+def test_main_routes_run_on_threaded_sessions(test_db, monkeypatch):
+    # The DB_ASYNC=0 path: the same routers over a sync Session in the threadpool
+    from api.account.catalog import invalidate_catalog
+    opened = []
+
+    class CountingSession(database.ThreadedSession):
+        def __init__(self, session):
+            opened.append(self)
+            super().__init__(session)
+
+    monkeypatch.setattr(database, "DB_ASYNC", False)
+    monkeypatch.setattr(database, "ThreadedSession", CountingSession)
+    invalidate_catalog()
+
+    seed_orders(test_db, 2, items_per_order=1)
+    product = test_db.query(models.Product).order_by(models.Product.id.desc()).first()
+    # Registered here rather than by the customer fixture, so that register
+    # and login run over ThreadedSession as well
+    email, headers = register_user()
+
+    assert client.get("/api/account/me", headers=headers).json()["email"] == email
+    assert client.get("/api/account/products").status_code == 200
+    product_data = client.get(f"/api/account/products/{product.id}").json()
+    line = {"id": 0, "product": product_data, "quantity": 2, "color": "black", "size": "M"}
+    assert client.post("/api/account/cart", json=line, headers=headers).status_code == 200
+    assert client.get("/api/account/cart", headers=headers).json()["item_count"] == 2
+    wish = {"product_id": product.id, "color": "black", "size": "M"}
+    assert client.post("/api/account/wishlist", json=wish, headers=headers).status_code == 200
+    assert [item["product"]["id"] for item in client.get("/api/account/wishlist", headers=headers).json()] == [product.id]
+
+    order = {"status": "CREATED", "total_price": 0, "items": [{"product_id": product.id, "quantity": 1, "color": "black", "size": "M"}]}
+    created = client.post("/api/account/orders", json=order, headers=headers)
+    assert created.status_code == 200, created.text
+    orders = client.get("/api/account/orders", headers=headers).json()["items"]
+    assert [item["total_price"] for item in orders] == [product.price]
+    assert client.get("/api/management/orders?limit=5").status_code == 200
+    assert len(opened) >= 12
+